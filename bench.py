@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""Rough performance measurements for the hrbrt package. Run with:
+
+    python bench.py
+"""
+
+import io
+import os
+import sys
+import time
+import resource
+import tracemalloc
+import tempfile
+import multiprocessing
+import hrbrt.io as hio
+import hrbrt.parse as hps
+import hrbrt.run as hrun
+
+
+def make_document(numsections):
+    """Generates a valid document with the given number of sections,
+    each containing a text block and a choice block"""
+    lines = []
+    for i in range(numsections):
+        if i > 0:
+            lines.append("== Section %d ==" % i)
+            lines.append("")
+        lines.append(":: This is the text of section %d, which goes on for a" % i)
+        lines.append(":  little while so that it looks like a real document.")
+        lines.append("")
+        if i < numsections-1:
+            lines.append(":: [] Carry on to the next section -- Okay, GO TO section %d" % (i+1))
+            lines.append(":  [] Go back to the start  -- Fine. ")
+            lines.append(":                              GO TO section %d." % (i+1))
+            lines.append("")
+            lines.append("This line is feedback")
+            lines.append("")
+    return "\n".join(lines)+"\n"
+
+
+def timed(fn,*args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter()-start, result
+
+
+def bench_parse_scaling():
+    """Parse time should grow linearly with document size"""
+    print("Parse time by document size (combinator parser)")
+    base = None
+    for n in (100,200,400,800,1600):
+        text = make_document(n)
+        t,doc = timed(hio.HrbrtIO.read,io.StringIO(text),False,False)
+        perkb = t/(len(text)/1024.0)
+        if base is None: base = perkb
+        print("  %5d sections %8d bytes %8.3fs  %6.2fms/KB  x%.2f" % (
+            n, len(text), t, perkb*1000, perkb/base))
+
+
+def bench_packrat():
+    """Parse time with and without packrat memoization"""
+    print("Packrat memoization")
+    text = make_document(800)
+    t,doc = timed(hio.HrbrtIO.read,io.StringIO(text),False,False)
+    print("  off  %8.3fs" % t)
+    memo = hps.Memo()
+    t,doc = timed(hio.HrbrtIO.read,io.StringIO(text),memo,False)
+    print("  on   %8.3fs  hit rate %.1f%% (%d hits, %d misses)" % (
+        t, memo.hit_rate*100, memo.hits, memo.misses))
+
+
+def bench_line_tokenizer():
+    """Parse time of the line tokenizer against the combinator parser"""
+    print("Line tokenizer")
+    text = make_document(1600)
+    t,doc = timed(hio.HrbrtIO.read,io.StringIO(text),False,False)
+    print("  combinators  %8.3fs" % t)
+    t,doc = timed(hio.HrbrtIO.read,io.StringIO(text))
+    print("  tokenizer    %8.3fs" % t)
+
+
+def bench_generated_parser():
+    """Parse time of the parser generated from the grammar against the 
+    combinator parser and the line tokenizer"""
+    print("Generated parser")
+    text = make_document(1600)
+    t,doc = timed(hio.HrbrtIO.read,io.StringIO(text),False,False)
+    print("  combinators  %8.3fs" % t)
+    t,doc = timed(hio.HrbrtIO.read,io.StringIO(text),False,False,None,None,False,True)
+    print("  generated    %8.3fs" % t)
+    t,doc = timed(hio.HrbrtIO.read,io.StringIO(text))
+    print("  tokenizer    %8.3fs" % t)
+
+
+def bench_preparsed_read():
+    """Load time and size of pre-parsed JSON and binary documents against 
+    parsing the source"""
+    print("Pre-parsed readers")
+    text = make_document(1600)
+    t,doc = timed(hio.HrbrtIO.read,io.StringIO(text),False,False)
+    print("  combinators  %8.3fs  %8d bytes" % (t,len(text)))
+    t,doc = timed(hio.HrbrtIO.read,io.StringIO(text))
+    print("  tokenizer    %8.3fs" % t)
+    out = io.StringIO()
+    hio.JsonIO.write(doc,out)
+    t,r = timed(hio.JsonIO.read,io.StringIO(out.getvalue()))
+    print("  json         %8.3fs  %8d bytes" % (t,len(out.getvalue())))
+    out = io.BytesIO()
+    hio.BinaryIO.write(doc,out)
+    t,r = timed(hio.BinaryIO.read,io.BytesIO(out.getvalue()))
+    print("  binary       %8.3fs  %8d bytes" % (t,len(out.getvalue())))
+
+
+def bench_reparse():
+    """Time to re-parse after an edit in the middle of a document, against
+    reading the edited document again"""
+    print("Incremental re-parse")
+    text = make_document(1600)
+    doc = hio.HrbrtIO.read(io.StringIO(text))
+    offset = text.index("section 800,")
+    newtext = text[:offset]+"part"+text[offset+7:]
+    t,r = timed(hio.HrbrtIO.read,io.StringIO(newtext))
+    print("  read         %8.3fs" % t)
+    t,r = timed(hio.HrbrtIO.reparse,doc,text,offset,7,"part")
+    print("  reparse      %8.3fs" % t)
+
+
+def bench_parallel_parse():
+    """Parse time using a process pool of increasing size"""
+    print("Parallel parsing (%d CPUs)" % os.cpu_count())
+    text = make_document(6400)
+    for fast in (False,True):
+        for jobs in (None,2,4,8):
+            t,doc = timed(hio.HrbrtIO.read,io.StringIO(text),False,fast,None,jobs)
+            print("  %-11s %5s jobs %8.3fs" % ("tokenizer" if fast else "combinators",
+                jobs or 1,t))
+
+
+def bench_iter_sections():
+    """Time and peak traced memory of reading a document whole against 
+    reading it a section at a time"""
+    print("Streaming read")
+    text = make_document(6400)
+    for name,fn in (("read",lambda s: hio.HrbrtIO.read(s)),
+            ("iter_sections",lambda s: sum(1 for x in hio.HrbrtIO.iter_sections(s)))):
+        stream = io.StringIO(text)
+        tracemalloc.start()
+        t,r = timed(fn,stream)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("  %-14s %8.3fs  peak %6.1fMB" % (name,t,peak/1024.0/1024.0))
+        del r
+
+
+def bench_mapped_read():
+    """Time and peak traced memory of the combinator parser reading a file 
+    as text against reading it memory-mapped"""
+    print("Memory-mapped read (combinator parser)")
+    text = make_document(1600)
+    with tempfile.TemporaryDirectory() as d:
+        filename = os.path.join(d,"bench.hb")
+        with open(filename,"w") as f:
+            f.write(text)
+        for name,mode,mapped in (("text","r",False),("mmap","rb",True)):
+            with open(filename,mode) as f:
+                tracemalloc.start()
+                t,r = timed(hio.HrbrtIO.read,f,False,False,None,None,mapped)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            print("  %-5s %8.3fs  peak %6.1fMB" % (name,t,peak/1024.0/1024.0))
+            del r
+
+
+def _write_peak(fmt,doc,results):
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(os.devnull,"w") as out:
+        t,r = timed(getattr(hio,fmt).write,doc,out)
+    results.put((t,resource.getrusage(resource.RUSAGE_SELF).ru_maxrss-base))
+
+
+def bench_writers():
+    """Write time and peak RSS growth of each writer. The document is 
+    parsed once, then each writer runs in a forked process, whose peak 
+    RSS starts out as its size at the fork, writing to the null device"""
+    print("Writers")
+    text = make_document(6400)
+    doc = hio.HrbrtIO.read(io.StringIO(text))
+    print("  %d byte document" % len(text))
+    ctx = multiprocessing.get_context("fork")
+    for fmt in ("JsonIO","XmlIO","MarkdownIO","HrbrtIO"):
+        results = ctx.Queue()
+        p = ctx.Process(target=_write_peak,args=(fmt,doc,results))
+        p.start()
+        t,rss = results.get()
+        p.join()
+        print("  %-10s %8.3fs  peak RSS +%6.1fMB" % (fmt,t,rss/1024.0))
+
+
+def bench_step_runner():
+    """Time per step and traced memory per session of many readers 
+    stepping through one shared document in turn"""
+    print("Step runner")
+    doc = hio.HrbrtIO.read(io.StringIO(make_document(100)))
+    numsessions = 10000
+    tracemalloc.start()
+    states = [ hrun.StepRunner.start(doc) for i in range(numsessions) ]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    steps = 0
+    start = time.perf_counter()
+    while not states[0].is_ended:
+        for i,state in enumerate(states):
+            prompt = hrun.StepRunner.present(state)
+            states[i] = hrun.StepRunner.advance(state,
+                i%2 if isinstance(prompt,hrun.StepRunner.ChoicePrompt) else None)
+            steps += 1
+    t = time.perf_counter()-start
+    saved = len(repr(hrun.StepRunner.save(states[0])))
+    print("  %d sessions  %d steps  %6.2fus/step  %6d bytes/session  saved %d chars" % (
+        numsessions, steps, t/steps*1000000, size/numsessions, saved))
+
+
+BENCHMARKS = [
+    bench_parse_scaling,
+    bench_packrat,
+    bench_line_tokenizer,
+    bench_generated_parser,
+    bench_writers,
+    bench_preparsed_read,
+    bench_reparse,
+    bench_parallel_parse,
+    bench_iter_sections,
+    bench_mapped_read,
+    bench_step_runner,
+]
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:]
+    for b in BENCHMARKS:
+        if not names or b.__name__ in names:
+            b()
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""Generates hrbrt/genparse.py, a recursive descent parser for the grammar
+in syntax.bnf. Run with:
+
+    python generate.py
+
+whenever the grammar, or the actions below which build the parse tree
+from it, are changed."""
+
+import os
+import re
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GRAMMAR = os.path.join(HERE,"syntax.bnf")
+OUTPUT = os.path.join(HERE,"hrbrt","genparse.py")
+
+START = "Document"
+
+# Rules whose value is their matched text, stripped of whitespace
+TEXT_RULES = frozenset(["Name","LineText","ChoiceMarkerMark","ChoiceDescPart",
+    "ChoiceResponseDescPart"])
+
+# Functions building the value of other rules from their text and the
+# values of the rules within them, as the parse.*.parse methods do. A
+# rule without one passes on the values within it.
+ACTIONS = '''
+def _build_Document(data,start,end,values):
+    return hparse.Document(values,hparse.LineIndex(data))
+
+
+def _build_FirstSection(data,start,end,values):
+    content = values[0]
+    return hparse.FirstSection(content.items,content.feedback,start)
+
+
+def _build_Section(data,start,end,values):
+    name,content = values
+    return hparse.Section(name,content.items,content.feedback,start)
+
+
+def _build_SectionContent(data,start,end,values):
+    items = []
+    flines = []
+    for v in values:
+        if isinstance(v,hparse.FeedbackLine):
+            flines.append(v.text)
+            continue
+        if (isinstance(v,hparse.ChoiceBlock) and len(items) > 0
+                and isinstance(items[-1],hparse.ChoiceBlock)):
+            raise hparse.ValidationError("Consecutive choice blocks are not allowed. "
+                +"Separate with text block or instruction block")
+        items.append(v)
+        if not isinstance(v,hparse.ChoiceBlock) and v.feedback is not None:
+            flines.append(v.feedback)
+    return hparse.SectionContent(items," ".join(flines) if len(flines) > 0 else None)
+
+
+def _build_ChoiceBlock(data,start,end,values):
+    choices = []
+    flines = []
+    for v in values:
+        if isinstance(v,hparse.FeedbackLine):
+            flines.append(v.text)
+        else:
+            choices.append(v)
+            if v.feedback is not None:
+                flines.append(v.feedback)
+    return hparse.ChoiceBlock(choices," ".join(flines) if len(flines) > 0 else None,
+        start)
+
+
+def _line_block(blocktype,linetype,values):
+    tlines = [values[0].text]
+    flines = []
+    for v in values[1:]:
+        if isinstance(v,linetype):
+            tlines.append(v.text.strip())
+        else:
+            flines.append(v.text.strip())
+    return blocktype(" ".join(tlines)," ".join(flines) if len(flines) > 0 else None)
+
+
+def _build_InstructionBlock(data,start,end,values):
+    return _line_block(hparse.InstructionBlock,hparse.InstructionLine,values)
+
+
+def _build_TextBlock(data,start,end,values):
+    return _line_block(hparse.TextBlock,hparse.TextLine,values)
+
+
+def _build_TextLine(data,start,end,values):
+    return hparse.TextLine(values[0])
+
+
+def _build_FirstTextLine(data,start,end,values):
+    return hparse.FirstTextLine(values[0])
+
+
+def _build_InstructionLine(data,start,end,values):
+    return hparse.InstructionLine(values[0])
+
+
+def _build_FirstInstructionLine(data,start,end,values):
+    return hparse.FirstInstructionLine(values[0])
+
+
+def _build_FeedbackLine(data,start,end,values):
+    return hparse.FeedbackLine(values[0])
+
+
+def _build_Choice(data,start,end,values):
+    marker,content = values
+    return hparse.Choice(marker.mark,content.description,content.response,
+        content.goto,content.feedback,start)
+
+
+def _build_FirstChoice(data,start,end,values):
+    marker,content = values
+    return hparse.FirstChoice(marker.mark,content.description,content.response,
+        content.goto,content.feedback,start)
+
+
+def _build_ChoiceMarker(data,start,end,values):
+    return hparse.ChoiceMarker(values[0] if len(values) > 0 else None)
+
+
+def _build_ChoiceContent(data,start,end,values):
+    desc = values[0]
+    resp = values[1] if len(values) > 1 else None
+    fb = [f for f in (desc.feedback,resp.feedback if resp is not None else None)
+        if f is not None]
+    return hparse.ChoiceContent(desc.text,
+        resp.description if resp is not None else None,
+        resp.goto if resp is not None else None,
+        " ".join(fb) if len(fb) > 0 else None)
+
+
+def _parts(values):
+    parts = [v for v in values if isinstance(v,str)]
+    flines = [v.feedback for v in values
+        if isinstance(v,hparse.ChoiceDescNewline) and v.feedback is not None]
+    return " ".join(parts), " ".join(flines) if len(flines) > 0 else None
+
+
+def _build_ChoiceDescription(data,start,end,values):
+    return hparse.ChoiceDescription(*_parts(values))
+
+
+def _build_ChoiceResponseDesc(data,start,end,values):
+    return hparse.ChoiceResponseDesc(*_parts(values))
+
+
+def _build_ChoiceDescNewline(data,start,end,values):
+    return hparse.ChoiceDescNewline(" ".join(v.text for v in values)
+        if len(values) > 0 else None)
+
+
+def _build_ChoiceResponse(data,start,end,values):
+    desc = goto = None
+    flines = []
+    for v in values:
+        if isinstance(v,hparse.ChoiceResponseDesc):
+            desc = v
+        elif isinstance(v,hparse.ChoiceGoto):
+            goto = v
+        if v.feedback is not None:
+            flines.append(v.feedback)
+    return hparse.ChoiceResponse(
+        desc.text if desc is not None and len(desc.text) > 0 else None,
+        goto.secname if goto is not None else None,
+        " ".join(flines) if len(flines) > 0 else None)
+
+
+def _build_ChoiceGoto(data,start,end,values):
+    nl = values[0] if len(values) > 1 else None
+    return hparse.ChoiceGoto(values[-1],nl.feedback if nl is not None else None)
+'''
+
+HEADER = '''# Generated from syntax.bnf by generate.py. Do not edit.
+"""Recursive descent parser for Hrbrt, generated from the grammar. Gives
+the same parse tree as parse.Document.parse, without building combinator
+objects: each rule is a function taking the position to parse from and
+returning the position it parsed up to, or -1."""
+
+import re
+from . import parse as hparse
+
+'''
+
+PARSE = '''
+
+def parse(text):
+    """Parses the text, which must be followed by the end of input. Returns
+    the Document and None, or None and the furthest position examined if
+    it can't be parsed, as HrbrtIO does."""
+    data = text+chr(0)
+    out = []
+    furthest = 0
+'''
+
+PARSE_END = '''
+    end = _%s(0)
+    if end >= 0:
+        if end > furthest: furthest = end
+        if data[end] == chr(0):
+            return out[0], None
+    return None, furthest
+'''
+
+
+class GrammarError(Exception):
+    pass
+
+
+# Grammar expressions are tuples of a kind and its arguments:
+# ("chars",set), ("ref",name), ("seq",items), ("alt",items),
+# ("rep",item,minimum), ("opt",item) and ("not",item)
+
+_TOKEN = re.compile(r"""\s*(?:(?P<define>::=)|(?P<name>[A-Za-z]+)"""
+    r"""|(?P<literal>'(?:\\.|[^'\\])*')|(?P<op>[()|*+?!]))""")
+_ESCAPE = re.compile(r"\\(x[0-9A-Fa-f]{2}|.)")
+_ESCAPES = { "t": "\t", "r": "\r", "n": "\n" }
+
+
+def tokenize(source):
+    tokens = []
+    pos = 0
+    source = source.rstrip()
+    while pos < len(source):
+        m = _TOKEN.match(source,pos)
+        if m is None:
+            raise GrammarError("Unexpected text at %s" % repr(source[pos:pos+20]))
+        tokens.append((m.lastgroup,m.group(m.lastgroup)))
+        pos = m.end()
+    return tokens
+
+
+def _unescape(literal):
+    def sub(m):
+        e = m.group(1)
+        if e[0] == "x": return chr(int(e[1:],16))
+        return _ESCAPES.get(e,e)
+    return _ESCAPE.sub(sub,literal[1:-1])
+
+
+def _literal(literal):
+    text = _unescape(literal)
+    if len(text) == 1:
+        return ("chars",frozenset(text))
+    if len(text) == 3 and text[1] == "-":
+        return ("chars",frozenset(chr(c) for c in range(ord(text[0]),ord(text[2])+1)))
+    raise GrammarError("Literal %s isn't a character or range" % literal)
+
+
+class _GrammarParser(object):
+
+    _tokens = None
+    _pos = 0
+
+    def __init__(self,tokens):
+        self._tokens = tokens
+        self._pos = 0
+
+    def _peek(self,offset=0):
+        p = self._pos+offset
+        return self._tokens[p] if p < len(self._tokens) else (None,None)
+
+    def _take(self,kind,value=None):
+        token = self._peek()
+        if token[0] != kind or (value is not None and token[1] != value):
+            raise GrammarError("Expected %s but found %s" % (value or kind,token[1]))
+        self._pos += 1
+        return token[1]
+
+    def _at_rule_start(self):
+        return self._peek()[0] == "name" and self._peek(1)[0] == "define"
+
+    def rules(self):
+        rules = {}
+        while self._peek()[0] is not None:
+            name = self._take("name")
+            self._take("define")
+            if name in rules:
+                raise GrammarError("Rule %s defined twice" % name)
+            rules[name] = self._expression()
+        return rules
+
+    def _expression(self):
+        items = [self._sequence()]
+        while self._peek() == ("op","|"):
+            self._pos += 1
+            items.append(self._sequence())
+        return items[0] if len(items) == 1 else ("alt",items)
+
+    def _sequence(self):
+        items = []
+        while (self._peek()[0] is not None and self._peek()[1] not in ("|",")")
+                and not self._at_rule_start()):
+            items.append(self._prefixed())
+        if len(items) == 0:
+            raise GrammarError("Expected an expression but found %s" % self._peek()[1])
+        return items[0] if len(items) == 1 else ("seq",items)
+
+    def _prefixed(self):
+        if self._peek() == ("op","!"):
+            self._pos += 1
+            return ("not",self._prefixed())
+        item = self._primary()
+        while self._peek()[0] == "op" and self._peek()[1] in "*+?":
+            op = self._take("op")
+            item = ("opt",item) if op == "?" else ("rep",item,0 if op == "*" else 1)
+        return item
+
+    def _primary(self):
+        kind,value = self._peek()
+        if kind == "name":
+            self._pos += 1
+            return ("ref",value)
+        if kind == "literal":
+            self._pos += 1
+            return _literal(value)
+        self._take("op","(")
+        item = self._expression()
+        self._take("op",")")
+        return item
+
+
+def parse_grammar(source):
+    """Returns a dictionary of rule names to expressions for the given
+    BNF source"""
+    rules = _GrammarParser(tokenize(source)).rules()
+    for name,expr in rules.items():
+        for ref in _refs(expr):
+            if ref not in rules:
+                raise GrammarError("Rule %s refers to undefined rule %s" % (name,ref))
+    return rules
+
+
+def _refs(expr):
+    kind = expr[0]
+    if kind == "ref":
+        yield expr[1]
+    elif kind in ("seq","alt"):
+        for e in expr[1]:
+            for r in _refs(e): yield r
+    elif kind in ("rep","opt","not"):
+        for r in _refs(expr[1]): yield r
+
+
+def _simplify(expr):
+    """Merges adjacent single character alternatives into one set"""
+    kind = expr[0]
+    if kind in ("seq","alt"):
+        items = [_simplify(e) for e in expr[1]]
+        if kind == "alt":
+            merged = []
+            for e in items:
+                if e[0] == "chars" and len(merged) > 0 and merged[-1][0] == "chars":
+                    merged[-1] = ("chars",merged[-1][1]|e[1])
+                else:
+                    merged.append(e)
+            items = merged
+            if len(items) == 1: return items[0]
+        return (kind,items)
+    if kind == "rep":
+        return (kind,_simplify(expr[1]),expr[2])
+    if kind in ("opt","not"):
+        return (kind,_simplify(expr[1]))
+    return expr
+
+
+class Generator(object):
+    """Writes the parser module for the given rules. Each rule becomes a
+    function which, given a position, returns the position following its
+    match or -1. Rules with values, either from an action or from the
+    rules within them, append them to the out list, and a matching
+    function which only recognises the rule is generated for use in
+    lookaheads."""
+
+    _rules = None
+    _actions = None
+    _produces = None
+    _constants = None
+    _names = None
+    _temp = 0
+    _wanted = None
+
+    def __init__(self,rules,actions):
+        self._rules = dict((n,_simplify(e)) for n,e in rules.items())
+        self._actions = actions
+        self._produces = {}
+        self._constants = []
+        self._names = {}
+
+    def _rule_produces(self,name):
+        if name not in self._produces:
+            self._produces[name] = False
+            self._produces[name] = (name in self._actions or name in TEXT_RULES
+                or self._expr_produces(self._rules[name]))
+        return self._produces[name]
+
+    def _expr_produces(self,expr):
+        kind = expr[0]
+        if kind == "ref":
+            return self._rule_produces(expr[1])
+        if kind in ("seq","alt"):
+            return any(self._expr_produces(e) for e in expr[1])
+        if kind in ("rep","opt"):
+            return self._expr_produces(expr[1])
+        return False
+
+    def _constant(self,prefix,source):
+        if source not in self._names:
+            name = "_%s_%d" % (prefix,len(self._constants))
+            self._names[source] = name
+            self._constants.append("%s = %s" % (name,source))
+        return self._names[source]
+
+    def _charset(self,chars):
+        return self._constant("CHARS","frozenset(%s)" % repr("".join(sorted(chars))))
+
+    def _run(self,chars):
+        pattern = "[%s]*" % "".join("\\"+c if c in "\\]^-" else c for c in sorted(chars))
+        return self._constant("RUN","re.compile(%s)" % repr(pattern))
+
+    def _function_name(self,name,capture):
+        if capture and self._rule_produces(name):
+            return "_"+name
+        return "_is_"+name
+
+    def generate(self,start):
+        functions = []
+        wanted = [(start,True)]
+        done = set()
+        while len(wanted) > 0:
+            name,capture = wanted.pop(0)
+            capture = capture and self._rule_produces(name)
+            if (name,capture) in done: continue
+            done.add((name,capture))
+            functions.append(self._function(name,capture,wanted))
+
+        lines = [HEADER]
+        lines.extend(self._constants)
+        lines.append("")
+        lines.append(ACTIONS)
+        lines.append(PARSE)
+        for f in functions:
+            lines.extend("    "+l if l else "" for l in f)
+            lines.append("")
+        lines.append(PARSE_END % start)
+        return "\n".join(lines).rstrip()+"\n"
+
+    def _function(self,name,capture,wanted):
+        self._temp = 0
+        self._wanted = wanted
+        body = self._expr(self._rules[name],"p","q",capture)
+        lines = ["def %s(p):" % self._function_name(name,capture)]
+        if any("furthest" in l for l in body):
+            lines.append("    nonlocal furthest")
+        if capture and (name in self._actions or name in TEXT_RULES):
+            lines.append("    n = len(out)")
+            lines.extend("    "+l for l in body)
+            lines.append("    if q >= 0:")
+            if name in TEXT_RULES:
+                lines.append("        out.append(data[p:q].strip())")
+            else:
+                lines.append("        values = out[n:]")
+                lines.append("        del out[n:]")
+                lines.append("        out.append(_build_%s(data,p,q,values))" % name)
+        else:
+            lines.extend("    "+l for l in body)
+        lines.append("    return q")
+        return lines
+
+    def _var(self):
+        self._temp += 1
+        return "p%d" % self._temp
+
+    def _expr(self,expr,pin,pout,capture):
+        """Returns the lines parsing the expression from position variable
+        pin, leaving the resulting position or -1 in variable pout. On
+        failure, any values appended are removed again."""
+        return getattr(self,"_expr_"+expr[0])(expr,pin,pout,
+            capture and self._expr_produces(expr))
+
+    def _expr_chars(self,expr,pin,pout,capture):
+        chars = expr[1]
+        if len(chars) == 1:
+            test = "data[%s] == %s" % (pin,repr(next(iter(chars))))
+        else:
+            test = "data[%s] in %s" % (pin,self._charset(chars))
+        return ["if %s > furthest: furthest = %s" % (pin,pin),
+                "%s = %s+1 if %s else -1" % (pout,pin,test)]
+
+    def _expr_ref(self,expr,pin,pout,capture):
+        self._wanted.append((expr[1],capture))
+        return ["%s = %s(%s)" % (pout,self._function_name(expr[1],capture),pin)]
+
+    def _expr_seq(self,expr,pin,pout,capture):
+        lines = []
+        if capture:
+            n = self._var()
+            lines.append("%s = len(out)" % n)
+        lines.append("%s = -1" % pout)
+        indent = ""
+        p = pin
+        for i,e in enumerate(expr[1]):
+            last = i == len(expr[1])-1
+            v = pout if last else self._var()
+            lines.extend(indent+l for l in self._expr(e,p,v,capture))
+            if not last:
+                lines.append(indent+"if %s >= 0:" % v)
+                indent += "    "
+            p = v
+        if capture:
+            lines.append("if %s < 0: del out[%s:]" % (pout,n))
+        return lines
+
+    def _expr_alt(self,expr,pin,pout,capture):
+        lines = []
+        indent = ""
+        for i,e in enumerate(expr[1]):
+            if i > 0:
+                lines.append(indent+"if %s < 0:" % pout)
+                indent += "    "
+            lines.extend(indent+l for l in self._expr(e,pin,pout,capture))
+        return lines
+
+    def _expr_opt(self,expr,pin,pout,capture):
+        lines = self._expr(expr[1],pin,pout,capture)
+        lines.append("if %s < 0: %s = %s" % (pout,pout,pin))
+        return lines
+
+    def _expr_not(self,expr,pin,pout,capture):
+        v = self._var()
+        lines = self._expr(expr[1],pin,v,False)
+        lines.append("%s = -1 if %s >= 0 else %s" % (pout,v,pin))
+        return lines
+
+    def _expr_rep(self,expr,pin,pout,capture):
+        item,minimum = expr[1],expr[2]
+        # a run of characters, alone or as the first alternative, is
+        # matched all at once
+        if item[0] == "chars":
+            run,rest = item[1],None
+        elif item[0] == "alt" and item[1][0][0] == "chars":
+            run = item[1][0][1]
+            rest = item[1][1] if len(item[1]) == 2 else ("alt",item[1][1:])
+        else:
+            run,rest = None,item
+
+        lines = ["%s = %s" % (pout,pin)]
+        if run is not None and rest is None:
+            lines.append("%s = %s.match(data,%s).end()" % (pout,self._run(run),pin))
+            lines.append("if %s > furthest: furthest = %s" % (pout,pout))
+        else:
+            v = self._var()
+            lines.append("while True:")
+            if run is not None:
+                lines.append("    %s = %s.match(data,%s).end()" % (v,self._run(run),pout))
+                lines.append("    if %s > furthest: furthest = %s" % (v,v))
+                lines.append("    if %s > %s:" % (v,pout))
+                lines.append("        %s = %s" % (pout,v))
+                lines.append("        continue")
+            lines.extend("    "+l for l in self._expr(rest,pout,v,capture))
+            lines.append("    if %s < 0: break" % v)
+            lines.append("    %s = %s" % (pout,v))
+        if minimum > 0:
+            lines.append("if %s == %s: %s = -1" % (pout,pin,pout))
+        return lines
+
+
+def generate(grammar_source):
+    """Returns the source of the parser module for the given BNF"""
+    actions = set(re.findall(r"^def _build_(\w+)\(",ACTIONS,re.M))
+    return Generator(parse_grammar(grammar_source),actions).generate(START)
+
+
+def main():
+    with open(GRAMMAR) as f:
+        source = generate(f.read())
+    with open(OUTPUT,"w") as f:
+        f.write(source)
+    print("Wrote %s" % OUTPUT)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,18 @@ import begin.formatters
 import begin.utils
 import argparse
 import sys    
+import os
 import re
+import json
 from . import VERSION
 from . import io as hio
 from . import parse as hparse
 from . import run as hrun
+from . import cache as hcache
+
+
+# Size above which Hrbrt input files are memory-mapped rather than read
+MMAP_SIZE = 1024*1024
 
 
 class NoDefaultHelpFormatter(argparse.HelpFormatter):
@@ -18,6 +25,36 @@ class NoDefaultHelpFormatter(argparse.HelpFormatter):
         return re.sub(r'\(default:.*\)', '', action.help)
 
 
+def _report(diagnostics,filename,diagfmt):
+    """Writes the diagnostics to standard error in the given format, exiting 
+    if any of them are errors"""
+    if diagfmt == "json":
+        sys.stderr.write(json.dumps([{ "severity": d.severity, "message": d.message, 
+            "section": d.section, "line": d.line, "column": d.column }
+            for d in diagnostics], indent=4)+"\n")
+    else:
+        for d in diagnostics:
+            if d.line is not None:
+                sys.stderr.write("%s:%d:%d: %s: %s\n" % (filename,d.line,d.column,
+                    d.severity,d.message))
+            else:
+                sys.stderr.write("%s: %s: %s\n" % (filename,d.severity,d.message))
+    if any(d.severity == hparse.Diagnostic.ERROR for d in diagnostics):
+        sys.exit(1)
+
+
+def _open(filename,mode,fmt):
+    """Opens the file for reading or writing in the given format, in binary 
+    mode if the format is a binary one"""
+    if getattr(fmt,"BINARY",False):
+        return open(filename, mode+"b")
+    return open(filename, mode, encoding='utf-8')
+    
+    
+def _standard_stream(stream,fmt):
+    return stream.buffer if getattr(fmt,"BINARY",False) else stream
+
+
 def _choice_validator(*choices):
     def validator(v):
         if v not in choices:
@@ -30,16 +67,21 @@ def _choice_validator(*choices):
     formatter_class=NoDefaultHelpFormatter
 )
 @begin.convert(
-    #fromfmt=_choice_validator("hrbrt"), 
-    tofmt=_choice_validator("hrbrt","json","xml","markdown"),
+    fromfmt=_choice_validator("hrbrt","json","binary"),
+    tofmt=_choice_validator("hrbrt","json","xml","markdown","binary"),
     run=_choice_validator("cli","gui"),
+    diagnostics=_choice_validator("text","json"),
+    jobs=int,
 )
 def main(
         input: "File to read from or '-' (standard input)",
         output: "Output the result. A filename, or '-' (standard output)" =None,
-        #fromfmt: "Input format. One of  'hrbrt'" =None,
-        tofmt: "Output format. One of 'hrbrt', 'json', 'xml' or 'markdown'" =None,
+        fromfmt: "Input format. One of 'hrbrt', 'json' or 'binary'" =None,
+        tofmt: "Output format. One of 'hrbrt', 'json', 'xml', 'markdown' or 'binary'" =None,
         run: "Run document interactively. One of 'cli' or 'gui'" =None,
+        diagnostics: "Format to report problems in. One of 'text' or 'json'" ="text",
+        cache: "Directory to cache parse results in, so unchanged files aren't parsed again" =None,
+        jobs: "Number of processes to parse large documents with" =None,
     ):    
     """Processes HRBrT branching text documents"""
 
@@ -49,29 +91,42 @@ def main(
     else:
         ext = None
         
-    #if fromfmt == "json" or (fromfmt is None and ext in hio.JsonIO.EXTENSIONS):
-    #    informat = hio.JsonIO
-    #else:        
-    #    informat = hio.HrbrtIO
-    informat = hio.HrbrtIO
-
-    # read from input stream
-    if input not in (None, "-"):
-        instream = open(input, "r", encoding='utf-8')
+    if fromfmt == "json" or (fromfmt is None and ext in hio.JsonIO.EXTENSIONS):
+        informat = hio.JsonIO
+    elif fromfmt == "binary" or (fromfmt is None and ext in hio.BinaryIO.EXTENSIONS):
+        informat = hio.BinaryIO
+    else:        
+        informat = hio.HrbrtIO
+
+    # read from input stream, mapping large files into memory
+    mapped = (informat is hio.HrbrtIO and input not in (None, "-") 
+        and os.path.isfile(input) and os.path.getsize(input) > MMAP_SIZE)
+    if mapped:
+        instream = open(input, "rb")
+    elif input not in (None, "-"):
+        instream = _open(input, "r", informat)
     else:
-        instream = sys.stdin
+        instream = _standard_stream(sys.stdin, informat)
+
+    filename = input if input not in (None, "-") else "<stdin>"
 
     try:    
-        document = informat.read(instream)
+        if informat is hio.HrbrtIO:
+            document = informat.read(instream, jobs=jobs, mmap=mapped,
+                cache=hcache.ParseCache(cache) if cache is not None else None)
+        else:
+            document = informat.read(instream)
     except (hparse.InputError, hparse.ValidationError) as e:
+        if diagnostics == "json":
+            _report([hparse.Diagnostic(str(e),line=getattr(e,"line",None),
+                column=getattr(e,"column",None))],filename,diagnostics)
         sys.exit(str(e))
 
-    # validate document
-    vfail = document.validate()
-    if vfail:
-        sys.exit(vfail)
+    # validate document, reporting every problem found
+    _report(document.diagnose(),filename,diagnostics)
 
-    # if requested, run and add feedback to parse tree
+    # if requested, run, collecting the choices made
+    answers = None
     if run is not None:
         if run == "gui":
             runner = hrun.GuiRunner
@@ -79,7 +134,7 @@ def main(
             runner = hrun.CommandLineRunner
             
         try:            
-            runner.run(document)
+            answers = runner.run(document)
         except hrun.RunnerError as e:
             sys.exit(str(e))
 
@@ -98,19 +153,21 @@ def main(
             outformat = hio.MarkdownIO
         elif tofmt == "xml" or (tofmt is None and ext in hio.XmlIO.EXTENSIONS):
             outformat = hio.XmlIO
+        elif tofmt == "binary" or (tofmt is None and ext in hio.BinaryIO.EXTENSIONS):
+            outformat = hio.BinaryIO
         else:        
             outformat = hio.HrbrtIO
         
         # write to output stream
         if output not in (None,"-"):
-            outstream = open(output, "w", encoding='utf-8')
+            outstream = _open(output, "w", outformat)
         elif output == "-":
-            outstream = sys.stdout
+            outstream = _standard_stream(sys.stdout, outformat)
         elif input in (None,"-"):
-            outstream = sys.stdout
+            outstream = _standard_stream(sys.stdout, outformat)
         else:
-            outstream = open("%s.out.%s" % ( input[:input.rindex(".")]
-                if "." in input else input, outformat.EXTENSIONS[0] ), "w", encoding='utf-8')
+            outstream = _open("%s.out.%s" % ( input[:input.rindex(".")]
+                if "." in input else input, outformat.EXTENSIONS[0] ), "w", outformat)
                             
         with outstream:
-            outformat.write(document,outstream)
+            outformat.write(document,outstream,answers)
@@ -0,0 +1,153 @@
+import os
+import io
+import json
+import struct
+import hashlib
+import time
+import tempfile
+from . import VERSION
+from . import parse
+from . import io as hio
+
+
+class ParseCache(object):
+    """Persistent cache of parse results, keyed by a hash of the Hrbrt 
+    text. Each entry is a file in the cache directory, holding the 
+    document's diagnostics and the document in BinaryIO's format. 
+    
+    The key includes the package, grammar and binary format versions, so 
+    entries made by a different version are never used. Entries are 
+    written to a temporary file and renamed into place, and the least
+    recently used are removed once the directory exceeds max_size bytes. 
+    Temporary files left by writers which failed before renaming them are 
+    removed once they are older than STALE_AGE seconds. Entries which disappear or turn out to be unreadable are treated as
+    missing, so the cache can be shared by several processes at once 
+    without locking."""
+    
+    DEFAULT_MAX_SIZE = 64*1024*1024
+    EXTENSION = ".hbcache"
+    TEMP_EXTENSION = EXTENSION+".tmp"
+    STALE_AGE = 60*60
+    
+    _LENGTH = struct.Struct("<I")
+    
+    _directory = None
+    directory = property(lambda s: s._directory)
+    _max_size = None
+    max_size = property(lambda s: s._max_size)
+    _size = None
+    
+    def __init__(self,directory,max_size=DEFAULT_MAX_SIZE):
+        self._directory = directory
+        self._max_size = max_size
+        self._size = None
+        os.makedirs(directory,exist_ok=True)
+        
+    @staticmethod
+    def key(text):
+        """Returns the cache key for the given Hrbrt text"""
+        h = hashlib.sha256()
+        h.update(("hrbrt %s grammar %d binary %d\0" % ( ".".join(map(str,VERSION)),
+            parse.GRAMMAR_VERSION, hio.BinaryIO.VERSION )).encode("utf-8"))
+        h.update(text.encode("utf-8","surrogatepass"))
+        return h.hexdigest()
+        
+    def _path(self,key):
+        return os.path.join(self._directory,key+ParseCache.EXTENSION)
+        
+    def get(self,text):
+        """Returns the cached Document for the given Hrbrt text, with its 
+        diagnostics, or None if it isn't cached"""
+        path = self._path(self.key(text))
+        try:
+            with open(path,"rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            # mark as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        try:
+            length, = ParseCache._LENGTH.unpack_from(data,0)
+            start = ParseCache._LENGTH.size
+            diagnostics = [ parse.Diagnostic(d["message"],d["severity"],d["section"],
+                d["line"],d["column"]) for d in json.loads(data[start:start+length]
+                .decode("utf-8")) ]
+            # keeps the go-to links stored with the document
+            return hio.BinaryIO.load(data[start+length:],diagnostics)
+        except (ValueError,KeyError,TypeError,struct.error,parse.InputError):
+            self._remove(path)
+            return None
+        
+    def put(self,text,document):
+        """Stores the Document parsed from the given Hrbrt text, along with 
+        its diagnostics"""
+        diagnostics = json.dumps([ { "severity": d.severity, "message": d.message,
+            "section": d.section, "line": d.line, "column": d.column } 
+            for d in document.diagnose() ]).encode("utf-8")
+        out = io.BytesIO()
+        out.write(ParseCache._LENGTH.pack(len(diagnostics)))
+        out.write(diagnostics)
+        hio.BinaryIO.write(document,out)
+        
+        fd,temp = tempfile.mkstemp(dir=self._directory,suffix=ParseCache.TEMP_EXTENSION)
+        try:
+            with os.fdopen(fd,"wb") as f:
+                f.write(out.getvalue())
+            os.replace(temp,self._path(self.key(text)))
+        except BaseException:
+            self._remove(temp)
+            raise
+            
+        # Only rescan the directory once the size written since the last 
+        # scan could have taken it over the maximum. Entries written by 
+        # other processes are counted at the next scan.
+        if self._size is not None:
+            self._size += len(out.getvalue())
+        if self._size is None or self._size > self._max_size:
+            self.evict()
+        
+    def evict(self):
+        """Removes stale temporary files, then the least recently used 
+        entries until the cache is no larger than its maximum size"""
+        entries = []
+        total = 0
+        stale = time.time()-ParseCache.STALE_AGE
+        for name in os.listdir(self._directory):
+            temp = name.endswith(ParseCache.TEMP_EXTENSION)
+            if not temp and not name.endswith(ParseCache.EXTENSION):
+                continue
+            path = os.path.join(self._directory,name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if temp:
+                # may still be being written unless it's old
+                if st.st_mtime < stale:
+                    self._remove(path)
+                continue
+            entries.append((st.st_mtime,st.st_size,path))
+            total += st.st_size
+        entries.sort()
+        for mtime,size,path in entries:
+            if total <= self._max_size:
+                break
+            self._remove(path)
+            total -= size
+        self._size = total
+            
+    def clear(self):
+        """Removes every entry"""
+        for name in os.listdir(self._directory):
+            if name.endswith(ParseCache.EXTENSION):
+                self._remove(os.path.join(self._directory,name))
+        self._size = 0
+            
+    def _remove(self,path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,1235 @@
+# Generated from syntax.bnf by generate.py. Do not edit.
+"""Recursive descent parser for Hrbrt, generated from the grammar. Gives
+the same parse tree as parse.Document.parse, without building combinator
+objects: each rule is a function taking the position to parse from and
+returning the position it parsed up to, or -1."""
+
+import re
+from . import parse as hparse
+
+
+_RUN_0 = re.compile('[\t ]*')
+_RUN_1 = re.compile('[=]*')
+_CHARS_2 = frozenset('-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz')
+_RUN_3 = re.compile('[ \\-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz]*')
+_RUN_4 = re.compile('[\t !"#$%&\'()*+,\\-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\\\\\]\\^_`abcdefghijklmnopqrstuvwxyz{|}~]*')
+_RUN_5 = re.compile('[\t !"#$%&\'()*+,\\-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\\\\\^_`abcdefghijklmnopqrstuvwxyz{|}~]*')
+_RUN_6 = re.compile('[\t !"#$%&\'()*+,./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\\\\\]\\^_`abcdefghijklmnopqrstuvwxyz{|}~]*')
+_RUN_7 = re.compile('[\t !"#$%&\'()*+,\\-./0123456789:;<=>?@ABCDEFHIJKLMNOPQRSTUVWXYZ[\\\\\\]\\^_`abcdefghijklmnopqrstuvwxyz{|}~]*')
+_RUN_8 = re.compile('[!,.:;?]*')
+
+
+def _build_Document(data,start,end,values):
+    return hparse.Document(values,hparse.LineIndex(data))
+
+
+def _build_FirstSection(data,start,end,values):
+    content = values[0]
+    return hparse.FirstSection(content.items,content.feedback,start)
+
+
+def _build_Section(data,start,end,values):
+    name,content = values
+    return hparse.Section(name,content.items,content.feedback,start)
+
+
+def _build_SectionContent(data,start,end,values):
+    items = []
+    flines = []
+    for v in values:
+        if isinstance(v,hparse.FeedbackLine):
+            flines.append(v.text)
+            continue
+        if (isinstance(v,hparse.ChoiceBlock) and len(items) > 0
+                and isinstance(items[-1],hparse.ChoiceBlock)):
+            raise hparse.ValidationError("Consecutive choice blocks are not allowed. "
+                +"Separate with text block or instruction block")
+        items.append(v)
+        if not isinstance(v,hparse.ChoiceBlock) and v.feedback is not None:
+            flines.append(v.feedback)
+    return hparse.SectionContent(items," ".join(flines) if len(flines) > 0 else None)
+
+
+def _build_ChoiceBlock(data,start,end,values):
+    choices = []
+    flines = []
+    for v in values:
+        if isinstance(v,hparse.FeedbackLine):
+            flines.append(v.text)
+        else:
+            choices.append(v)
+            if v.feedback is not None:
+                flines.append(v.feedback)
+    return hparse.ChoiceBlock(choices," ".join(flines) if len(flines) > 0 else None,
+        start)
+
+
+def _line_block(blocktype,linetype,values):
+    tlines = [values[0].text]
+    flines = []
+    for v in values[1:]:
+        if isinstance(v,linetype):
+            tlines.append(v.text.strip())
+        else:
+            flines.append(v.text.strip())
+    return blocktype(" ".join(tlines)," ".join(flines) if len(flines) > 0 else None)
+
+
+def _build_InstructionBlock(data,start,end,values):
+    return _line_block(hparse.InstructionBlock,hparse.InstructionLine,values)
+
+
+def _build_TextBlock(data,start,end,values):
+    return _line_block(hparse.TextBlock,hparse.TextLine,values)
+
+
+def _build_TextLine(data,start,end,values):
+    return hparse.TextLine(values[0])
+
+
+def _build_FirstTextLine(data,start,end,values):
+    return hparse.FirstTextLine(values[0])
+
+
+def _build_InstructionLine(data,start,end,values):
+    return hparse.InstructionLine(values[0])
+
+
+def _build_FirstInstructionLine(data,start,end,values):
+    return hparse.FirstInstructionLine(values[0])
+
+
+def _build_FeedbackLine(data,start,end,values):
+    return hparse.FeedbackLine(values[0])
+
+
+def _build_Choice(data,start,end,values):
+    marker,content = values
+    return hparse.Choice(marker.mark,content.description,content.response,
+        content.goto,content.feedback,start)
+
+
+def _build_FirstChoice(data,start,end,values):
+    marker,content = values
+    return hparse.FirstChoice(marker.mark,content.description,content.response,
+        content.goto,content.feedback,start)
+
+
+def _build_ChoiceMarker(data,start,end,values):
+    return hparse.ChoiceMarker(values[0] if len(values) > 0 else None)
+
+
+def _build_ChoiceContent(data,start,end,values):
+    desc = values[0]
+    resp = values[1] if len(values) > 1 else None
+    fb = [f for f in (desc.feedback,resp.feedback if resp is not None else None)
+        if f is not None]
+    return hparse.ChoiceContent(desc.text,
+        resp.description if resp is not None else None,
+        resp.goto if resp is not None else None,
+        " ".join(fb) if len(fb) > 0 else None)
+
+
+def _parts(values):
+    parts = [v for v in values if isinstance(v,str)]
+    flines = [v.feedback for v in values
+        if isinstance(v,hparse.ChoiceDescNewline) and v.feedback is not None]
+    return " ".join(parts), " ".join(flines) if len(flines) > 0 else None
+
+
+def _build_ChoiceDescription(data,start,end,values):
+    return hparse.ChoiceDescription(*_parts(values))
+
+
+def _build_ChoiceResponseDesc(data,start,end,values):
+    return hparse.ChoiceResponseDesc(*_parts(values))
+
+
+def _build_ChoiceDescNewline(data,start,end,values):
+    return hparse.ChoiceDescNewline(" ".join(v.text for v in values)
+        if len(values) > 0 else None)
+
+
+def _build_ChoiceResponse(data,start,end,values):
+    desc = goto = None
+    flines = []
+    for v in values:
+        if isinstance(v,hparse.ChoiceResponseDesc):
+            desc = v
+        elif isinstance(v,hparse.ChoiceGoto):
+            goto = v
+        if v.feedback is not None:
+            flines.append(v.feedback)
+    return hparse.ChoiceResponse(
+        desc.text if desc is not None and len(desc.text) > 0 else None,
+        goto.secname if goto is not None else None,
+        " ".join(flines) if len(flines) > 0 else None)
+
+
+def _build_ChoiceGoto(data,start,end,values):
+    nl = values[0] if len(values) > 1 else None
+    return hparse.ChoiceGoto(values[-1],nl.feedback if nl is not None else None)
+
+
+
+def parse(text):
+    """Parses the text, which must be followed by the end of input. Returns
+    the Document and None, or None and the furthest position examined if
+    it can't be parsed, as HrbrtIO does."""
+    data = text+chr(0)
+    out = []
+    furthest = 0
+
+    def _Document(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _FirstSection(p)
+        if p2 >= 0:
+            q = p2
+            while True:
+                p3 = _Section(q)
+                if p3 < 0: break
+                q = p3
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_Document(data,p,q,values))
+        return q
+
+    def _FirstSection(p):
+        n = len(out)
+        q = _SectionContent(p)
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_FirstSection(data,p,q,values))
+        return q
+
+    def _Section(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _Heading(p)
+        if p2 >= 0:
+            q = _SectionContent(p2)
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_Section(data,p,q,values))
+        return q
+
+    def _SectionContent(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = p
+        while True:
+            p3 = _is_BlankLine(p2)
+            if p3 < 0:
+                p4 = len(out)
+                p3 = -1
+                p6 = _is_StarterLine(p2)
+                p5 = -1 if p6 >= 0 else p2
+                if p5 >= 0:
+                    p3 = _FeedbackLine(p5)
+                if p3 < 0: del out[p4:]
+            if p3 < 0: break
+            p2 = p3
+        if p2 >= 0:
+            q = p2
+            while True:
+                p7 = _ChoiceBlock(q)
+                if p7 < 0:
+                    p7 = _InstructionBlock(q)
+                    if p7 < 0:
+                        p7 = _TextBlock(q)
+                if p7 < 0: break
+                q = p7
+            if q == p2: q = -1
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_SectionContent(data,p,q,values))
+        return q
+
+    def _Heading(p):
+        p1 = len(out)
+        q = -1
+        p2 = _is_QuoteMarker(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            p3 = _is_HeadingMarker(p2)
+            if p3 >= 0:
+                p4 = _is_LineWhitespace(p3)
+                if p4 < 0: p4 = p3
+                if p4 >= 0:
+                    p5 = _Name(p4)
+                    if p5 >= 0:
+                        p6 = _is_HeadingMarker(p5)
+                        if p6 >= 0:
+                            q = _is_Newline(p6)
+        if q < 0: del out[p1:]
+        return q
+
+    def _is_BlankLine(p):
+        q = -1
+        p1 = _is_QuoteMarker(p)
+        if p1 < 0: p1 = p
+        if p1 >= 0:
+            p2 = _is_LineWhitespace(p1)
+            if p2 < 0: p2 = p1
+            if p2 >= 0:
+                q = _is_Newline(p2)
+        return q
+
+    def _is_StarterLine(p):
+        q = _is_FirstTextLine(p)
+        if q < 0:
+            q = _is_FirstInstructionLine(p)
+            if q < 0:
+                q = _is_Heading(p)
+                if q < 0:
+                    q = _is_FirstChoice(p)
+        return q
+
+    def _FeedbackLine(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _is_QuoteMarker(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            p3 = _LineText(p2)
+            if p3 >= 0:
+                q = _is_Newline(p3)
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_FeedbackLine(data,p,q,values))
+        return q
+
+    def _ChoiceBlock(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _FirstChoice(p)
+        if p2 >= 0:
+            q = p2
+            while True:
+                p3 = _is_BlankLine(q)
+                if p3 < 0:
+                    p3 = _Choice(q)
+                    if p3 < 0:
+                        p4 = len(out)
+                        p3 = -1
+                        p6 = _is_StarterLine(q)
+                        p5 = -1 if p6 >= 0 else q
+                        if p5 >= 0:
+                            p3 = _FeedbackLine(p5)
+                        if p3 < 0: del out[p4:]
+                if p3 < 0: break
+                q = p3
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_ChoiceBlock(data,p,q,values))
+        return q
+
+    def _InstructionBlock(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _FirstInstructionLine(p)
+        if p2 >= 0:
+            q = p2
+            while True:
+                p3 = _is_BlankLine(q)
+                if p3 < 0:
+                    p3 = _InstructionLine(q)
+                    if p3 < 0:
+                        p4 = len(out)
+                        p3 = -1
+                        p6 = _is_StarterLine(q)
+                        p5 = -1 if p6 >= 0 else q
+                        if p5 >= 0:
+                            p3 = _FeedbackLine(p5)
+                        if p3 < 0: del out[p4:]
+                if p3 < 0: break
+                q = p3
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_InstructionBlock(data,p,q,values))
+        return q
+
+    def _TextBlock(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _FirstTextLine(p)
+        if p2 >= 0:
+            q = p2
+            while True:
+                p3 = _is_BlankLine(q)
+                if p3 < 0:
+                    p3 = _TextLine(q)
+                    if p3 < 0:
+                        p4 = len(out)
+                        p3 = -1
+                        p6 = _is_StarterLine(q)
+                        p5 = -1 if p6 >= 0 else q
+                        if p5 >= 0:
+                            p3 = _FeedbackLine(p5)
+                        if p3 < 0: del out[p4:]
+                if p3 < 0: break
+                q = p3
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_TextBlock(data,p,q,values))
+        return q
+
+    def _is_QuoteMarker(p):
+        nonlocal furthest
+        q = -1
+        p1 = p
+        while True:
+            p2 = -1
+            p3 = p1
+            p3 = _RUN_0.match(data,p1).end()
+            if p3 > furthest: furthest = p3
+            if p3 >= 0:
+                if p3 > furthest: furthest = p3
+                p2 = p3+1 if data[p3] == '>' else -1
+            if p2 < 0: break
+            p1 = p2
+        if p1 == p: p1 = -1
+        if p1 >= 0:
+            q = p1
+            q = _RUN_0.match(data,p1).end()
+            if q > furthest: furthest = q
+        return q
+
+    def _is_HeadingMarker(p):
+        nonlocal furthest
+        q = -1
+        if p > furthest: furthest = p
+        p1 = p+1 if data[p] == '=' else -1
+        if p1 >= 0:
+            q = p1
+            q = _RUN_1.match(data,p1).end()
+            if q > furthest: furthest = q
+            if q == p1: q = -1
+        return q
+
+    def _is_LineWhitespace(p):
+        nonlocal furthest
+        q = p
+        q = _RUN_0.match(data,p).end()
+        if q > furthest: furthest = q
+        if q == p: q = -1
+        return q
+
+    def _Name(p):
+        nonlocal furthest
+        n = len(out)
+        q = -1
+        if p > furthest: furthest = p
+        p1 = p+1 if data[p] in _CHARS_2 else -1
+        if p1 >= 0:
+            q = p1
+            q = _RUN_3.match(data,p1).end()
+            if q > furthest: furthest = q
+        if q >= 0:
+            out.append(data[p:q].strip())
+        return q
+
+    def _is_Newline(p):
+        nonlocal furthest
+        q = -1
+        if p > furthest: furthest = p
+        p1 = p+1 if data[p] == '\r' else -1
+        if p1 >= 0:
+            if p1 > furthest: furthest = p1
+            q = p1+1 if data[p1] == '\n' else -1
+            if q < 0: q = p1
+        if q < 0:
+            if p > furthest: furthest = p
+            q = p+1 if data[p] == '\n' else -1
+        return q
+
+    def _is_FirstTextLine(p):
+        q = -1
+        p1 = _is_QuoteMarker(p)
+        if p1 < 0: p1 = p
+        if p1 >= 0:
+            p2 = _is_FirstTextLineMarker(p1)
+            if p2 >= 0:
+                q = _is_TextLineContent(p2)
+        return q
+
+    def _is_FirstInstructionLine(p):
+        q = -1
+        p1 = _is_QuoteMarker(p)
+        if p1 < 0: p1 = p
+        if p1 >= 0:
+            p2 = _is_FirstInstructionLineMarker(p1)
+            if p2 >= 0:
+                q = _is_TextLineContent(p2)
+        return q
+
+    def _is_Heading(p):
+        q = -1
+        p1 = _is_QuoteMarker(p)
+        if p1 < 0: p1 = p
+        if p1 >= 0:
+            p2 = _is_HeadingMarker(p1)
+            if p2 >= 0:
+                p3 = _is_LineWhitespace(p2)
+                if p3 < 0: p3 = p2
+                if p3 >= 0:
+                    p4 = _is_Name(p3)
+                    if p4 >= 0:
+                        p5 = _is_HeadingMarker(p4)
+                        if p5 >= 0:
+                            q = _is_Newline(p5)
+        return q
+
+    def _is_FirstChoice(p):
+        q = -1
+        p1 = _is_QuoteMarker(p)
+        if p1 < 0: p1 = p
+        if p1 >= 0:
+            p2 = _is_FirstTextLineMarker(p1)
+            if p2 >= 0:
+                p3 = _is_LineWhitespace(p2)
+                if p3 < 0: p3 = p2
+                if p3 >= 0:
+                    p4 = _is_ChoiceMarker(p3)
+                    if p4 >= 0:
+                        q = _is_ChoiceContent(p4)
+        return q
+
+    def _LineText(p):
+        nonlocal furthest
+        n = len(out)
+        q = p
+        q = _RUN_4.match(data,p).end()
+        if q > furthest: furthest = q
+        if q == p: q = -1
+        if q >= 0:
+            out.append(data[p:q].strip())
+        return q
+
+    def _FirstChoice(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _is_QuoteMarker(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            p3 = _is_FirstTextLineMarker(p2)
+            if p3 >= 0:
+                p4 = _is_LineWhitespace(p3)
+                if p4 < 0: p4 = p3
+                if p4 >= 0:
+                    p5 = _ChoiceMarker(p4)
+                    if p5 >= 0:
+                        q = _ChoiceContent(p5)
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_FirstChoice(data,p,q,values))
+        return q
+
+    def _Choice(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _is_QuoteMarker(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            p3 = _is_TextLineMarker(p2)
+            if p3 >= 0:
+                p4 = _is_LineWhitespace(p3)
+                if p4 < 0: p4 = p3
+                if p4 >= 0:
+                    p5 = _ChoiceMarker(p4)
+                    if p5 >= 0:
+                        q = _ChoiceContent(p5)
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_Choice(data,p,q,values))
+        return q
+
+    def _FirstInstructionLine(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _is_QuoteMarker(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            p3 = _is_FirstInstructionLineMarker(p2)
+            if p3 >= 0:
+                q = _TextLineContent(p3)
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_FirstInstructionLine(data,p,q,values))
+        return q
+
+    def _InstructionLine(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _is_QuoteMarker(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            p3 = _is_InstructionLineMarker(p2)
+            if p3 >= 0:
+                q = _TextLineContent(p3)
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_InstructionLine(data,p,q,values))
+        return q
+
+    def _FirstTextLine(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _is_QuoteMarker(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            p3 = _is_FirstTextLineMarker(p2)
+            if p3 >= 0:
+                q = _TextLineContent(p3)
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_FirstTextLine(data,p,q,values))
+        return q
+
+    def _TextLine(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _is_QuoteMarker(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            p3 = _is_TextLineMarker(p2)
+            if p3 >= 0:
+                q = _TextLineContent(p3)
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_TextLine(data,p,q,values))
+        return q
+
+    def _is_FirstTextLineMarker(p):
+        nonlocal furthest
+        q = -1
+        if p > furthest: furthest = p
+        p1 = p+1 if data[p] == ':' else -1
+        if p1 >= 0:
+            if p1 > furthest: furthest = p1
+            q = p1+1 if data[p1] == ':' else -1
+        return q
+
+    def _is_TextLineContent(p):
+        q = -1
+        p1 = _is_LineWhitespace(p)
+        if p1 < 0: p1 = p
+        if p1 >= 0:
+            p2 = _is_LineText(p1)
+            if p2 >= 0:
+                q = _is_Newline(p2)
+        return q
+
+    def _is_FirstInstructionLineMarker(p):
+        nonlocal furthest
+        q = -1
+        if p > furthest: furthest = p
+        p1 = p+1 if data[p] == '%' else -1
+        if p1 >= 0:
+            if p1 > furthest: furthest = p1
+            q = p1+1 if data[p1] == '%' else -1
+        return q
+
+    def _is_Name(p):
+        nonlocal furthest
+        q = -1
+        if p > furthest: furthest = p
+        p1 = p+1 if data[p] in _CHARS_2 else -1
+        if p1 >= 0:
+            q = p1
+            q = _RUN_3.match(data,p1).end()
+            if q > furthest: furthest = q
+        return q
+
+    def _is_ChoiceMarker(p):
+        nonlocal furthest
+        q = -1
+        if p > furthest: furthest = p
+        p1 = p+1 if data[p] == '[' else -1
+        if p1 >= 0:
+            p2 = _is_LineWhitespace(p1)
+            if p2 < 0: p2 = p1
+            if p2 >= 0:
+                p3 = _is_ChoiceMarkerMark(p2)
+                if p3 < 0: p3 = p2
+                if p3 >= 0:
+                    if p3 > furthest: furthest = p3
+                    q = p3+1 if data[p3] == ']' else -1
+        return q
+
+    def _is_ChoiceContent(p):
+        q = -1
+        p1 = _is_LineWhitespace(p)
+        if p1 < 0: p1 = p
+        if p1 >= 0:
+            p2 = _is_ChoiceDescription(p1)
+            if p2 >= 0:
+                p3 = _is_ChoiceResponse(p2)
+                if p3 < 0: p3 = p2
+                if p3 >= 0:
+                    p4 = _is_LineWhitespace(p3)
+                    if p4 < 0: p4 = p3
+                    if p4 >= 0:
+                        q = _is_Newline(p4)
+        return q
+
+    def _ChoiceMarker(p):
+        nonlocal furthest
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        if p > furthest: furthest = p
+        p2 = p+1 if data[p] == '[' else -1
+        if p2 >= 0:
+            p3 = _is_LineWhitespace(p2)
+            if p3 < 0: p3 = p2
+            if p3 >= 0:
+                p4 = _ChoiceMarkerMark(p3)
+                if p4 < 0: p4 = p3
+                if p4 >= 0:
+                    if p4 > furthest: furthest = p4
+                    q = p4+1 if data[p4] == ']' else -1
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_ChoiceMarker(data,p,q,values))
+        return q
+
+    def _ChoiceContent(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _is_LineWhitespace(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            p3 = _ChoiceDescription(p2)
+            if p3 >= 0:
+                p4 = _ChoiceResponse(p3)
+                if p4 < 0: p4 = p3
+                if p4 >= 0:
+                    p5 = _is_LineWhitespace(p4)
+                    if p5 < 0: p5 = p4
+                    if p5 >= 0:
+                        q = _is_Newline(p5)
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_ChoiceContent(data,p,q,values))
+        return q
+
+    def _is_TextLineMarker(p):
+        nonlocal furthest
+        q = -1
+        if p > furthest: furthest = p
+        p1 = p+1 if data[p] == ':' else -1
+        if p1 >= 0:
+            if p1 > furthest: furthest = p1
+            p2 = p1+1 if data[p1] == ':' else -1
+            q = -1 if p2 >= 0 else p1
+        return q
+
+    def _TextLineContent(p):
+        p1 = len(out)
+        q = -1
+        p2 = _is_LineWhitespace(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            p3 = _LineText(p2)
+            if p3 >= 0:
+                q = _is_Newline(p3)
+        if q < 0: del out[p1:]
+        return q
+
+    def _is_InstructionLineMarker(p):
+        nonlocal furthest
+        q = -1
+        if p > furthest: furthest = p
+        p1 = p+1 if data[p] == '%' else -1
+        if p1 >= 0:
+            if p1 > furthest: furthest = p1
+            p2 = p1+1 if data[p1] == '%' else -1
+            q = -1 if p2 >= 0 else p1
+        return q
+
+    def _is_LineText(p):
+        nonlocal furthest
+        q = p
+        q = _RUN_4.match(data,p).end()
+        if q > furthest: furthest = q
+        if q == p: q = -1
+        return q
+
+    def _is_ChoiceMarkerMark(p):
+        nonlocal furthest
+        q = p
+        q = _RUN_5.match(data,p).end()
+        if q > furthest: furthest = q
+        if q == p: q = -1
+        return q
+
+    def _is_ChoiceDescription(p):
+        q = -1
+        p1 = _is_ChoiceDescPart(p)
+        if p1 >= 0:
+            q = p1
+            while True:
+                p2 = -1
+                p3 = _is_ChoiceDescNewline(q)
+                if p3 >= 0:
+                    p2 = _is_ChoiceDescPart(p3)
+                if p2 < 0: break
+                q = p2
+        return q
+
+    def _is_ChoiceResponse(p):
+        nonlocal furthest
+        q = -1
+        p1 = _is_ChoiceDescNewline(p)
+        if p1 < 0: p1 = p
+        if p1 >= 0:
+            if p1 > furthest: furthest = p1
+            p2 = p1+1 if data[p1] == '-' else -1
+            if p2 >= 0:
+                if p2 > furthest: furthest = p2
+                p3 = p2+1 if data[p2] == '-' else -1
+                if p3 >= 0:
+                    q = -1
+                    p4 = _is_ChoiceDescNewline(p3)
+                    if p4 < 0: p4 = p3
+                    if p4 >= 0:
+                        p5 = _is_ChoiceResponseDesc(p4)
+                        if p5 >= 0:
+                            q = _is_ChoiceGoto(p5)
+                            if q < 0: q = p5
+                    if q < 0:
+                        q = _is_ChoiceGoto(p3)
+        return q
+
+    def _ChoiceMarkerMark(p):
+        nonlocal furthest
+        n = len(out)
+        q = p
+        q = _RUN_5.match(data,p).end()
+        if q > furthest: furthest = q
+        if q == p: q = -1
+        if q >= 0:
+            out.append(data[p:q].strip())
+        return q
+
+    def _ChoiceDescription(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _ChoiceDescPart(p)
+        if p2 >= 0:
+            q = p2
+            while True:
+                p4 = len(out)
+                p3 = -1
+                p5 = _ChoiceDescNewline(q)
+                if p5 >= 0:
+                    p3 = _ChoiceDescPart(p5)
+                if p3 < 0: del out[p4:]
+                if p3 < 0: break
+                q = p3
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_ChoiceDescription(data,p,q,values))
+        return q
+
+    def _ChoiceResponse(p):
+        nonlocal furthest
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _ChoiceDescNewline(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            if p2 > furthest: furthest = p2
+            p3 = p2+1 if data[p2] == '-' else -1
+            if p3 >= 0:
+                if p3 > furthest: furthest = p3
+                p4 = p3+1 if data[p3] == '-' else -1
+                if p4 >= 0:
+                    p5 = len(out)
+                    q = -1
+                    p6 = _ChoiceDescNewline(p4)
+                    if p6 < 0: p6 = p4
+                    if p6 >= 0:
+                        p7 = _ChoiceResponseDesc(p6)
+                        if p7 >= 0:
+                            q = _ChoiceGoto(p7)
+                            if q < 0: q = p7
+                    if q < 0: del out[p5:]
+                    if q < 0:
+                        q = _ChoiceGoto(p4)
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_ChoiceResponse(data,p,q,values))
+        return q
+
+    def _is_ChoiceDescPart(p):
+        nonlocal furthest
+        q = p
+        while True:
+            p1 = _RUN_6.match(data,q).end()
+            if p1 > furthest: furthest = p1
+            if p1 > q:
+                q = p1
+                continue
+            p1 = -1
+            if q > furthest: furthest = q
+            p2 = q+1 if data[q] == '-' else -1
+            if p2 >= 0:
+                if p2 > furthest: furthest = p2
+                p3 = p2+1 if data[p2] == '-' else -1
+                p1 = -1 if p3 >= 0 else p2
+            if p1 < 0: break
+            q = p1
+        if q == p: q = -1
+        return q
+
+    def _is_ChoiceDescNewline(p):
+        q = -1
+        p1 = _is_Newline(p)
+        if p1 >= 0:
+            p2 = p1
+            while True:
+                p3 = _is_BlankLine(p2)
+                if p3 < 0:
+                    p3 = -1
+                    p5 = _is_StarterLine(p2)
+                    if p5 < 0:
+                        p5 = _is_TextLine(p2)
+                    p4 = -1 if p5 >= 0 else p2
+                    if p4 >= 0:
+                        p3 = _is_FeedbackLine(p4)
+                if p3 < 0: break
+                p2 = p3
+            if p2 >= 0:
+                p6 = _is_QuoteMarker(p2)
+                if p6 < 0: p6 = p2
+                if p6 >= 0:
+                    p7 = _is_TextLineMarker(p6)
+                    if p7 >= 0:
+                        p8 = _is_LineWhitespace(p7)
+                        if p8 < 0: p8 = p7
+                        if p8 >= 0:
+                            p9 = _is_ChoiceMarker(p8)
+                            q = -1 if p9 >= 0 else p8
+        return q
+
+    def _is_ChoiceResponseDesc(p):
+        q = -1
+        p1 = _is_ChoiceResponseDescPart(p)
+        if p1 >= 0:
+            q = p1
+            while True:
+                p2 = -1
+                p3 = _is_ChoiceDescNewline(q)
+                if p3 >= 0:
+                    p2 = _is_ChoiceResponseDescPart(p3)
+                if p2 < 0: break
+                q = p2
+        return q
+
+    def _is_ChoiceGoto(p):
+        nonlocal furthest
+        q = -1
+        p1 = _is_ChoiceDescNewline(p)
+        if p1 < 0: p1 = p
+        if p1 >= 0:
+            if p1 > furthest: furthest = p1
+            p2 = p1+1 if data[p1] == 'G' else -1
+            if p2 >= 0:
+                if p2 > furthest: furthest = p2
+                p3 = p2+1 if data[p2] == 'O' else -1
+                if p3 >= 0:
+                    if p3 > furthest: furthest = p3
+                    p4 = p3+1 if data[p3] == ' ' else -1
+                    if p4 >= 0:
+                        if p4 > furthest: furthest = p4
+                        p5 = p4+1 if data[p4] == 'T' else -1
+                        if p5 >= 0:
+                            if p5 > furthest: furthest = p5
+                            p6 = p5+1 if data[p5] == 'O' else -1
+                            if p6 >= 0:
+                                p7 = _is_LineWhitespace(p6)
+                                if p7 < 0: p7 = p6
+                                if p7 >= 0:
+                                    p8 = _is_Name(p7)
+                                    if p8 >= 0:
+                                        q = _is_EndPunctuation(p8)
+                                        if q < 0: q = p8
+        return q
+
+    def _ChoiceDescPart(p):
+        nonlocal furthest
+        n = len(out)
+        q = p
+        while True:
+            p1 = _RUN_6.match(data,q).end()
+            if p1 > furthest: furthest = p1
+            if p1 > q:
+                q = p1
+                continue
+            p1 = -1
+            if q > furthest: furthest = q
+            p2 = q+1 if data[q] == '-' else -1
+            if p2 >= 0:
+                if p2 > furthest: furthest = p2
+                p3 = p2+1 if data[p2] == '-' else -1
+                p1 = -1 if p3 >= 0 else p2
+            if p1 < 0: break
+            q = p1
+        if q == p: q = -1
+        if q >= 0:
+            out.append(data[p:q].strip())
+        return q
+
+    def _ChoiceDescNewline(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _is_Newline(p)
+        if p2 >= 0:
+            p3 = p2
+            while True:
+                p4 = _is_BlankLine(p3)
+                if p4 < 0:
+                    p5 = len(out)
+                    p4 = -1
+                    p7 = _is_StarterLine(p3)
+                    if p7 < 0:
+                        p7 = _is_TextLine(p3)
+                    p6 = -1 if p7 >= 0 else p3
+                    if p6 >= 0:
+                        p4 = _FeedbackLine(p6)
+                    if p4 < 0: del out[p5:]
+                if p4 < 0: break
+                p3 = p4
+            if p3 >= 0:
+                p8 = _is_QuoteMarker(p3)
+                if p8 < 0: p8 = p3
+                if p8 >= 0:
+                    p9 = _is_TextLineMarker(p8)
+                    if p9 >= 0:
+                        p10 = _is_LineWhitespace(p9)
+                        if p10 < 0: p10 = p9
+                        if p10 >= 0:
+                            p11 = _is_ChoiceMarker(p10)
+                            q = -1 if p11 >= 0 else p10
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_ChoiceDescNewline(data,p,q,values))
+        return q
+
+    def _ChoiceResponseDesc(p):
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _ChoiceResponseDescPart(p)
+        if p2 >= 0:
+            q = p2
+            while True:
+                p4 = len(out)
+                p3 = -1
+                p5 = _ChoiceDescNewline(q)
+                if p5 >= 0:
+                    p3 = _ChoiceResponseDescPart(p5)
+                if p3 < 0: del out[p4:]
+                if p3 < 0: break
+                q = p3
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_ChoiceResponseDesc(data,p,q,values))
+        return q
+
+    def _ChoiceGoto(p):
+        nonlocal furthest
+        n = len(out)
+        p1 = len(out)
+        q = -1
+        p2 = _ChoiceDescNewline(p)
+        if p2 < 0: p2 = p
+        if p2 >= 0:
+            if p2 > furthest: furthest = p2
+            p3 = p2+1 if data[p2] == 'G' else -1
+            if p3 >= 0:
+                if p3 > furthest: furthest = p3
+                p4 = p3+1 if data[p3] == 'O' else -1
+                if p4 >= 0:
+                    if p4 > furthest: furthest = p4
+                    p5 = p4+1 if data[p4] == ' ' else -1
+                    if p5 >= 0:
+                        if p5 > furthest: furthest = p5
+                        p6 = p5+1 if data[p5] == 'T' else -1
+                        if p6 >= 0:
+                            if p6 > furthest: furthest = p6
+                            p7 = p6+1 if data[p6] == 'O' else -1
+                            if p7 >= 0:
+                                p8 = _is_LineWhitespace(p7)
+                                if p8 < 0: p8 = p7
+                                if p8 >= 0:
+                                    p9 = _Name(p8)
+                                    if p9 >= 0:
+                                        q = _is_EndPunctuation(p9)
+                                        if q < 0: q = p9
+        if q < 0: del out[p1:]
+        if q >= 0:
+            values = out[n:]
+            del out[n:]
+            out.append(_build_ChoiceGoto(data,p,q,values))
+        return q
+
+    def _is_TextLine(p):
+        q = -1
+        p1 = _is_QuoteMarker(p)
+        if p1 < 0: p1 = p
+        if p1 >= 0:
+            p2 = _is_TextLineMarker(p1)
+            if p2 >= 0:
+                q = _is_TextLineContent(p2)
+        return q
+
+    def _is_FeedbackLine(p):
+        q = -1
+        p1 = _is_QuoteMarker(p)
+        if p1 < 0: p1 = p
+        if p1 >= 0:
+            p2 = _is_LineText(p1)
+            if p2 >= 0:
+                q = _is_Newline(p2)
+        return q
+
+    def _is_ChoiceResponseDescPart(p):
+        nonlocal furthest
+        q = p
+        while True:
+            p1 = _RUN_7.match(data,q).end()
+            if p1 > furthest: furthest = p1
+            if p1 > q:
+                q = p1
+                continue
+            p1 = -1
+            if q > furthest: furthest = q
+            p2 = q+1 if data[q] == 'G' else -1
+            if p2 >= 0:
+                p3 = -1
+                if p2 > furthest: furthest = p2
+                p4 = p2+1 if data[p2] == 'O' else -1
+                if p4 >= 0:
+                    if p4 > furthest: furthest = p4
+                    p5 = p4+1 if data[p4] == ' ' else -1
+                    if p5 >= 0:
+                        if p5 > furthest: furthest = p5
+                        p6 = p5+1 if data[p5] == 'T' else -1
+                        if p6 >= 0:
+                            if p6 > furthest: furthest = p6
+                            p3 = p6+1 if data[p6] == 'O' else -1
+                p1 = -1 if p3 >= 0 else p2
+            if p1 < 0: break
+            q = p1
+        if q == p: q = -1
+        return q
+
+    def _is_EndPunctuation(p):
+        nonlocal furthest
+        q = p
+        q = _RUN_8.match(data,p).end()
+        if q > furthest: furthest = q
+        if q == p: q = -1
+        return q
+
+    def _ChoiceResponseDescPart(p):
+        nonlocal furthest
+        n = len(out)
+        q = p
+        while True:
+            p1 = _RUN_7.match(data,q).end()
+            if p1 > furthest: furthest = p1
+            if p1 > q:
+                q = p1
+                continue
+            p1 = -1
+            if q > furthest: furthest = q
+            p2 = q+1 if data[q] == 'G' else -1
+            if p2 >= 0:
+                p3 = -1
+                if p2 > furthest: furthest = p2
+                p4 = p2+1 if data[p2] == 'O' else -1
+                if p4 >= 0:
+                    if p4 > furthest: furthest = p4
+                    p5 = p4+1 if data[p4] == ' ' else -1
+                    if p5 >= 0:
+                        if p5 > furthest: furthest = p5
+                        p6 = p5+1 if data[p5] == 'T' else -1
+                        if p6 >= 0:
+                            if p6 > furthest: furthest = p6
+                            p3 = p6+1 if data[p6] == 'O' else -1
+                p1 = -1 if p3 >= 0 else p2
+            if p1 < 0: break
+            q = p1
+        if q == p: q = -1
+        if q >= 0:
+            out.append(data[p:q].strip())
+        return q
+
+
+    end = _Document(0)
+    if end >= 0:
+        if end > furthest: furthest = end
+        if data[end] == chr(0):
+            return out[0], None
+    return None, furthest
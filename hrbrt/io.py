@@ -1,62 +1,133 @@
 import sys
+import os
 import re
 import textwrap
 import json
 import codecs
-import xml.dom
-import xml.dom.minidom
+import bisect
+import struct
+import mmap
+import concurrent.futures
+import xml.sax.saxutils
 from . import parse
+from . import lex
+from . import genparse
+
+
+def _marks(block,answers):
+    """Returns the marks of the block's choices, as selected in the given 
+    Answers if there are any, or else as parsed"""
+    if answers is not None:
+        return answers.marks(block)
+    return [ c.mark for c in block.choices ]
 
 
 class JsonIO(object):
 
     EXTENSIONS = ["json","js"]
+    INDENT = " "*4
+    
+    @staticmethod
+    def read(stream):
+        """Rebuilds the Document from JSON data in the form written by 
+        JsonIO.write, without parsing any Hrbrt. Feedback attached to 
+        individual text blocks, instruction blocks and choices isn't 
+        written, so it's None in the result."""
+        return JsonIO.INST._read(stream)
 
     @staticmethod
-    def write(document,stream):
-        JsonIO.INST._write(document,stream)
-        
-    def _write(self,document,stream):
-        obj = self._visit_Document(document)
-        stream.write(json.dumps(obj, indent=4))
+    def write(document,stream,answers=None):
+        """Writes the document as JSON, with the choices marked as selected 
+        in the given Answers, if any"""
+        JsonIO.INST._write(document,stream,answers)
         
-    def _visit(self,item):
+    def _read(self,stream):
+        try:
+            return self._read_Document(json.load(stream))
+        except KeyError as e:
+            raise parse.InputError("Invalid JSON document: missing field %s" % e)
+        except (ValueError,TypeError,AttributeError) as e:
+            raise parse.InputError("Invalid JSON document: %s" % e)
+            
+    def _read_Document(self,obj):
+        return parse.Document([ self._read_Section(s) for s in obj ])
+        
+    def _read_Section(self,obj):
+        blocks = [ self._read_block(b) for b in obj["blocks"] ]
+        if "name" in obj:
+            return parse.Section(obj["name"],blocks,obj["feedback"])
+        return parse.FirstSection(blocks,obj["feedback"])
+        
+    def _read_block(self,obj):
+        if obj["type"] == "text":
+            return parse.TextBlock(obj["content"],None)
+        elif obj["type"] == "instructions":
+            return parse.InstructionBlock(obj["content"],None)
+        elif obj["type"] == "choices":
+            return self._read_ChoiceBlock(obj)
+        raise ValueError("unknown block type '%s'" % obj["type"])
+        
+    def _read_ChoiceBlock(self,obj):
+        choices = []
+        for c in obj["content"]:
+            ctype = parse.Choice if len(choices) > 0 else parse.FirstChoice
+            choices.append(ctype(c["mark"],c["description"],c["response"],
+                c["goto"],None))
+        return parse.ChoiceBlock(choices,obj["feedback"])
+        
+    def _write(self,document,stream,answers=None):
+        # Encodes one section at a time, laid out as json.dumps would lay 
+        # out the whole list of sections. Newlines only appear in the 
+        # encoder's output as indentation, never within strings, so each 
+        # section can be indented by one level afterwards.
+        sections = document.sections
+        if len(sections) == 0:
+            stream.write("[]")
+            return
+        encoder = json.JSONEncoder(indent=JsonIO.INDENT)
+        for i,s in enumerate(sections):
+            stream.write("[\n" if i == 0 else ",\n")
+            stream.write(JsonIO.INDENT+encoder.encode(self._visit(s,answers))
+                .replace("\n","\n"+JsonIO.INDENT))
+        stream.write("\n]")
+        
+    def _visit(self,item,answers):
         fname = "_visit_%s" % type(item).__name__
-        return getattr(self,fname,lambda x: None)(item)
+        return getattr(self,fname,lambda x,a: None)(item,answers)
         
-    def _visit_Document(self,doc):
+    def _visit_Document(self,doc,answers):
         seclist = []
         for s in doc.sections:
-            seclist.append(self._visit(s))
+            seclist.append(self._visit(s,answers))
         return seclist
         
-    def _visit_FirstSection(self,sec):
+    def _visit_FirstSection(self,sec,answers):
         blocklist = []
         for b in sec.items:
-            blocklist.append(self._visit(b))
+            blocklist.append(self._visit(b,answers))
         return { "blocks": blocklist, "feedback": sec.feedback }
         
-    def _visit_Section(self,sec):
+    def _visit_Section(self,sec,answers):
         blocklist = []
         for b in sec.items:
-            blocklist.append(self._visit(b))
+            blocklist.append(self._visit(b,answers))
         return { "blocks": blocklist, "feedback": sec.feedback, "name": sec.heading }
                 
-    def _visit_TextBlock(self,tblock):
+    def _visit_TextBlock(self,tblock,answers):
         return { "content": tblock.text, "type": "text" }
         
-    def _visit_InstructionBlock(self,iblock):
+    def _visit_InstructionBlock(self,iblock,answers):
         return { "content": iblock.text, "type": "instructions" }
         
-    def _visit_ChoiceBlock(self,cblock):
+    def _visit_ChoiceBlock(self,cblock,answers):
         choicelist = []
-        for c in cblock.choices:
-            choicelist.append(self._visit_Choice(c))
+        for c,m in zip(cblock.choices,_marks(cblock,answers)):
+            choicelist.append(self._visit_Choice(c,m))
         return { "content": choicelist, "feedback": cblock.feedback, "type": "choices" }
         
-    def _visit_Choice(self,choice):
+    def _visit_Choice(self,choice,mark):
         return { "description": choice.description, "goto": choice.goto,
-                 "mark": choice.mark, "response": choice.response }
+                 "mark": mark, "response": choice.response }
         
 JsonIO.INST = JsonIO()
 
@@ -66,7 +137,7 @@ class HtmlIO(object):
     EXTENSIONS = ["htm","html","xhtml"]
     
     @staticmethod
-    def write(document,stream):
+    def write(document,stream,answers=None):
         # TODO
         pass
 
@@ -76,36 +147,309 @@ class HrbrtIO(object):
     EXTENSIONS = ["hb"]
     LINE_WIDTH = 79
     
+    # Least amount of text given to each process when parsing in parallel
+    CHUNK_SIZE = 64*1024
+    
     @staticmethod
-    def read(stream):
-        return HrbrtIO.INST._read(stream)
+    def read(stream,packrat=False,fast=True,cache=None,jobs=None,mmap=False,
+            generated=False):
+        """Parses the Hrbrt data in the given stream and returns the 
+        Document. Unless fast is false, the line tokenizer is tried first
+        and the combinator parser is only used if it can't handle the 
+        input. If packrat is true, the combinator parser's rule results 
+        are memoized to avoid re-parsing. To inspect the memo's hit rate 
+        afterwards, pass a parse.Memo as packrat instead. If a 
+        cache.ParseCache is given, text found in it isn't parsed at all,
+        and other text is added to it once parsed. If jobs is more than 
+        one, large documents are split at their headings and the pieces 
+        parsed by that many processes at once. If mmap is true the stream, 
+        which must then be a file opened in binary mode, is memory-mapped 
+        rather than read, and the combinator parser works on the mapping 
+        directly. The other options still need the text, which is then 
+        decoded from the mapping in one go. If generated is true, the 
+        parser generated from the grammar by generate.py is used in place 
+        of the combinator parser, and packrat is ignored."""
+        return HrbrtIO.INST._read(stream,packrat,fast,cache,jobs,mmap,generated)
     
     @staticmethod
-    def write(document,stream):
-        HrbrtIO.INST._write(document, stream)
-        
-    def _read(self,stream):
+    def iter_sections(stream,packrat=False,fast=True,generated=False):
+        """Parses the Hrbrt data in the given stream a section at a time,
+        yielding each FirstSection and Section as soon as it has been 
+        read, so that only one section's text is held at once. The parse 
+        options are as for read."""
+        return HrbrtIO.INST._iter_sections(stream,packrat,fast,generated)
+    
+    @staticmethod
+    def reparse(document,text,offset,removed,inserted,packrat=False,fast=True,
+            generated=False):
+        """Returns the Document for the given Hrbrt text after an edit 
+        replacing removed characters at offset with the inserted text. 
+        document must be the result of reading the text before the edit. 
+        Only the sections the edit touches, and the one before them in 
+        case a heading was changed, are parsed again. The parse options 
+        are as for read."""
+        return HrbrtIO.INST._reparse(document,text,offset,removed,inserted,
+            packrat,fast,generated)
+    
+    @staticmethod
+    def write(document,stream,answers=None):
+        """Writes the document as Hrbrt, with the choices marked as selected 
+        in the given Answers, if any"""
+        HrbrtIO.INST._write(document,stream,answers)
+        
+    # Content for the first section, placed before text which starts with 
+    # a heading so that it can be parsed as a document
+    _FIRST_SECTION = ":: -\n"
+    
+    # Amount of text read from the stream at a time by iter_sections
+    _READ_SIZE = 64*1024
+    
+    def _iter_sections(self,stream,packrat,fast,generated):
+        buf = ""
+        pos = 0        # position of the start of buf in the document
+        line = 0       # number of lines before buf in the document
+        scanned = 0    # how much of buf has been searched for headings
+        first = True
+        while True:
+            data = stream.read(self._READ_SIZE)
+            buf += data
+            # only look for headings in complete lines, until the end
+            if data == "":
+                end = len(buf)
+            else:
+                end = max(buf.rfind("\n"),buf.rfind("\r"))+1
+            start = 0
+            for p in lex.heading_starts(buf[:end],scanned):
+                if p == 0: continue
+                yield self._parse_section(stream,buf,start,p,pos,line,first,packrat,
+                    fast,generated)
+                start = p
+                first = False
+            line += parse.LineIndex(buf[:start]).lines-1
+            buf = buf[start:]
+            pos += start
+            scanned = end-start
+            if data == "":
+                break
+        yield self._parse_section(stream,buf,0,len(buf),pos,line,first,packrat,fast,
+            generated)
+            
+    def _parse_section(self,stream,buf,start,end,pos,line,first,packrat,fast,
+            generated):
+        """Parses the section occupying start to end of buf, which is at 
+        pos in the document and follows the given number of lines"""
+        prefix = "" if first else self._FIRST_SECTION
+        document,p = self._try_parse(prefix+buf[start:end],packrat,fast,generated)
+        if document is None:
+            # parse on into the following text, as a whole parse would 
+            # look ahead there, reading on from the stream until the text 
+            # runs past the failure to find the same position
+            text = prefix+buf[start:]
+            while True:
+                document,p = self._try_parse(text,packrat,False,generated)
+                if document is None and self._runs_past(text,p):
+                    break
+                data = stream.read(self._READ_SIZE)
+                if data == "":
+                    break
+                text += data
+            if document is not None:
+                p = len(text)
+            self._fail(buf[:start]+text[len(prefix):],max(p-len(prefix),0)+start,line)
+        return self._moved(document.sections[-1],pos+start-len(prefix))
+        
+    def _runs_past(self,text,p):
+        """Whether the text runs on past position p to a whole heading line 
+        and beyond, past where a parse failing at p can have looked"""
+        for h in lex.heading_starts(text,p+1):
+            m = self._LINE.match(text,h)
+            if m.end() < len(text):
+                return True
+        return False
+        
+    # A line and its ending
+    _LINE = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)?")
+        
+    def _reparse(self,document,text,offset,removed,inserted,packrat,fast,generated):
+        newtext = text[:offset]+inserted+text[offset+removed:]
+        sections = document.sections
+        starts = [ s.pos for s in sections ]
+        if len(sections) == 0 or None in starts:
+            return self._parse(newtext,packrat,fast,generated)
+            
+        # Sections from a up to but not including b are parsed again
+        a = max(bisect.bisect_right(starts,offset)-2,0)
+        b = bisect.bisect_right(starts,offset+removed)
+        delta = len(inserted)-removed
+        start = starts[a]
+        end = starts[b]+delta if b < len(starts) else len(newtext)
+        
+        prefix = "" if a == 0 else self._FIRST_SECTION
+        try:
+            region = self._parse(prefix+newtext[start:end],packrat,fast,generated)
+        except (parse.InputError,parse.ValidationError):
+            # parse everything, to fail as a full parse would
+            return self._parse(newtext,packrat,fast,generated)
+        shift = start-len(prefix)
+        changed = region.sections[0 if a == 0 else 1:]
+        
+        return parse.Document(sections[:a] 
+            + [ self._moved(s,shift) for s in changed ]
+            + [ self._moved(s,delta) for s in sections[b:] ],
+            parse.LineIndex(newtext))
+            
+    def _moved(self,section,delta):
+        if delta == 0:
+            return section
+        if isinstance(section,parse.FirstSection):
+            return parse.FirstSection(section.items,section.feedback,section.pos+delta,
+                section.origin)
+        return parse.Section(section.heading,section.items,section.feedback,
+            section.pos+delta,section.origin)
+        
+    def _read(self,stream,packrat=False,fast=True,cache=None,jobs=None,mapped=False,
+            generated=False):
+        if mapped:
+            return self._read_mapped(stream,packrat,fast,cache,jobs,generated)
         instring = stream.read()
-        input = parse.Input(instring)
+        
+        return self._read_text(instring,packrat,fast,cache,jobs,generated)
+        
+    def _read_text(self,instring,packrat,fast,cache,jobs,generated):
+        if cache is not None:
+            document = cache.get(instring)
+            if document is None:
+                document = self._parse(instring,packrat,fast,generated,jobs)
+                cache.put(instring,document)
+            return document
             
-        document = parse.Document.parse(input)
+        return self._parse(instring,packrat,fast,generated,jobs)
+        
+    def _read_mapped(self,stream,packrat,fast,cache,jobs,generated):
+        if os.fstat(stream.fileno()).st_size == 0:
+            # empty files can't be mapped
+            return self._read_text("",packrat,fast,cache,jobs,generated)
             
+        with mmap.mmap(stream.fileno(),0,access=mmap.ACCESS_READ) as m:
+            # the generated parser works on text only
+            if (fast or generated or cache is not None 
+                    or (jobs is not None and jobs > 1)):
+                try:
+                    instring = str(m,"ascii")
+                except UnicodeDecodeError:
+                    # outside of the grammar, so leave the parser to fail
+                    instring = None
+                if instring is not None:
+                    if generated or cache is not None or (jobs is not None and jobs > 1):
+                        return self._read_text(instring,packrat,fast,cache,jobs,generated)
+                    document = lex.parse(instring)
+                    if document is not None:
+                        return document
+                    del instring
+                    
+            if packrat is True:
+                packrat = parse.Memo()
+            input = parse.BufferInput(m,packrat or None)
+            document = parse.Document.parse(input)
+            if document is None:
+                self._fail(m,input.get_deepest_pos())
+            return document
+    
+    def _parse(self,instring,packrat,fast,generated=False,jobs=None):
+        if jobs is not None and jobs > 1:
+            chunks = self._chunks(instring,jobs)
+            if len(chunks) > 1:
+                return self._parse_chunks(instring,chunks,packrat,fast,generated,jobs)
+    
+        document,p = self._try_parse(instring,packrat,fast,generated)
         if document is None:
-            p = input.get_deepest_pos()
-            raise parse.InputError("Parse error near '%s'" % (instring[p:p+100]+"..."))
-        
+            self._fail(instring,p)
         return document
+        
+    def _try_parse(self,instring,packrat,fast,generated=False):
+        """Returns the Document parsed from the text, or None and the 
+        position the parse failed at"""
+        if fast:
+            document = lex.parse(instring)
+            if document is not None:
+                return document,None
+                
+        if generated:
+            return genparse.parse(instring)
+        
+        if packrat is True:
+            packrat = parse.Memo()
+        input = parse.Input(instring,packrat or None)
+            
+        document = parse.Document.parse(input)
+            
+        if document is None:
+            return None,input.get_deepest_pos()
+        
+        return document,None
+        
+    def _fail(self,instring,p,line=0):
+        """Raises an InputError for the problem found at position p of 
+        the text, which follows the given number of lines"""
+        l,c = parse.LineIndex(instring).location(p)
+        raise parse.InputError("Parse error at line %d, column %d" % (l+line,c),
+            l+line,c)
+        
+    def _chunks(self,instring,jobs):
+        """Splits the text at headings into at most the given number of 
+        pieces, of at least CHUNK_SIZE characters each. Returns the start 
+        position of each piece."""
+        size = max(len(instring)//jobs,HrbrtIO.CHUNK_SIZE)
+        starts = [0]
+        for p in lex.heading_starts(instring):
+            if p-starts[-1] >= size and len(instring)-p >= size:
+                starts.append(p)
+        return starts
+        
+    def _parse_chunks(self,instring,starts,packrat,fast,generated,jobs):
+        ends = starts[1:]+[len(instring)]
+        # every piece after the first starts with a heading, so is parsed 
+        # as a document by putting a first section before it
+        texts = [ instring[:ends[0]] ] + [ self._FIRST_SECTION+instring[a:b]
+            for a,b in zip(starts[1:],ends[1:]) ]
+        
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(_parse_chunk,texts,[packrat]*len(texts),
+                [fast]*len(texts),[generated]*len(texts)))
+            
+        sections = []
+        for i,(start,(document,p)) in enumerate(zip(starts,results)):
+            shift = start-(0 if i == 0 else len(self._FIRST_SECTION))
+            if isinstance(document,parse.ValidationError):
+                raise document
+            if document is None:
+                # parse on to the end, as a whole parse would look ahead 
+                # into the next piece, to find the same position
+                prefix = "" if i == 0 else self._FIRST_SECTION
+                text = prefix+instring[start:]
+                document,p = self._try_parse(text,packrat,False,generated)
+                if document is not None:
+                    p = len(text)
+                self._fail(instring,max(p+shift,start))
+            sections.extend(self._moved(s,shift) 
+                for s in document.sections[0 if i == 0 else 1:])
+        
+        return parse.Document(sections,parse.LineIndex(instring))
                             
-    def _write(self,doc,stream):
-        stream.write( "\n".join(map(self._visit,doc.sections)) )
+    def _write(self,doc,stream,answers=None):
+        sep = ""
+        for s in doc.sections:
+            stream.write(sep)
+            stream.write(self._visit(s,answers))
+            sep = "\n"
         
-    def _visit(self,item):
+    def _visit(self,item,answers):
         fname = "_visit_%s" % type(item).__name__
-        return getattr(self,fname,lambda x: None)(item)
+        return getattr(self,fname,lambda x,a: None)(item,answers)
         
-    def _visit_FirstSection(self,sec):
+    def _visit_FirstSection(self,sec,answers):
         s = ""
-        s += "\n".join(map(self._visit,sec.items))
+        s += "\n".join(self._visit(i,answers) for i in sec.items)
         if sec.feedback is not None:
             s += "\n"
             flines = textwrap.wrap(sec.feedback,HrbrtIO.LINE_WIDTH)
@@ -113,9 +457,9 @@ class HrbrtIO(object):
                 s += "%s\n" % line
         return s
         
-    def _visit_Section(self,sec):
+    def _visit_Section(self,sec,answers):
         s = "== %s ==\n\n" % sec.heading
-        s += "\n".join(map(self._visit,sec.items))
+        s += "\n".join(self._visit(i,answers) for i in sec.items)
         if sec.feedback is not None:
             s += "\n"
             flines = textwrap.wrap(sec.feedback,HrbrtIO.LINE_WIDTH)
@@ -123,27 +467,28 @@ class HrbrtIO(object):
                 s += "%s\n" % line
         return s
         
-    def _visit_TextBlock(self,text):
+    def _visit_TextBlock(self,text,answers):
         lines = textwrap.wrap(text.text,width=HrbrtIO.LINE_WIDTH-3)
         s = ":: %s\n" % lines[0]
         for line in lines[1:]:
             s += ":  %s\n" % line
         return s
         
-    def _visit_InstructionBlock(self,instr):
+    def _visit_InstructionBlock(self,instr,answers):
         lines = textwrap.wrap(instr.text,width=HrbrtIO.LINE_WIDTH-3)
         s = "%%%% %s\n" % lines[0]
         for line in lines[1:]:
             s += "%%  %s\n" % line
         return s
         
-    def _visit_ChoiceBlock(self,cblock):
+    def _visit_ChoiceBlock(self,cblock,answers):
         s = ""
         if len(cblock.choices) > 0:
+            marks = _marks(cblock,answers)
             choicestrs = []
-            choicestrs.append(":: %s" % self._visit_Choice(cblock.choices[0]))
-            for choice in cblock.choices[1:]:
-                choicestrs.append(":  %s" % self._visit_Choice(choice))
+            choicestrs.append(":: %s" % self._visit_Choice(cblock.choices[0],marks[0]))
+            for choice,mark in zip(cblock.choices[1:],marks[1:]):
+                choicestrs.append(":  %s" % self._visit_Choice(choice,mark))
             s += "".join(choicestrs)
         if cblock.feedback is not None and len(cblock.feedback)>0:
             s += "\n"
@@ -152,10 +497,10 @@ class HrbrtIO(object):
                 s += "%s\n" % line
         return s
         
-    def _visit_Choice(self,choice):
+    def _visit_Choice(self,choice,mark):
         s = ""
         dlines = textwrap.wrap(choice.description,HrbrtIO.LINE_WIDTH, 
-                        initial_indent="[%s] " % (choice.mark if choice.mark is not None else ""),
+                        initial_indent="[%s] " % (mark if mark is not None else ""),
                         subsequent_indent=":  ")
         s += "\n".join(dlines)+"\n"
         if choice.response is not None or choice.goto is not None:            
@@ -176,25 +521,42 @@ class HrbrtIO(object):
 HrbrtIO.INST = HrbrtIO()
 
 
+def _parse_chunk(text,packrat,fast,generated):
+    """Parses one piece of a document split for parallel parsing, in a 
+    worker process"""
+    try:
+        return HrbrtIO.INST._try_parse(text,packrat,fast,generated)
+    except parse.ValidationError as e:
+        # given back rather than raised, so that an error in an earlier 
+        # piece is reported first, as in a whole parse
+        return e,None
+
+
 class MarkdownIO(object):
     
     EXTENSIONS = ["md","markdown"]
     LINE_WIDTH = 79
     
     @staticmethod
-    def write(document,stream):
-        MarkdownIO.INST._write(document,stream)
-        
-    def _write(self,document,stream):
-        stream.write("\n".join(map(self._visit_section,document.sections)))
-        
-    def _visit_section(self,section):
+    def write(document,stream,answers=None):
+        """Writes the document as Markdown, with the choices marked as 
+        selected in the given Answers, if any"""
+        MarkdownIO.INST._write(document,stream,answers)
+        
+    def _write(self,document,stream,answers=None):
+        sep = ""
+        for s in document.sections:
+            stream.write(sep)
+            stream.write(self._visit_section(s,answers))
+            sep = "\n"
+        
+    def _visit_section(self,section,answers):
         s = ""
         
         if hasattr(section,"heading"):
             s += section.heading + "\n" + "-"*len(section.heading)+"\n\n"
             
-        s += "\n".join(map(self._visit,section.items))
+        s += "\n".join(self._visit(i,answers) for i in section.items)
         
         if section.feedback is not None:
             s += "\n" + "".join(map(lambda s: "> %s\n" % s,
@@ -202,24 +564,24 @@ class MarkdownIO(object):
             
         return s
             
-    def _visit(self,item):
+    def _visit(self,item,answers):
         hname = "_visit_%s" % type(item).__name__.lower()
-        return getattr(self,hname,self._visit_default)(item)
+        return getattr(self,hname,self._visit_default)(item,answers)
         
-    def _visit_default(self,item):
+    def _visit_default(self,item,answers):
         return ""
         
-    def _visit_textblock(self,block):
+    def _visit_textblock(self,block,answers):
         return "".join(map(lambda s: "%s\n" % s,
             textwrap.wrap(block.text,MarkdownIO.LINE_WIDTH)))
         
-    def _visit_instructionblock(self,block):
+    def _visit_instructionblock(self,block,answers):
         return ("\n".join(textwrap.wrap(block.text.replace("--",""),
             MarkdownIO.LINE_WIDTH,initial_indent='<!-- ')) + " -->\n")
         
-    def _visit_choiceblock(self,block):
+    def _visit_choiceblock(self,block,answers):
         s = ""
-        s += "".join(map(self._visit_choice,block.choices))
+        s += "".join(map(self._visit_choice,block.choices,_marks(block,answers)))
         
         if block.feedback is not None:
             s += "\n" + "".join(map(lambda s: "> %s\n" % s,
@@ -230,8 +592,8 @@ class MarkdownIO(object):
         return re.sub("\s","-",
             re.sub("^\d+\s*","",text.lower()))
         
-    def _visit_choice(self,choice):
-        m = "[%s]" % (choice.mark if choice.mark else "")
+    def _visit_choice(self,choice,mark):
+        m = "[%s]" % (mark if mark else "")
         d = choice.description
         if choice.goto:
             d = "[%s](#%s)" % (d,self._headingize(choice.goto))
@@ -245,76 +607,278 @@ class MarkdownIO(object):
 MarkdownIO.INST = MarkdownIO()
 
 
+class _XmlWriter(object):
+    """Writes indented XML elements straight to a stream, in the same 
+    layout as xml.dom.minidom's writexml. An element's start tag is left 
+    open until it's known whether it has any children, so that empty
+    elements can be written as <name/>."""
+
+    _stream = None
+    _indent = None
+    _open = None
+    
+    def __init__(self,stream,indent):
+        self._stream = stream
+        self._indent = indent
+        self._open = []
+        
+    def _add_child(self):
+        if len(self._open) > 0 and not self._open[-1][1]:
+            self._open[-1][1] = True
+            self._stream.write(">\n")
+        
+    def declaration(self):
+        self._stream.write('<?xml version="1.0" ?>\n')
+        
+    def start(self,name):
+        self._add_child()
+        self._stream.write("%s<%s" % (self._indent*len(self._open),name))
+        self._open.append([name,False])
+        
+    def end(self):
+        name,children = self._open.pop()
+        if children:
+            self._stream.write("%s</%s>\n" % (self._indent*len(self._open),name))
+        else:
+            self._stream.write("/>\n")
+            
+    def text_element(self,name,text):
+        self._add_child()
+        self._stream.write("%s<%s>%s</%s>\n" % (self._indent*len(self._open),
+            name,xml.sax.saxutils.escape(text,{'"':"&quot;"}),name))
+
+
 class XmlIO(object):
 
     EXTENSIONS = ["xml"]
+    INDENT = " "*4
 
     @staticmethod
-    def write(document,stream):
-        XmlIO.INST._write(document,stream)
-        
-    def _write(self,document,stream):
-        doc = xml.dom.minidom.getDOMImplementation().createDocument(None,None,None)
-        self._append_to(self._visit_document(document,doc),doc)
-        doc.writexml(stream,addindent=" "*4,newl="\n")
-        
-    def _textel(self,name,text,doc):
-        el = doc.createElement(name)
-        el.appendChild(doc.createTextNode(text))
-        return el
+    def write(document,stream,answers=None):
+        """Writes the document as XML, with the choices marked as selected 
+        in the given Answers, if any"""
+        XmlIO.INST._write(document,stream,answers)
+        
+    def _write(self,document,stream,answers=None):
+        out = _XmlWriter(stream,XmlIO.INDENT)
+        out.declaration()
+        self._visit_document(document,out,answers)
     
-    def _append_to(self,child,parent):
-        if child and parent:
-            parent.appendChild(child)
-    
-    def _visit(self,item,doc):
+    def _visit(self,item,out,answers):
         hname = "_visit_%s" % type(item).__name__.lower()
-        return getattr(self,hname,self._visit_default)(item,doc)
+        return getattr(self,hname,self._visit_default)(item,out,answers)
         
-    def _visit_default(self,item,doc):
-        return None
+    def _visit_default(self,item,out,answers):
+        pass
     
-    def _visit_document(self,document,doc):
-        elDoc = doc.createElement("document")
+    def _visit_document(self,document,out,answers):
+        out.start("document")
         for section in document.sections:
-            self._append_to(self._visit_section(section,doc),elDoc)
-        return elDoc
+            self._visit_section(section,out,answers)
+        out.end()
         
-    def _visit_section(self,section,doc):
-        elSec = doc.createElement("section")
+    def _visit_section(self,section,out,answers):
+        out.start("section")
         if hasattr(section,"heading"):
-            self._append_to(self._textel("name",section.heading,doc),elSec)
+            out.text_element("name",section.heading)
         for block in section.items:
-            self._append_to(self._visit(block,doc),elSec)
+            self._visit(block,out,answers)
         if section.feedback:
-            self._append_to(self._textel("feedback",section.feedback,doc),elSec)
-        return elSec
+            out.text_element("feedback",section.feedback)
+        out.end()
         
-    def _visit_textblock(self,text,doc):
-        return self._textel("text",text.text,doc)
+    def _visit_textblock(self,text,out,answers):
+        out.text_element("text",text.text)
         
-    def _visit_instructionblock(self,inst,doc):
-        return self._textel("instructions",inst.text,doc)
+    def _visit_instructionblock(self,inst,out,answers):
+        out.text_element("instructions",inst.text)
         
-    def _visit_choiceblock(self,choice,doc):
-        elChoice = doc.createElement("choice")
-        for c in choice.choices:
-            self._append_to(self._visit_choice(c,doc),elChoice)
+    def _visit_choiceblock(self,choice,out,answers):
+        out.start("choice")
+        for c,m in zip(choice.choices,_marks(choice,answers)):
+            self._visit_choice(c,m,out)
         if choice.feedback:
-            self._append_to(self._textel("feedback",choice.feedback,doc),elChoice)
-        return elChoice
+            out.text_element("feedback",choice.feedback)
+        out.end()
         
-    def _visit_choice(self,choice,doc):
-        elOpt = doc.createElement("option")
-        if choice.mark:
-            self._append_to(self._textel("mark",choice.mark,doc),elOpt)
+    def _visit_choice(self,choice,mark,out):
+        out.start("option")
+        if mark:
+            out.text_element("mark",mark)
         if choice.description:
-            self._append_to(self._textel("desc",choice.description,doc),elOpt)
+            out.text_element("desc",choice.description)
         if choice.response:
-            self._append_to(self._textel("response",choice.response,doc),elOpt)
+            out.text_element("response",choice.response)
         if choice.goto:
-            self._append_to(self._textel("goto",choice.goto.lower(),doc),elOpt)
-        return elOpt
+            out.text_element("goto",choice.goto.lower())
+        out.end()
 
         
 XmlIO.INST = XmlIO()
+
+
+class BinaryIO(object):
+    """Compact binary form of a parsed document, for loading quickly 
+    without parsing. All integers are little-endian. The data is:
+    
+        header      magic "HBRT", format version (u16), reserved (u16)
+        strings     count (u32), count+1 end offsets (u32) into the 
+                    UTF-8 data which follows
+        sections    count (u32), then for each section a section record 
+                    followed by its block records, each choice block's 
+                    record followed by its choice records
+        
+    Records refer to strings by index into the string table, with -1 for 
+    None. Go-tos are stored both as written and as the index of the 
+    section they refer to, or -1 if there's no such section."""
+
+    EXTENSIONS = ["hbc"]
+    BINARY = True
+    
+    MAGIC = b"HBRT"
+    VERSION = 1
+    
+    _HEADER = struct.Struct("<4sHH")
+    _COUNT = struct.Struct("<I")
+    _SECTION = struct.Struct("<iiI")     # name, feedback, blocks
+    _BLOCK = struct.Struct("<BiiI")      # type, text, feedback, choices
+    _CHOICE = struct.Struct("<iiiiii")   # mark, description, response, goto,
+                                         # goto section, feedback
+    _TEXT = 0
+    _INSTRUCTIONS = 1
+    _CHOICES = 2
+    
+    @staticmethod
+    def read(stream,mmap=False):
+        """Loads the Document from the binary data in the given stream, which 
+        must be opened in binary mode. If mmap is true the stream, which must 
+        then be a file, is memory-mapped rather than read."""
+        return BinaryIO.INST._read(stream,mmap)
+        
+    @staticmethod
+    def load(buffer,diagnostics=None):
+        """Loads the Document from binary data in the given bytes-like object,
+        such as an mmap. The document's diagnostics can be given, if known, 
+        so that it isn't checked again."""
+        return BinaryIO.INST._load(buffer,diagnostics)
+    
+    @staticmethod
+    def write(document,stream,answers=None):
+        """Writes the document in binary form, with the choices marked as 
+        selected in the given Answers, if any"""
+        BinaryIO.INST._write(document,stream,answers)
+        
+    def _read(self,stream,mapped=False):
+        if mapped and os.fstat(stream.fileno()).st_size == 0:
+            # empty files can't be mapped
+            return self._load(b"")
+        if mapped:
+            with mmap.mmap(stream.fileno(),0,access=mmap.ACCESS_READ) as m:
+                return self._load(m)
+        return self._load(stream.read())
+        
+    def _load(self,buffer,diagnostics=None):
+        try:
+            magic,version,reserved = self._HEADER.unpack_from(buffer,0)
+            if magic != self.MAGIC:
+                raise parse.InputError("Not a binary Hrbrt document")
+            if version != self.VERSION:
+                raise parse.InputError("Unsupported binary format version %d" % version)
+            pos = self._HEADER.size
+            strings,pos = self._load_strings(buffer,pos)
+            sections,targets,pos = self._load_sections(buffer,pos,strings)
+            # go-tos were resolved when written, so aren't looked up again
+            return parse.Document(sections,None,diagnostics,targets)
+        except (struct.error,IndexError,UnicodeDecodeError,ValueError) as e:
+            raise parse.InputError("Invalid binary document: %s" % e)
+        
+    def _load_strings(self,buffer,pos):
+        count, = self._COUNT.unpack_from(buffer,pos)
+        pos += self._COUNT.size
+        ends = struct.unpack_from("<%dI" % (count+1),buffer,pos)
+        pos += 4*(count+1)
+        if ends[-1] > len(buffer)-pos:
+            raise parse.InputError("Invalid binary document: truncated strings")
+        with memoryview(buffer) as view:
+            data = view[pos:pos+ends[-1]]
+            # None is at index -1
+            strings = [ str(data[ends[i]:ends[i+1]],"utf-8") for i in range(count) ] + [None]
+            data.release()
+        return strings, pos+ends[-1]
+        
+    def _load_sections(self,buffer,pos,strings):
+        sections = []
+        targets = []
+        count, = self._COUNT.unpack_from(buffer,pos)
+        pos += self._COUNT.size
+        for i in range(count):
+            name,feedback,nblocks = self._SECTION.unpack_from(buffer,pos)
+            pos += self._SECTION.size
+            blocks = []
+            for j in range(nblocks):
+                btype,text,bfeedback,nchoices = self._BLOCK.unpack_from(buffer,pos)
+                pos += self._BLOCK.size
+                if btype == self._TEXT:
+                    blocks.append(parse.TextBlock(strings[text],strings[bfeedback]))
+                elif btype == self._INSTRUCTIONS:
+                    blocks.append(parse.InstructionBlock(strings[text],strings[bfeedback]))
+                elif btype == self._CHOICES:
+                    choices = []
+                    for k in range(nchoices):
+                        mark,desc,resp,goto,target,cfeedback = self._CHOICE.unpack_from(buffer,pos)
+                        pos += self._CHOICE.size
+                        targets.append(target)
+                        ctype = parse.Choice if k > 0 else parse.FirstChoice
+                        choices.append(ctype(strings[mark],strings[desc],strings[resp],
+                            strings[goto],strings[cfeedback]))
+                    blocks.append(parse.ChoiceBlock(choices,strings[bfeedback]))
+                else:
+                    raise parse.InputError("Invalid binary document: unknown block type %d" % btype)
+            if name == -1:
+                sections.append(parse.FirstSection(blocks,strings[feedback]))
+            else:
+                sections.append(parse.Section(strings[name],blocks,strings[feedback]))
+        return sections, targets, pos
+        
+    def _write(self,document,stream,answers=None):
+        strings = {}
+        def intern(s):
+            if s is None: return -1
+            return strings.setdefault(s,len(strings))
+        
+        sections = document.sections
+        targets = { s: i for i,s in enumerate(sections) }
+        
+        records = bytearray(self._COUNT.pack(len(sections)))
+        for s in sections:
+            items = [ b for b in s.items if type(b) in self._BLOCK_TYPES ]
+            records += self._SECTION.pack(intern(getattr(s,"heading",None)),
+                intern(s.feedback),len(items))
+            for b in items:
+                btype = self._BLOCK_TYPES[type(b)]
+                if btype == self._CHOICES:
+                    choices = b.choices
+                    records += self._BLOCK.pack(btype,-1,intern(b.feedback),len(choices))
+                    for i,(c,m) in enumerate(zip(choices,_marks(b,answers))):
+                        target = targets.get(document.target(b,i),-1)
+                        records += self._CHOICE.pack(intern(m),intern(c.description),
+                            intern(c.response),intern(c.goto),target,intern(c.feedback))
+                else:
+                    records += self._BLOCK.pack(btype,intern(b.text),intern(b.feedback),0)
+                    
+        data = [ s.encode("utf-8") for s in strings ]
+        ends = [0]
+        for d in data:
+            ends.append(ends[-1]+len(d))
+        stream.write(self._HEADER.pack(self.MAGIC,self.VERSION,0))
+        stream.write(self._COUNT.pack(len(data)))
+        stream.write(struct.pack("<%dI" % len(ends),*ends))
+        stream.write(b"".join(data))
+        stream.write(records)
+        
+BinaryIO._BLOCK_TYPES = {
+    parse.TextBlock: BinaryIO._TEXT,
+    parse.InstructionBlock: BinaryIO._INSTRUCTIONS,
+    parse.ChoiceBlock: BinaryIO._CHOICES,
+}
+BinaryIO.INST = BinaryIO()
@@ -0,0 +1,341 @@
+import re
+from . import parse as hparse
+
+
+BLANK = 0
+FEEDBACK = 1
+HEADING = 2
+FIRST_TEXT = 3
+TEXT = 4
+FIRST_INSTRUCTION = 5
+INSTRUCTION = 6
+
+STARTERS = frozenset([HEADING,FIRST_TEXT,FIRST_INSTRUCTION])
+
+_INVALID = re.compile("[^%s\r\n]" % re.escape(hparse.ALL_CHARACTERS))
+_NEWLINE = re.compile(r"\r\n|\r|\n")
+_QUOTE = re.compile(r"(?:[ \t]*>)+[ \t]*")
+_WHITESPACE = re.compile(r"[ \t]*")
+_HEADING = re.compile(r"={2,}[ \t]*([A-Za-z0-9_-][A-Za-z0-9_ -]*)={2,}")
+_MARKER = re.compile(r"\[[ \t]*([^\]]*)\]")
+_DESC_PART = re.compile(r"(?:[^-]|-(?!-))+")
+_RESPONSE_PART = re.compile(r"(?:[^G]|G(?!O TO))+")
+_GOTO = re.compile(r"GO TO[ \t]*([A-Za-z0-9_-][A-Za-z0-9_ -]*)[.,!?;:]*")
+_HEADING_LINE = re.compile(r"(?<![^\r\n])(?:%s)?%s(?=[\r\n]|\Z)" % (
+    _QUOTE.pattern,_HEADING.pattern))
+
+
+class Line(object):
+    """A classified line of input. Holds the line's kind, its content
+    (for text, instruction and heading lines), the text it would
+    contribute as a feedback line, and the line's body following
+    any quote marker."""
+
+    __slots__ = ("kind","text","feedback","body")
+
+    def __init__(self,kind,text,feedback,body):
+        self.kind = kind
+        self.text = text
+        self.feedback = feedback
+        self.body = body
+
+    def __repr__(self):
+        return "Line(%s,%s,%s,%s)" % (repr(self.kind),repr(self.text),
+            repr(self.feedback),repr(self.body))
+
+
+def split_lines(text):
+    """Splits the text into lines, without their line breaks. Returns
+    None if the last line is unterminated"""
+    if "\r" in text:
+        lines = _NEWLINE.split(text)
+    else:
+        lines = text.split("\n")
+    if lines[-1] != "":
+        return None
+    lines.pop()
+    return lines
+
+
+def classify(line):
+    """Returns a Line token for the given line of text, which is
+    assumed to contain only valid characters"""
+    m = _QUOTE.match(line)
+    body = line[m.end():] if m is not None else line
+    c = body[:1]
+    if c == ":":
+        if body[1:2] == ":":
+            text = body[2:].strip()
+            if text: return Line(FIRST_TEXT,text,body.strip(),body)
+        else:
+            text = body[1:].strip()
+            if text: return Line(TEXT,text,body.strip(),body)
+    elif c == "%":
+        if body[1:2] == "%":
+            text = body[2:].strip()
+            if text: return Line(FIRST_INSTRUCTION,text,body.strip(),body)
+        else:
+            text = body[1:].strip()
+            if text: return Line(INSTRUCTION,text,body.strip(),body)
+    elif c == "=":
+        m = _HEADING.fullmatch(body)
+        if m is not None:
+            return Line(HEADING,m.group(1).strip(),body.strip(),body)
+    feedback = body.strip()
+    return Line(FEEDBACK if feedback else BLANK,None,feedback,body)
+
+
+def tokenize(text):
+    """Classifies each line of the text in a single pass. Returns the
+    list of Line tokens, or None if the text can't be tokenized - if it
+    contains characters outside of the grammar or ends without a line
+    break."""
+    if _INVALID.search(text) is not None:
+        return None
+    lines = split_lines(text)
+    if lines is None:
+        return None
+    return [classify(l) for l in lines]
+
+
+def is_heading(line):
+    """Returns true if the given line of text, without its line break,
+    is a section heading"""
+    m = _QUOTE.match(line)
+    return _HEADING.fullmatch(line[m.end():] if m is not None else line) is not None
+
+
+def heading_starts(text,start=0):
+    """Returns the positions at which the heading lines in the text 
+    start, in order, ignoring any starting before the given position"""
+    return [m.start() for m in _HEADING_LINE.finditer(text,start)]
+
+
+def parse(text):
+    """Parses the text using the line tokenizer, returning the same
+    Document as parse.Document.parse would. Returns None if the text
+    can't be handled here, in which case the combinator parser should
+    be used instead, for its result or to report the error."""
+    tokens = tokenize(text)
+    if tokens is None:
+        return None
+    return _Builder(tokens,hparse.LineIndex(text)).build()
+
+
+class _Builder(object):
+    """State machine building the parse tree from the line tokens"""
+
+    _tokens = None
+    _lines = None
+    _next_significant = None
+
+    def __init__(self,tokens,lines):
+        self._tokens = tokens
+        self._lines = lines
+
+    def build(self):
+        tokens = self._tokens
+        sections = []
+
+        r = self._section_content(0)
+        if r is None: return None
+        items,feedback,i = r
+        sections.append(hparse.FirstSection(items,feedback,0))
+
+        while i < len(tokens):
+            if tokens[i].kind != HEADING: return None
+            name = tokens[i].text
+            pos = self._lines.line_start(i+1)
+            r = self._section_content(i+1)
+            if r is None: return None
+            items,feedback,i = r
+            sections.append(hparse.Section(name,items,feedback,pos))
+
+        return hparse.Document(sections,self._lines)
+
+    def _section_content(self,i):
+        tokens = self._tokens
+        n = len(tokens)
+        items = []
+        flines = []
+
+        while i < n and tokens[i].kind not in STARTERS:
+            if tokens[i].kind != BLANK:
+                flines.append(tokens[i].feedback)
+            i += 1
+
+        while i < n:
+            kind = tokens[i].kind
+            if kind == FIRST_INSTRUCTION:
+                block,i = self._line_block(i,INSTRUCTION,hparse.InstructionBlock)
+            elif kind == FIRST_TEXT:
+                r = self._choice(i,True)
+                if r is not None:
+                    block,i = self._choice_block(r)
+                else:
+                    block,i = self._line_block(i,TEXT,hparse.TextBlock)
+            else:
+                break
+            if (len(items) > 0 and isinstance(block,hparse.ChoiceBlock)
+                    and isinstance(items[-1],hparse.ChoiceBlock)):
+                # leave the combinator parser to raise the error
+                return None
+            items.append(block)
+            if not isinstance(block,hparse.ChoiceBlock) and block.feedback is not None:
+                flines.append(block.feedback)
+
+        if len(items) == 0: return None
+        return items, " ".join(flines) if len(flines) > 0 else None, i
+
+    def _line_block(self,i,linekind,blocktype):
+        tokens = self._tokens
+        n = len(tokens)
+        tlines = [tokens[i].text]
+        flines = []
+        i += 1
+        while i < n and tokens[i].kind not in STARTERS:
+            kind = tokens[i].kind
+            if kind == linekind:
+                tlines.append(tokens[i].text)
+            elif kind != BLANK:
+                flines.append(tokens[i].feedback)
+            i += 1
+        return blocktype(" ".join(tlines),
+            " ".join(flines) if len(flines) > 0 else None), i
+
+    def _choice_block(self,first):
+        tokens = self._tokens
+        n = len(tokens)
+        choices = []
+        flines = []
+        choice,i = first
+        while True:
+            choices.append(choice)
+            if choice.feedback is not None:
+                flines.append(choice.feedback)
+            while i < n and tokens[i].kind not in STARTERS:
+                kind = tokens[i].kind
+                if kind == TEXT:
+                    r = self._choice(i,False)
+                    if r is not None:
+                        choice,i = r
+                        break
+                if kind != BLANK:
+                    flines.append(tokens[i].feedback)
+                i += 1
+            else:
+                break
+        return hparse.ChoiceBlock(choices,
+            " ".join(flines) if len(flines) > 0 else None, choices[0].pos), i
+
+    def _choice(self,i,first):
+        """Parses the choice starting at line i. Returns the choice and the 
+        index of the line following it, or None if there's no choice 
+        there"""
+        pos = self._lines.line_start(i+1)
+        body = self._tokens[i].body
+        p = _WHITESPACE.match(body,2 if first else 1).end()
+        m = _MARKER.match(body,p)
+        if m is None: return None
+        mark = m.group(1).strip() or None
+        p = _WHITESPACE.match(body,m.end()).end()
+
+        r = self._parts(i,p,_DESC_PART)
+        if r is None: return None
+        i,p,desc,flines = r
+        
+        response = goto = None
+        r = self._response(i,p)
+        if r is not None:
+            i,p,response,goto,rflines = r
+            flines.extend(rflines)
+            
+        body = self._tokens[i].body
+        if _WHITESPACE.match(body,p).end() != len(body): return None
+
+        ctype = hparse.FirstChoice if first else hparse.Choice
+        return ctype(mark,desc,response,goto,
+            " ".join(flines) if len(flines) > 0 else None, pos), i+1
+    
+    def _desc_newline(self,i,p):
+        """Continues a choice from position p of line i onto the next text 
+        line, skipping blank and feedback lines in between. Returns the 
+        line index, position following the line marker and feedback lines 
+        skipped, or None if the choice can't continue."""
+        tokens = self._tokens
+        if p != len(tokens[i].body): return None
+        if self._next_significant is None:
+            self._next_significant = nexts = [None]*len(tokens)
+            n = None
+            for j in range(len(tokens)-1,-1,-1):
+                nexts[j] = n
+                if tokens[j].kind in STARTERS or tokens[j].kind == TEXT:
+                    n = j
+        j = self._next_significant[i]
+        if j is None or tokens[j].kind != TEXT: return None
+        body = tokens[j].body
+        p = _WHITESPACE.match(body,1).end()
+        if _MARKER.match(body,p) is not None: return None
+        return j, p, [t.feedback for t in tokens[i+1:j] if t.kind != BLANK]
+    
+    def _parts(self,i,p,pattern):
+        """Parses text matching the pattern from position p of line i, 
+        continuing onto following lines. Returns the line index and 
+        position reached, the text and the feedback lines skipped, or None
+        if there's no text"""
+        m = pattern.match(self._tokens[i].body,p)
+        if m is None: return None
+        parts = [m.group().strip()]
+        flines = []
+        p = m.end()
+        while True:
+            r = self._desc_newline(i,p)
+            if r is None: break
+            j,q,skipped = r
+            m = pattern.match(self._tokens[j].body,q)
+            if m is None: break
+            parts.append(m.group().strip())
+            flines.extend(skipped)
+            i,p = j,m.end()
+        return i, p, " ".join(parts), flines
+        
+    def _optional_newline(self,i,p,flines):
+        r = self._desc_newline(i,p)
+        if r is None: return i,p
+        flines.extend(r[2])
+        return r[0],r[1]
+        
+    def _response(self,i,p):
+        """Parses the choice's response and go-to from position p of line i. 
+        Returns the line index and position reached, the response text, 
+        the go-to section name and the feedback lines skipped, or None if 
+        there's no response"""
+        flines = []
+        i,p = self._optional_newline(i,p,flines)
+        if not self._tokens[i].body.startswith("--",p): return None
+        p += 2
+        
+        rflines = []
+        j,q = self._optional_newline(i,p,rflines)
+        r = self._parts(j,q,_RESPONSE_PART)
+        if r is not None:
+            j,q,text,pflines = r
+            rflines.extend(pflines)
+            goto = None
+            g = self._goto(j,q)
+            if g is not None:
+                j,q,goto,gflines = g
+                rflines.extend(gflines)
+            return j, q, text if len(text) > 0 else None, goto, flines+rflines
+            
+        g = self._goto(i,p)
+        if g is None: return None
+        i,p,goto,gflines = g
+        return i, p, None, goto, flines+gflines
+        
+    def _goto(self,i,p):
+        flines = []
+        i,p = self._optional_newline(i,p,flines)
+        m = _GOTO.match(self._tokens[i].body,p)
+        if m is None: return None
+        return i, m.end(), m.group(1).strip(), flines
@@ -1,3 +1,14 @@
+import re
+import sys
+import bisect
+import array
+import collections.abc
+
+
+# Version of the grammar and parse tree. Increase this whenever a change
+# would give a different parse tree or validation result for the same 
+# input, so that cached parse results are no longer used.
+GRAMMAR_VERSION = 1
 
 ALL_CHARACTERS = (
     "abcdefghijklmnopqrstuvwxyz"
@@ -8,36 +19,85 @@ ALL_CHARACTERS = (
 
 
 class Input(object):
-    """Immutable wrapper for the input string. Holds a 
-    position in the input. Holds a reference to the Input 
-    it was branched from and the last Input branched from 
-    it."""
+    """Cursor over the input string. Holds a position in the 
+    input and a reference to the Input it was branched from. The 
+    input string, and the furthest position examined so far, are 
+    shared by every Input branched from the original, so branching 
+    is cheap regardless of the size of the input."""
     
-    _pos = 0
-    _data = None
-    _child = None
-    _parent = None
+    __slots__ = ("_pos","_data","_parent","_memo","_furthest")
     
-    def __init__(self,data):
+    def __init__(self,data,memo=None):
         self._pos = 0
         self._data = data+chr(0)
-        self._child = None
         self._parent = None
+        self._memo = memo
+        self._furthest = [0]
+        
+    pos = property(lambda s: s._pos)
+    line_index = property(lambda s: LineIndex(s._data))
         
     def next(self):
         """Return the next symbol from the input string and 
         advance the position"""
-        s = self._data[self._pos]
-        self._pos += 1
+        p = self._pos
+        s = self._data[p]
+        self._pos = p+1
+        f = self._furthest
+        if p > f[0]: f[0] = p
         return s
         
+    def peek(self):
+        """Return the next symbol from the input string without 
+        advancing the position. It still counts as examined"""
+        p = self._pos
+        f = self._furthest
+        if p > f[0]: f[0] = p
+        return self._data[p]
+        
+    def literal(self,text):
+        """If the input continues with the given string, advance past 
+        it and return it, otherwise return None. The symbols read are 
+        those that comparing one at a time would read"""
+        p = self._pos
+        data = self._data
+        f = self._furthest
+        if data.startswith(text,p):
+            self._pos = p+len(text)
+            if p+len(text)-1 > f[0]: f[0] = p+len(text)-1
+            return text
+        k = p
+        while data[k] == text[k-p]: k += 1
+        if k > f[0]: f[0] = k
+        return None
+        
+    def match(self,pattern):
+        """Match the given compiled regular expression at the 
+        current position. If it matches, advance past the match 
+        and return the matched string, otherwise return None. If 
+        the pattern's first group matches beyond the end of the 
+        match, in a lookahead, the input it covers counts as 
+        examined"""
+        m = pattern.match(self._data,self._pos)
+        end = self._pos if m is None else m.end()
+        seen = end
+        if m is not None and pattern.groups > 0 and m.end(1) > end: 
+            seen = m.end(1)-1
+        f = self._furthest
+        if seen > f[0]: f[0] = seen
+        if m is None: return None
+        self._pos = end
+        return m.group()
+        
     def branch(self):
         """Return a new Input at the same position as this one, 
         which holds a reference to this input"""
-        b = Input(self._data)
+        b = object.__new__(type(self))
+        b._data = self._data
         b._pos = self._pos
         b._parent = self
-        self._child = b
+        b._memo = self._memo
+        b._furthest = self._furthest
         return b
         
     def commit(self):
@@ -49,35 +109,373 @@ class Input(object):
             self._parent._pos = self._pos
             
     def get_deepest_pos(self):
-        """Returns the position of the last Input which descends 
-        from this one"""
-        if self._child is not None:
-            return self._child.get_deepest_pos()
-        else:
-            return self._pos
+        """Returns the furthest position examined by this Input or 
+        any other sharing its input string. When a parse fails, this 
+        is where the problem was found."""
+        return self._furthest[0]
+
+
+class BufferInput(Input):
+    """Cursor over ASCII input held in a bytes-like object, such as a 
+    memory-mapped file, which is parsed in place rather than being 
+    decoded and copied into a string. Symbols and matches are returned 
+    as strings, as for Input, and positions count bytes."""
+    
+    __slots__ = ()
+    
+    # Bytes equivalents of the string patterns passed to match
+    _patterns = {}
+    # Bytes equivalents of the strings passed to literal
+    _literals = {}
+    
+    def __init__(self,data,memo=None):
+        self._pos = 0
+        self._data = data
+        self._parent = None
+        self._memo = memo
+        self._furthest = [0]
+        
+    def next(self):
+        """Return the next symbol from the input and advance the 
+        position. The end of the input is given as chr(0)"""
+        p = self._pos
+        self._pos = p+1
+        f = self._furthest
+        if p > f[0]: f[0] = p
+        if p == len(self._data):
+            return chr(0)
+        return chr(self._data[p])
+        
+    def peek(self):
+        """Return the next symbol from the input without advancing 
+        the position. It still counts as examined"""
+        p = self._pos
+        f = self._furthest
+        if p > f[0]: f[0] = p
+        if p == len(self._data):
+            return chr(0)
+        return chr(self._data[p])
+        
+    def literal(self,text):
+        """If the input continues with the given string, advance past 
+        it and return it, otherwise return None"""
+        btext = BufferInput._literals.get(text)
+        if btext is None:
+            btext = text.encode("ascii")
+            BufferInput._literals[text] = btext
+        p = self._pos
+        data = self._data
+        f = self._furthest
+        if data[p:p+len(btext)] == btext:
+            self._pos = p+len(btext)
+            if p+len(btext)-1 > f[0]: f[0] = p+len(btext)-1
+            return text
+        k = p
+        while k < len(data) and data[k] == btext[k-p]: k += 1
+        if k > f[0]: f[0] = k
+        return None
+        
+    def match(self,pattern):
+        """Match the given compiled regular expression at the 
+        current position. If it matches, advance past the match 
+        and return the matched string, otherwise return None"""
+        bpattern = BufferInput._patterns.get(pattern)
+        if bpattern is None:
+            bpattern = re.compile(pattern.pattern.encode("ascii"))
+            BufferInput._patterns[pattern] = bpattern
+        m = bpattern.match(self._data,self._pos)
+        end = self._pos if m is None else m.end()
+        seen = end
+        if m is not None and bpattern.groups > 0 and m.end(1) > end: 
+            seen = m.end(1)-1
+        f = self._furthest
+        if seen > f[0]: f[0] = seen
+        if m is None: return None
+        self._pos = end
+        return m.group().decode("ascii")
+
+
+class LineIndex(object):
+    """Maps positions in a string to line and column numbers,
+    both counting from 1"""
+    
+    _NEWLINE = re.compile(r"\r\n|\r|\n")
+    _BYTES_NEWLINE = re.compile(rb"\r\n|\r|\n")
+    
+    __slots__ = ("_starts",)
+    
+    def __init__(self,text):
+        """text may also be a bytes-like object, in which case positions
+        count bytes"""
+        newline = LineIndex._NEWLINE if isinstance(text,str) else LineIndex._BYTES_NEWLINE
+        # held as machine integers, as documents are kept for a long time,
+        # and only as wide as the text needs
+        self._starts = array.array("i" if len(text) <= 0x7fffffff else "q",[0])
+        self._starts.extend(m.end() for m in newline.finditer(text))
+        
+    lines = property(lambda s: len(s._starts))
+        
+    def line_start(self,line):
+        """Returns the position at which the given line starts"""
+        return self._starts[line-1]
+        
+    def location(self,pos):
+        """Returns the line and column of the given position"""
+        line = bisect.bisect_right(self._starts,pos)
+        return line, pos-self._starts[line-1]+1
+
+
+class Memo(object):
+    """Packrat memo table, shared by an Input and the Inputs 
+    branched from it. Records the outcome of each memoized rule 
+    at each position so that retrying the rule there doesn't 
+    parse the input again."""
+    
+    hits = 0
+    misses = 0
+    _table = None
+    
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._table = {}
+        
+    hit_rate = property(lambda s: float(s.hits)/(s.hits+s.misses) 
+                            if s.hits+s.misses > 0 else 0.0)
+        
+    def apply(self,rule,input,cut):
+        """Parses the given rule function at the input's position, 
+        using the recorded outcome if there is one. If cut is true 
+        and the rule succeeds, the parser is assumed never to 
+        backtrack past its start again, so entries for earlier 
+        positions are dropped."""
+        pos = input._pos
+        entries = self._table.get(pos)
+        if entries is None:
+            entries = self._table[pos] = {}
+        entry = entries.get(rule)
+        if entry is not None:
+            self.hits += 1
+            result,end,deepest = entry
+            if result is not None: input._pos = end
+            # reinstate the furthest position reached, for error reporting
+            f = input._furthest
+            if deepest > f[0]: f[0] = deepest
+            return result
+        self.misses += 1
+        result = rule(input)
+        entries[rule] = (result,input._pos,input.get_deepest_pos())
+        if cut and result is not None:
+            self.discard_before(pos)
+        return result
+        
+    def discard_before(self,pos):
+        """Drops the entries for positions before the given one"""
+        for p in [p for p in self._table if p < pos]:
+            del self._table[p]
+            
+
+def memoized(cut=False):
+    """Decorator for a rule's parse method which memoizes its 
+    results when the input is in packrat mode, i.e. has a Memo. 
+    See Memo.apply for the meaning of cut."""
+    def decorator(rule):
+        def parse(input):
+            memo = getattr(input,"_memo",None)
+            if memo is None:
+                return rule(input)
+            return memo.apply(rule,input,cut)
+        parse.__name__ = rule.__name__
+        parse.__doc__ = rule.__doc__
+        return parse
+    return decorator
 
 
 class ValidationError(Exception):
     pass
     
 
+class ReadOnlyList(collections.abc.Sequence):
+    """Sequence which can't be changed, viewing a tuple of its items. The 
+    parse tree holds its sections, items and choices in these, so that 
+    they can be handed out without being copied. It compares equal to a 
+    list of the same items and slices to a plain list"""
+    
+    __slots__ = ("_items",)
+    
+    def __init__(self,items=()):
+        self._items = tuple(items)
+        
+    def __getitem__(self,index):
+        if isinstance(index,slice):
+            return list(self._items[index])
+        return self._items[index]
+        
+    def __len__(self):
+        return len(self._items)
+        
+    def __iter__(self):
+        return iter(self._items)
+        
+    def __reversed__(self):
+        return reversed(self._items)
+        
+    def __contains__(self,item):
+        return item in self._items
+        
+    def __eq__(self,other):
+        if isinstance(other,ReadOnlyList):
+            return self._items == other._items
+        if isinstance(other,list):
+            return list(self._items) == other
+        return NotImplemented
+        
+    def __ne__(self,other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+        
+    __hash__ = None
+        
+    def __add__(self,other):
+        return list(self._items) + other
+        
+    def __radd__(self,other):
+        return other + list(self._items)
+        
+    def __repr__(self):
+        return repr(list(self._items))
+    
+    def _refuse(self,*args,**kargs):
+        raise TypeError("%s can't be changed" % type(self).__name__)
+        
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _refuse
+    append = extend = insert = pop = remove = clear = sort = reverse = _refuse
+    
+    def __reduce__(self):
+        return ReadOnlyList,(self._items,)
+
+
+def _read_only(items):
+    return items if isinstance(items,ReadOnlyList) else ReadOnlyList(items)
+
+
+class Diagnostic(object):
+    """A problem found in a document, with the name of the section 
+    it was found in and, where known, its line and column"""
+
+    ERROR = "error"
+    WARNING = "warning"
+
+    __slots__ = ("_message","_severity","_section","_line","_column")
+
+    message = property(lambda s: s._message)
+    severity = property(lambda s: s._severity)
+    section = property(lambda s: s._section)
+    line = property(lambda s: s._line)
+    column = property(lambda s: s._column)
+    
+    def __init__(self,message,severity=ERROR,section=None,line=None,column=None):
+        self._message = message
+        self._severity = severity
+        self._section = section
+        self._line = line
+        self._column = column
+        
+    def __repr__(self):
+        return "Diagnostic(%s,%s,%s,%s,%s)" % (repr(self._message),
+            repr(self._severity),repr(self._section),repr(self._line),
+            repr(self._column))
+            
+    def __str__(self):
+        return self._message
+    
+
 class Document(object):
 
-    _sections = None
-    sections = property(lambda s: list(s._sections))
-    _is_completed = False
+    __slots__ = ("_sections","_is_completed","_line_index","_diagnostics","_blocks",
+                 "_indexes","_firsts","_targets")
+
+    sections = property(lambda s: s._sections)
     is_completed = property(lambda s: s._is_completed)
+    line_index = property(lambda s: s._line_index)
     
-    def __init__(self,sections):
-        self._sections = sections
+    def __init__(self,sections,line_index=None,diagnostics=None,targets=None):
+        self._sections = _read_only(sections)
+        self._line_index = line_index
+        self._diagnostics = diagnostics
         self._is_completed = False
         for s in sections:
             if getattr(s,"is_completed",False):
                 self._is_completed = True
                 break
+        self._link(targets)
+        
+    def __reduce__(self):
+        # links are made again when unpickled, rather than pickling the 
+        # graph of sections they form
+        return (Document,(self._sections,self._line_index,self._diagnostics))
+        
+    def _link(self,targets=None):
+        """Finds the position of the section each choice's go-to names, or 
+        -1 if there's no go-to or no such section. Where sections share a 
+        name, the first of them is used. The links are kept by the 
+        document rather than the choices, which may be shared with other 
+        documents. Also numbers the choice blocks in document order, for 
+        Answers to refer to. Positions already known for every choice, 
+        in document order, can be given as targets, so that no names are 
+        looked up."""
+        self._indexes = None
+        keys = {}
+        for i,s in enumerate(self._sections):
+            if isinstance(s,(FirstSection,Section)) and s.key is not None:
+                keys.setdefault(s.key,i)
+        self._blocks = {}                   # block -> number
+        self._firsts = array.array("i")     # number -> index of first choice
+        self._targets = array.array("i")    # choice index -> section index
+        for s in self._sections:
+            if not isinstance(s,(FirstSection,Section)): continue
+            for b in s.items:
+                if isinstance(b,ChoiceBlock) and b not in self._blocks:
+                    self._blocks[b] = len(self._firsts)
+                    self._firsts.append(len(self._targets))
+                    if targets is None:
+                        self._targets.extend(keys.get(c.goto.lower(),-1) 
+                            if c.goto is not None else -1 for c in b.choices)
+                    else:
+                        self._targets.extend([-1]*len(b.choices))
+        if targets is not None:
+            if len(targets) != len(self._targets):
+                raise ValueError("Expected %d targets, got %d" % (
+                    len(self._targets),len(targets)))
+            if any(not -1 <= t < len(self._sections) for t in targets):
+                raise ValueError("Target out of range")
+            self._targets = array.array("i",targets)
         
     def __repr__(self):
         return "Document(%s)" % repr(self._sections)
+
+    def index(self,section):
+        """Returns the position of the section in the document"""
+        # only needed when stepping through, so found on first use
+        if self._indexes is None:
+            self._indexes = { s: i for i,s in enumerate(self._sections) 
+                              if isinstance(s,(FirstSection,Section)) }
+        try:
+            return self._indexes[section]
+        except KeyError:
+            raise ValueError("Section is not part of the document")
+
+    def target(self,block,choice):
+        """Returns the section the go-to of the choice at the given index in 
+        the block leads to, or None if it has no go-to or names no section"""
+        try:
+            first = self._firsts[self._blocks[block]]
+        except KeyError:
+            raise ValueError("Choice block is not part of the document")
+        if not 0 <= choice < len(block.choices):
+            raise IndexError("Choice index out of range")
+        target = self._targets[first+choice]
+        return self._sections[target] if target >= 0 else None
         
     @staticmethod
     def parse(input):
@@ -88,123 +486,281 @@ class Document(object):
         if sec is None: return None
         items.append(sec)
         
-        sec = ZeroOrMore(Section).parse(input)
+        sec = _SECTIONS.parse(input)
         if sec is None: return None
         items.extend(sec)
         
-        if Char(chr(0)).parse(input) is None: return None
+        if _END.parse(input) is None: return None
         
         input.commit()
-        doc = Document(items)
+        doc = Document(items,input.line_index)
                 
         return doc
         
-    def _walk_section(self,sec,endsec,path,lastlead,sections):
-        """Walks the goto graph from this section. Raises 
-        ValidationError for invalid path. Returns True if 
-        path to end found."""
+    @staticmethod
+    def _section_name(sec):
+        return sec.key if sec.key is not None else "first"
+        
+    def _section_flow(self,sec,endsec):
+        """Checks the flow rules which apply to the section on its own.
+        Returns the sections its go-tos lead to, leaving out unknown 
+        sections, and the message describing why the reader can't get 
+        through the section with the block or choice at fault, if any, 
+        or None."""
         
-        sname = sec.heading.lower() if hasattr(sec,"heading") else "first"
-        cbs = list(filter(lambda x: isinstance(x,ChoiceBlock), sec.items))
-        found_valid = False
+        sname = self._section_name(sec)
+        cbs = [b for b in sec.items if isinstance(b,ChoiceBlock)]
         
-        # end section is itself a valid path
-        # (at this point we assume it falls through)
-        if sec is endsec:
-            found_valid = True
-
         # only the end section may be choiceless
         if len(cbs)==0 and sec is not endsec:
-            raise ValidationError(('Section "%s" has no choice blocks and so '
-                    +'cannot reach end of document') % sname)
-
-        # iterate over choice blocks
-        for b in cbs:
+            return [], (('Section "%s" has no choice blocks and so '
+                    +'cannot reach end of document') % sname, None)
         
-            last_block = b is cbs[-1]
-            gcs = list(filter(lambda c: c.goto is not None, b.choices))
-            
-            # iterate over choices with gotos
-            for c in gcs:
+        targets = []
+        for b in cbs:
+            targets.extend(t for t in (self.target(b,i) for i in range(len(b.choices)))
+                if t is not None)
             
-                last_goto = last_block and c is gcs[-1]
-                target = sections[c.goto.lower()]
-                newpath = path+[sec]
-                newlastlead = ( len(newpath)-1 
-                        if found_valid or not last_goto else lastlead )
-                
-                # Is target a loop?
-                if target in newpath:
-                    # must be potential exit following the section
-                    if newlastlead==-1 or newlastlead < newpath.index(target):
-                        raise ValidationError('Dead-end loop found in section "%s"' % sname)    
-                else:
-                    # Recurse to target section
-                    if self._walk_section(target,endsec,newpath,
-                            newlastlead,sections):
-                        found_valid = True
-                        
             # if block doesnt fall through, stop
-            if not any([c.goto is None for c in b.choices]):
+            if all(c.goto is not None for c in b.choices):
                 # End section *must* fall all the way through
                 if sec is endsec:
-                    raise ValidationError(('End section "%s" has no '
-                        +'choices that reach end of document') % sname)
-                break
-        else:
-            # Fell through last block
-            # Only the end section may fall through
-            if sec is not endsec:
-                raise ValidationError(('Section "%s" has one or more '
-                    +'choices that reach end of section and so never '
-                    +'reach end of document') % sname)
+                    return targets, (('End section "%s" has no '
+                        +'choices that reach end of document') % sname, b)
+                return targets, None
+                
+        # Fell through last block
+        # Only the end section may fall through
+        if sec is not endsec:
+            fallen = next(c for c in cbs[-1].choices if c.goto is None)
+            return targets, (('Section "%s" has one or more '
+                +'choices that reach end of section and so never '
+                +'reach end of document') % sname, fallen)
+        return targets, None
+        
+    def _walk_sections(self,reported,report):
+        """Walks the goto graph from the first section, without recursion,
+        finding its strongly connected components with Tarjan's algorithm. 
+        A component is complete once everything it leads to has been 
+        walked, so it's known then whether it can reach the end section.
+        Reports invalid paths, treating sections already reported as 
+        reaching the end so that each problem is only reported once. 
+        Returns the sections visited."""
+    
+        endsec = self._sections[-1]
+        targets = {}    # section -> sections its go-tos lead to
+        index = {}      # section -> order visited in
+        low = {}        # section -> lowest index reachable in its component
+        closed = {}     # section -> order in which it first closed a loop
+        component = []  # visited sections with incomplete components
+        incomplete = set()
+        live = set()    # sections which can reach end of document
+        walk = []       # sections being walked, with their remaining go-tos
+        
+        def visit(sec):
+            targets[sec],problem = self._section_flow(sec,endsec)
+            index[sec] = low[sec] = len(index)
+            component.append(sec)
+            incomplete.add(sec)
+            walk.append((sec,iter(targets[sec]),problem))
+        
+        visit(self._sections[0])
+        while len(walk) > 0:
+            sec,remaining,problem = walk[-1]
+            for target in remaining:
+                if target not in index:
+                    visit(target)
+                    break
+                if target in incomplete:
+                    low[sec] = min(low[sec],index[target])
+                    closed.setdefault(sec,len(closed))
+            else:
+                walk.pop()
+                if problem is not None:
+                    message,at = problem
+                    report(message,sec,at=at)
+                if len(walk) > 0:
+                    parent = walk[-1][0]
+                    low[parent] = min(low[parent],low[sec])
+                if low[sec] != index[sec]:
+                    continue
+                
+                # sec's component is complete
+                i = len(component)-1
+                while component[i] is not sec:
+                    i -= 1
+                members = component[i:]
+                del component[i:]
+                incomplete.difference_update(members)
+                
+                if (endsec in members or any(m in reported for m in members)
+                        or any(t in live for m in members for t in targets[m])):
+                    live.update(members)
+                    continue
                     
-        return found_valid
-        
-    def _validate(self):
-    
-        # Collect sections into map, checking for duplicates        
-        sectionmap = {}
+                # No escape from the loop
+                closers = [m for m in members if m in closed]
+                if len(closers) > 0:
+                    closer = min(closers,key=lambda m: closed[m])
+                    report('Dead-end loop found in section "%s"' 
+                            % self._section_name(closer), closer)
+                    live.update(members)
+                    
+        return index
+        
+    def _validate(self,report):
+        """Checks the document, calling report with the message, the 
+        section and optionally the severity and the block or choice at 
+        fault of each problem found"""
+        reported = set()
+        def report_section(message,sec,severity=Diagnostic.ERROR,at=None):
+            reported.add(sec)
+            report(message,sec,severity,at)
+    
+        # Check for duplicate section names
+        names = set()
         for s in self.sections[1:]:
-            n = s.heading.lower()
-            if n in sectionmap:
-                raise ValidationError("Duplicate section name '%s'" % n)
-            sectionmap[n] = s
+            if s.key in names:
+                report_section("Duplicate section name '%s'" % s.key, s)
+            names.add(s.key)
 
         # Iterate over goto references, checking sections exist            
         for s in self.sections:
             for b in s.items:
                 if isinstance(b,ChoiceBlock):
-                    for c in b.choices:
-                        if c.goto is not None:
-                            n = c.goto.lower()
-                            if n not in sectionmap:
-                                raise ValidationError("Go-to references unknown section '%s'" % n)
+                    for i,c in enumerate(b.choices):
+                        if c.goto is not None and self.target(b,i) is None:
+                            report_section("Go-to references unknown section '%s'" 
+                                % c.goto.lower(), s, at=c)
                                                                 
         # walk all goto paths
-        self._walk_section(self.sections[0],self.sections[-1], 
-            [],-1,sectionmap)
+        visited = self._walk_sections(reported,report_section)
+        
+        for s in self.sections:
+            if s not in visited and s not in reported:
+                report(('Section "%s" cannot be reached from start of '
+                    +'document') % self._section_name(s), s, Diagnostic.WARNING)
+                
+    def diagnose(self):
+        """Checks the document, returning a list of Diagnostics 
+        describing every problem found. Marking choices doesn't affect 
+        the result, so the check is only made once."""
+        if self._diagnostics is None:
+            self._diagnostics = self._diagnose()
+        return list(self._diagnostics)
+        
+    def _diagnose(self):
+        diagnostics = []
+        def report(message,sec,severity=Diagnostic.ERROR,at=None):
+            line = column = None
+            pos = sec.pos
+            if pos is not None and at is not None and at.pos is not None:
+                # positions within a section are counted from its origin
+                pos += at.pos-sec.origin
+            if self._line_index is not None and pos is not None:
+                line,column = self._line_index.location(pos)
+            diagnostics.append(Diagnostic(message,severity,
+                self._section_name(sec),line,column))
+        self._validate(report)
+        return diagnostics
         
     def validate(self):
-        try:
-            self._validate()
-        except ValidationError as e:
-            return str(e)
+        """Checks the document, returning the message for the first 
+        error found, or None"""
+        for d in self.diagnose():
+            if d.severity == Diagnostic.ERROR:
+                return d.message
         return None
         
 
+class Answers(object):
+    """The choices one reader has made in a Document, kept apart from the 
+    document so that any number of readers can share one parsed tree. 
+    Holds the index of the choice selected in each choice block, in 
+    document order, or -1 for blocks not yet answered, which keep the 
+    marks they were parsed with."""
+
+    __slots__ = ("_document","_selected")
+
+    document = property(lambda s: s._document)
+
+    def __init__(self,document,selected=None):
+        self._document = document
+        if selected is None:
+            self._selected = array.array("i",[-1])*len(document._blocks)
+        else:
+            self._selected = array.array("i",selected)
+            if len(self._selected) != len(document._blocks):
+                raise ValueError("Expected %d answers, got %d" % (
+                    len(document._blocks),len(self._selected)))
+
+    def __repr__(self):
+        return "Answers(%s)" % repr(self._selected.tolist())
+
+    def copy(self):
+        """Returns new Answers with the same choices made"""
+        return Answers(self._document,self._selected)
+
+    def update(self,other):
+        """Takes on the choices made in other Answers for the same document"""
+        if other._document is not self._document:
+            raise ValueError("Answers are for a different document")
+        self._selected[:] = other._selected
+
+    def tolist(self):
+        """Returns the index selected in each choice block, in document 
+        order, or -1 for those not answered. Answers can be made again 
+        from the list and the document."""
+        return self._selected.tolist()
+
+    def _index(self,block):
+        try:
+            return self._document._blocks[block]
+        except KeyError:
+            raise ValueError("Choice block is not part of the document")
+
+    def select(self,block,choice):
+        """Selects the choice at the given index in the block, or with 
+        None, forgets the block's answer"""
+        if choice is not None and not 0 <= choice < len(block.choices):
+            raise IndexError("Choice index out of range")
+        self._selected[self._index(block)] = choice if choice is not None else -1
+
+    def selected(self,block):
+        """Returns the index of the choice selected in the block, or None 
+        if it hasn't been answered"""
+        choice = self._selected[self._index(block)]
+        return choice if choice >= 0 else None
+
+    def marks(self,block):
+        """Returns the mark of each of the block's choices: the selected 
+        one marked "X" and the rest unmarked, or if the block hasn't been 
+        answered, the marks it was parsed with"""
+        choice = self._selected[self._index(block)]
+        if choice < 0:
+            return [ c.mark for c in block.choices ]
+        return [ "X" if i == choice else None for i in range(len(block.choices)) ]
+
+
 class FirstSection(object):
 
-    _items = None
-    items = property(lambda s: list(s._items))
-    _feedback = None
+    __slots__ = ("_items","_feedback","_is_completed","_pos","_origin")
+
+    items = property(lambda s: s._items)
     feedback = property(lambda s: s._feedback)
-    _is_completed = False
     is_completed = property(lambda s: s._is_completed)
-
-    def __init__(self,items,feedback):
-        self._items = items
+    pos = property(lambda s: s._pos)
+    # the position of the section in the text it was parsed from, which 
+    # the positions of its blocks and choices are relative to
+    origin = property(lambda s: s._origin)
+    # the first section has no name, so can't be gone to
+    key = None
+
+    def __init__(self,items,feedback,pos=None,origin=None):
+        self._items = _read_only(items)
         self._feedback = feedback
+        self._pos = pos
+        self._origin = pos if origin is None else origin
         self._is_completed = False
         for i in items:
             if getattr(i,"is_completed",False):
@@ -220,27 +776,36 @@ class FirstSection(object):
     @staticmethod
     def parse(input):
         input = input.branch()        
+        pos = input.pos
         cont = SectionContent.parse(input)
         if cont is None: return None        
         input.commit()
-        return FirstSection(cont.items,cont.feedback)
+        return FirstSection(cont.items,cont.feedback,pos)
         
         
 class Section(object):
 
-    _heading = None
+    __slots__ = ("_heading","_key","_items","_feedback","_is_completed","_pos",
+        "_origin")
+
     heading = property(lambda s: s._heading)
-    _items = None
-    items = property(lambda s: list(s._items))
-    _feedback = None
+    # the heading normalized for go-tos to refer to
+    key = property(lambda s: s._key)
+    items = property(lambda s: s._items)
     feedback = property(lambda s: s._feedback)
-    _is_completed = False
     is_completed = property(lambda s: s._is_completed)
+    pos = property(lambda s: s._pos)
+    # the position of the section in the text it was parsed from, which 
+    # the positions of its blocks and choices are relative to
+    origin = property(lambda s: s._origin)
     
-    def __init__(self,heading,items,feedback):
+    def __init__(self,heading,items,feedback,pos=None,origin=None):
         self._heading = heading
-        self._items = items
+        self._key = sys.intern(heading.lower())
+        self._items = _read_only(items)
         self._feedback = feedback
+        self._pos = pos
+        self._origin = pos if origin is None else origin
         self._is_completed = False
         for i in items:
             if getattr(i,"is_completed",False):
@@ -254,8 +819,10 @@ class Section(object):
             repr(self._heading),repr(self._items),repr(self._feedback) )
         
     @staticmethod
+    @memoized(cut=True)
     def parse(input):
         input = input.branch()
+        pos = input.pos
         
         head = Heading.parse(input)
         if head is None: return None
@@ -264,18 +831,18 @@ class Section(object):
         if cont is None: return None
         
         input.commit()
-        return Section(head.name,cont.items,cont.feedback)
+        return Section(head.name,cont.items,cont.feedback,pos)
         
         
 class SectionContent(object):
     
-    _items = None
-    items = property(lambda s: list(s._items))
-    _feedback = None
+    __slots__ = ("_items","_feedback")
+
+    items = property(lambda s: s._items)
     feedback = property(lambda s: s._feedback)
     
     def __init__(self,items,feedback):
-        self._items = items
+        self._items = _read_only(items)
         self._feedback = feedback
         
     def __repr__(self):
@@ -290,16 +857,14 @@ class SectionContent(object):
         flines = []
         
         while True:
-            l = Alternatives(BlankLine,
-                    Sequence(Not(StarterLine),FeedbackLine)).parse(input)
+            l = _LEADING_LINE.parse(input)
             if l is None:
                 break
             elif isinstance(l,list) and isinstance(l[1],FeedbackLine):
                 flines.append(l[1].text)
                 
         while True:
-            i = Alternatives(ChoiceBlock,InstructionBlock,
-                TextBlock).parse(input)
+            i = _BLOCK.parse(input)
             if i is None: break
             items.append(i)
             if not isinstance(i,ChoiceBlock) and i.feedback is not None:
@@ -320,7 +885,10 @@ class SectionContent(object):
     
 class Heading(object):
 
-    _name = None
+    FIRST = frozenset(" \t>=")
+
+    __slots__ = ("_name",)
+
     name = property(lambda s: s._name)
     
     def __init__(self,name):
@@ -330,14 +898,15 @@ class Heading(object):
         return "Heading(%s)" % repr(self._name)
         
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
     
-        Optional(QuoteMarker).parse(input)
+        _OPTIONAL_QUOTEMARKER.parse(input)
     
         if HeadingMarker.parse(input) is None: return None
         
-        Optional(LineWhitespace).parse(input)
+        _OPTIONAL_LINEWHITESPACE.parse(input)
         
         name = Name.parse(input)
         if name is None: return None
@@ -352,32 +921,41 @@ class Heading(object):
 
 class QuoteMarker(object):
 
+    __slots__ = ()
+
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
-        if OneOrMore(Sequence(ZeroOrMore(Char(' \t')),
-                Char('>'))).parse(input) is None: return None
-        ZeroOrMore(Char(' \t')).parse(input)
+        if _QUOTES.parse(input) is None: return None
+        _OPTIONAL_WHITESPACE.parse(input)
         input.commit()
-        return QuoteMarker()
+        return QuoteMarker.INST
+
+QuoteMarker.INST = QuoteMarker()
 
 
 class HeadingMarker(object):
 
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()
-        if Char("=").parse(input) is None: return None
-        if OneOrMore(Char("=")).parse(input) is None: return None
+        if _EQUALS.parse(input) is None: return None
+        if _MORE_EQUALS.parse(input) is None: return None
         input.commit()
-        return HeadingMarker()
+        return HeadingMarker.INST
+
+HeadingMarker.INST = HeadingMarker()
 
 
 class Name(object):
 
     _CHARACTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-"
     
-    _text = None
+    __slots__ = ("_text",)
+
     text = property(lambda s: s._text)
     
     def __init__(self,text):
@@ -390,42 +968,43 @@ class Name(object):
     def parse(input):
         input = input.branch()
     
-        i = []
-        r = Char(Name._CHARACTERS).parse(input)
-        if r is None: return None
-        i.append(r)
-        
-        r = ZeroOrMore(Char(Name._CHARACTERS+" ")).parse(input)
-        if r is None: return None
-        i.extend(r)
+        text = _NAME_TEXT.parse(input)
+        if text is None: return None
     
         input.commit()
-        return Name("".join(i).strip())
+        return Name(text.strip())
         
 
 class Newline(object):
 
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()
-        if Alternatives(Sequence(Char("\r"),Char("\n")),
-                Char("\n"),Char("\r")).parse(input) is None: return None
+        if _NEWLINE.parse(input) is None: return None
         input.commit()
-        return Newline()
+        return Newline.INST
+
+Newline.INST = Newline()
 
 
 class ChoiceBlock(object):
     
-    _choices = None
-    choices = property(lambda s: list(s._choices))
-    _feedback = None
+    FIRST = frozenset(" \t>:")
+
+    __slots__ = ("_choices","_feedback","_is_completed","_pos")
+
+    choices = property(lambda s: s._choices)
     feedback = property(lambda s: s._feedback)
-    _is_completed = False
     is_completed = property(lambda s: s._is_completed)
+    # the position in the text it was parsed from
+    pos = property(lambda s: s._pos)
     
-    def __init__(self,choices,feedback):
-        self._choices = choices
+    def __init__(self,choices,feedback,pos=None):
+        self._choices = _read_only(choices)
         self._feedback = feedback
+        self._pos = pos
         self._is_completed = False
         for c in choices:
             if c.mark is not None:
@@ -439,8 +1018,10 @@ class ChoiceBlock(object):
             repr(self._choices),repr(self._feedback) )
         
     @staticmethod
+    @memoized(cut=True)
     def parse(input):
         input.branch()
+        pos = input.pos
         
         choices = []
         flines = []
@@ -452,8 +1033,7 @@ class ChoiceBlock(object):
             flines.append(l.feedback)
 
         while True:
-            l = Alternatives(BlankLine,Choice,
-                Sequence(Not(StarterLine),FeedbackLine)).parse(input)
+            l = _CHOICE_BLOCK_LINE.parse(input)
             if l is None:
                 break
             elif isinstance(l,Choice):
@@ -465,14 +1045,16 @@ class ChoiceBlock(object):
         
         input.commit()
         return ChoiceBlock(choices,
-            " ".join(flines) if len(flines)>0 else None)
+            " ".join(flines) if len(flines)>0 else None, pos)
     
     
 class InstructionBlock(object):
     
-    _text = None
+    FIRST = frozenset(" \t>%")
+
+    __slots__ = ("_text","_feedback")
+
     text = property(lambda s: s._text)
-    _feedback = None
     feedback = property(lambda s: s._feedback)
     
     def __init__(self,text,feedback):
@@ -484,6 +1066,7 @@ class InstructionBlock(object):
             repr(self._text),repr(self._feedback))
         
     @staticmethod
+    @memoized(cut=True)
     def parse(input):
         input = input.branch()
         
@@ -495,8 +1078,7 @@ class InstructionBlock(object):
         tlines.append(l.text)
         
         while True:
-            l = Alternatives(BlankLine,InstructionLine,
-                Sequence(Not(StarterLine),FeedbackLine)).parse(input)
+            l = _INSTRUCTION_BLOCK_LINE.parse(input)
             if l is None: 
                 break
             elif isinstance(l,InstructionLine):
@@ -511,9 +1093,11 @@ class InstructionBlock(object):
     
 class TextBlock(object):
     
-    _text = None
+    FIRST = frozenset(" \t>:")
+
+    __slots__ = ("_text","_feedback")
+
     text = property(lambda s: s._text)
-    _feedback = None
     feedback = property(lambda s: s._feedback)
     
     def __init__(self,text,feedback):
@@ -525,6 +1109,7 @@ class TextBlock(object):
             repr(self._text),repr(self._feedback) )
     
     @staticmethod
+    @memoized(cut=True)
     def parse(input):
         input = input.branch()
         
@@ -536,8 +1121,7 @@ class TextBlock(object):
         tlines.append(l.text)
         
         while True:
-            l = Alternatives(BlankLine,TextLine,
-                    Sequence(Not(StarterLine),FeedbackLine)).parse(input)
+            l = _TEXT_BLOCK_LINE.parse(input)
             if l is None: 
                 break
             elif isinstance(l,TextLine):
@@ -552,7 +1136,10 @@ class TextBlock(object):
     
 class TextLine(object):
 
-    _text = None
+    FIRST = frozenset(" \t>:")
+
+    __slots__ = ("_text",)
+
     text = property(lambda s: s._text)
     
     def __init__(self,text):
@@ -562,10 +1149,11 @@ class TextLine(object):
         return "TextLine(%s)" % repr(self._text)
         
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
     
-        Optional(QuoteMarker).parse(input)
+        _OPTIONAL_QUOTEMARKER.parse(input)
     
         if TextLineMarker.parse(input) is None: return None
 
@@ -578,7 +1166,10 @@ class TextLine(object):
 
 class FirstTextLine(object):
 
-    _text = None
+    FIRST = frozenset(" \t>:")
+
+    __slots__ = ("_text",)
+
     text = property(lambda s: s._text)
     
     def __init__(self,text):
@@ -588,10 +1179,11 @@ class FirstTextLine(object):
         return "FirstTextLine(%s)" % repr(self._text)
 
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
     
-        Optional(QuoteMarker).parse(input)
+        _OPTIONAL_QUOTEMARKER.parse(input)
     
         if FirstTextLineMarker.parse(input) is None: return None
 
@@ -604,7 +1196,8 @@ class FirstTextLine(object):
 
 class TextLineContent(object):
 
-    _text = None
+    __slots__ = ("_text",)
+
     text = property(lambda s: s._text)
 
     def __init__(self,text):
@@ -614,10 +1207,11 @@ class TextLineContent(object):
         return "TextLineContent(%s)" % repr(self._text)
 
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
         
-        Optional(LineWhitespace).parse(input)
+        _OPTIONAL_LINEWHITESPACE.parse(input)
         
         text = LineText.parse(input)
         if text is None: return None
@@ -630,29 +1224,37 @@ class TextLineContent(object):
 
 class TextLineMarker(object):
 
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()
-        if Char(":").parse(input) is None: return None
-        if Not(Char(":")).parse(input) is None: return None
+        if _COLON.parse(input) is None: return None
+        if _NOT_COLON.parse(input) is None: return None
         input.commit()
-        return TextLineMarker()
+        return TextLineMarker.INST
+
+TextLineMarker.INST = TextLineMarker()
 
 
 class FirstTextLineMarker(object):
 
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()
-        if Char(":").parse(input) is None: return None
-        if Char(":").parse(input) is None: return None
+        if _DOUBLE_COLON.parse(input) is None: return None
         input.commit()
-        return FirstTextLineMarker()
+        return FirstTextLineMarker.INST
+
+FirstTextLineMarker.INST = FirstTextLineMarker()
 
 
 class LineText(object):
 
-    _text = None
+    __slots__ = ("_text",)
+
     text = property(lambda s: s._text)
     
     def __init__(self,text):
@@ -662,48 +1264,63 @@ class LineText(object):
         return "LineText(%s)" % repr(self._text)
         
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
         
-        i = OneOrMore(Char(ALL_CHARACTERS)).parse(input)
-        if i is None: return None
+        text = _LINE_TEXT.parse(input)
+        if text is None: return None
         
         input.commit()
-        return LineText("".join(i).strip())
+        return LineText(text.strip())
 
 
 class BlankLine(object):
 
+    FIRST = frozenset(" \t>\r\n")
+
+    __slots__ = ()
+
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
         
-        Optional(QuoteMarker).parse(input)
+        _OPTIONAL_QUOTEMARKER.parse(input)
         
-        Optional(LineWhitespace).parse(input)
+        _OPTIONAL_LINEWHITESPACE.parse(input)
 
         if Newline.parse(input) is None: return None
 
         input.commit()        
-        return BlankLine()
+        return BlankLine.INST
         
     def __repr__(self):
         return "BlankLine()"
 
+BlankLine.INST = BlankLine()
+
 
 class LineWhitespace(object):
 
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()        
-        if OneOrMore(Char(" \t")).parse(input) is None: return None        
+        if _WHITESPACE.parse(input) is None: return None        
         input.commit()
-        return LineWhitespace()
+        return LineWhitespace.INST
+
+LineWhitespace.INST = LineWhitespace()
 
 
 class InstructionLine(object):
     
-    _text = None
+    FIRST = frozenset(" \t>%")
+
+    __slots__ = ("_text",)
+
     text = property(lambda s: s._text)
     
     def __init__(self,text):
@@ -713,10 +1330,11 @@ class InstructionLine(object):
         return "InstructionLine(%s)" % repr(self._text)
         
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()    
         
-        Optional(QuoteMarker).parse(input)
+        _OPTIONAL_QUOTEMARKER.parse(input)
         
         if InstructionLineMarker.parse(input) is None: return None
 
@@ -729,18 +1347,25 @@ class InstructionLine(object):
 
 class InstructionLineMarker(object):
 
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()        
-        if Char('%').parse(input) is None: return None
-        if Not(Char('%')).parse(input) is None: return None
+        if _PERCENT.parse(input) is None: return None
+        if _NOT_PERCENT.parse(input) is None: return None
         input.commit()
-        return InstructionLineMarker()
+        return InstructionLineMarker.INST
+
+InstructionLineMarker.INST = InstructionLineMarker()
 
 
 class FirstInstructionLine(object):
     
-    _text = None
+    FIRST = frozenset(" \t>%")
+
+    __slots__ = ("_text",)
+
     text = property(lambda s: s._text)
     
     def __init__(self,text):
@@ -750,10 +1375,11 @@ class FirstInstructionLine(object):
         return "FirstInstructionLine(%s)" % repr(self._text)
         
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()    
         
-        Optional(QuoteMarker).parse(input)
+        _OPTIONAL_QUOTEMARKER.parse(input)
         
         if FirstInstructionLineMarker.parse(input) is None: return None
 
@@ -766,34 +1392,39 @@ class FirstInstructionLine(object):
 
 class FirstInstructionLineMarker(object):
 
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()
-        if Char('%').parse(input) is None: return None
-        if Char('%').parse(input) is None: return None
+        if _DOUBLE_PERCENT.parse(input) is None: return None
         input.commit()
-        return FirstInstructionLineMarker()
+        return FirstInstructionLineMarker.INST
+
+FirstInstructionLineMarker.INST = FirstInstructionLineMarker()
 
 
 class Choice(object):
 
-    _mark = None
+    FIRST = frozenset(" \t>:")
+
+    __slots__ = ("_mark","_description","_response","_goto","_feedback","_pos")
+
     mark = property(lambda s: s._mark)
-    _description = None
     description = property(lambda s: s._description)
-    _response = None
     response = property(lambda s: s._response)
-    _goto = None
     goto = property(lambda s: s._goto)
-    _feedback = None
     feedback = property(lambda s: s._feedback)
+    # the position in the text it was parsed from
+    pos = property(lambda s: s._pos)
 
-    def __init__(self,mark,description,response,goto,feedback):
+    def __init__(self,mark,description,response,goto,feedback,pos=None):
         self._mark = mark
         self._description = description
         self._response = response
         self._goto = goto
         self._feedback = feedback
+        self._pos = pos
         
     def __repr__(self):
         return "Choice(%s,%s,%s,%s,%s)" % ( repr(self._mark),
@@ -804,14 +1435,16 @@ class Choice(object):
         self._mark = mark
             
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
+        pos = input.pos
         
-        Optional(QuoteMarker).parse(input)
+        _OPTIONAL_QUOTEMARKER.parse(input)
 
         if TextLineMarker.parse(input) is None: return None
 
-        Optional(LineWhitespace).parse(input)
+        _OPTIONAL_LINEWHITESPACE.parse(input)
         
         marker = ChoiceMarker.parse(input)
         if marker is None: return None
@@ -821,28 +1454,30 @@ class Choice(object):
         
         input.commit()
         return Choice(marker.mark,content.description,
-            content.response,content.goto,content.feedback)
+            content.response,content.goto,content.feedback,pos)
         
         
 class FirstChoice(object):
 
-    _mark = None
+    FIRST = frozenset(" \t>:")
+
+    __slots__ = ("_mark","_description","_response","_goto","_feedback","_pos")
+
     mark = property(lambda s: s._mark)
-    _description = None
     description = property(lambda s: s._description)
-    _response = None
     response = property(lambda s: s._response)
-    _goto = None
     goto = property(lambda s: s._goto)
-    _feedback = None
     feedback = property(lambda s: s._feedback)
+    # the position in the text it was parsed from
+    pos = property(lambda s: s._pos)
 
-    def __init__(self,mark,description,response,goto,feedback):
+    def __init__(self,mark,description,response,goto,feedback,pos=None):
         self._mark = mark
         self._description = description
         self._response = response
         self._goto = goto
         self._feedback = feedback
+        self._pos = pos
         
     def __repr__(self):
         return "FirstChoice(%s,%s,%s,%s,%s)" % ( repr(self._mark),
@@ -853,14 +1488,16 @@ class FirstChoice(object):
         self._mark = mark
             
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
+        pos = input.pos
         
-        Optional(QuoteMarker).parse(input)
+        _OPTIONAL_QUOTEMARKER.parse(input)
 
         if FirstTextLineMarker.parse(input) is None: return None
 
-        Optional(LineWhitespace).parse(input)
+        _OPTIONAL_LINEWHITESPACE.parse(input)
         
         marker = ChoiceMarker.parse(input)
         if marker is None: return None
@@ -870,12 +1507,13 @@ class FirstChoice(object):
         
         input.commit()
         return FirstChoice(marker.mark,content.description,
-            content.response,content.goto,content.feedback)
+            content.response,content.goto,content.feedback,pos)
         
 
 class ChoiceMarker(object):
     
-    _mark = None
+    __slots__ = ("_mark",)
+
     mark = property(lambda s: s._mark)
     
     def __init__(self,mark):
@@ -885,14 +1523,15 @@ class ChoiceMarker(object):
         return "ChoiceMarker(%s)" % repr(self._mark)
         
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
                 
         if ChoiceMarkerOpen.parse(input) is None: return None
         
-        Optional(LineWhitespace).parse(input)
+        _OPTIONAL_LINEWHITESPACE.parse(input)
         
-        mark = Optional(ChoiceMarkerMark).parse(input)
+        mark = _OPTIONAL_CHOICEMARKERMARK.parse(input)
         if mark is None: return None
         
         if ChoiceMarkerClose.parse(input) is None: return None
@@ -903,27 +1542,36 @@ class ChoiceMarker(object):
 
 class ChoiceMarkerOpen(object):
     
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()
-        if Char('[').parse(input) is None: return None
+        if _OPEN_BRACKET.parse(input) is None: return None
         input.commit()
-        return ChoiceMarkerOpen()
+        return ChoiceMarkerOpen.INST
+
+ChoiceMarkerOpen.INST = ChoiceMarkerOpen()
     
     
 class ChoiceMarkerClose(object):
     
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()
-        if Char(']').parse(input) is None: return None
+        if _CLOSE_BRACKET.parse(input) is None: return None
         input.commit()
-        return ChoiceMarkerClose()
+        return ChoiceMarkerClose.INST
+
+ChoiceMarkerClose.INST = ChoiceMarkerClose()
     
     
 class ChoiceMarkerMark(object):
 
-    _text = None
+    __slots__ = ("_text",)
+
     text = property(lambda s: s._text)
 
     def __init__(self,text):
@@ -936,22 +1584,20 @@ class ChoiceMarkerMark(object):
     def parse(input):
         input = input.branch()
 
-        i = OneOrMore(Char(ALL_CHARACTERS.replace("]",""))).parse(input)
-        if i is None: return None            
+        text = _MARK_TEXT.parse(input)
+        if text is None: return None            
         
         input.commit()
-        return ChoiceMarkerMark("".join(i).strip())
+        return ChoiceMarkerMark(text.strip())
 
 
 class ChoiceContent(object):
 
-    _description = None
+    __slots__ = ("_description","_response","_goto","_feedback")
+
     description = property(lambda s: s._description)
-    _response = None
     response = property(lambda s: s._response)
-    _goto = None
     goto = property(lambda s: s._goto)
-    _feedback = None
     feedback = property(lambda s: s._feedback)
 
     def __init__(self,description,response,goto,feedback):
@@ -966,17 +1612,18 @@ class ChoiceContent(object):
             repr(self._goto),repr(self._feedback) )
         
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
         
-        Optional(LineWhitespace).parse(input)
+        _OPTIONAL_LINEWHITESPACE.parse(input)
         
         desc = ChoiceDescription.parse(input)
         if desc is None: return None
         
-        resp = Optional(ChoiceResponse).parse(input)
+        resp = _OPTIONAL_CHOICERESPONSE.parse(input)
 
-        Optional(LineWhitespace).parse(input)
+        _OPTIONAL_LINEWHITESPACE.parse(input)
         
         if Newline.parse(input) is None: return None
         
@@ -994,9 +1641,9 @@ class ChoiceContent(object):
     
 class ChoiceDescription(object):
     
-    _text = None
+    __slots__ = ("_text","_feedback")
+
     text = property(lambda s: s._text)
-    _feedback = None
     feedback = property(lambda s: s._feedback)
     
     def __init__(self,text,feedback):
@@ -1018,8 +1665,7 @@ class ChoiceDescription(object):
         if p is None: return None
         parts.append(p.text.strip())
         
-        ps = ZeroOrMore(Sequence(
-            ChoiceDescNewline,ChoiceDescPart)).parse(input)
+        ps = _DESC_CONTINUATION.parse(input)
         if ps is None: return None
         parts.extend([p[1].text for p in ps])
         flines.extend(list(filter(lambda x: x is not None,
@@ -1032,7 +1678,8 @@ class ChoiceDescription(object):
 
 class ChoiceDescNewline(object):
 
-    _feedback = None
+    __slots__ = ("_feedback",)
+
     feedback = property(lambda s: s._feedback)
     
     def __init__(self,feedback):
@@ -1042,6 +1689,7 @@ class ChoiceDescNewline(object):
         return "ChoiceDescNewline(%s)" % repr(self._feedback)
 
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
         
@@ -1050,23 +1698,19 @@ class ChoiceDescNewline(object):
         if Newline.parse(input) is None: return None
 
         while True:
-            l = Alternatives(
-                    BlankLine,
-                    Sequence(
-                        Not(Alternatives(StarterLine,TextLine)),
-                        FeedbackLine)).parse(input)
+            l = _DESC_NEWLINE_LINE.parse(input)
             if l is None:
                 break
             elif isinstance(l,list) and isinstance(l[1],FeedbackLine):
                 flines.append(l[1].text)
     
-        Optional(QuoteMarker).parse(input)
+        _OPTIONAL_QUOTEMARKER.parse(input)
         
         if TextLineMarker.parse(input) is None: return None
         
-        Optional(LineWhitespace).parse(input)
+        _OPTIONAL_LINEWHITESPACE.parse(input)
         
-        if Not(ChoiceMarker).parse(input) is None: return None
+        if _NOT_CHOICEMARKER.parse(input) is None: return None
         
         input.commit()
         return ChoiceDescNewline(
@@ -1075,7 +1719,8 @@ class ChoiceDescNewline(object):
     
 class ChoiceDescPart(object):
 
-    _text = None
+    __slots__ = ("_text",)
+
     text = property(lambda s: s._text)
     
     def __init__(self,text):
@@ -1087,22 +1732,18 @@ class ChoiceDescPart(object):
     @staticmethod
     def parse(input):
         input = input.branch()
-        text = OneOrMore(Alternatives(
-                Char(ALL_CHARACTERS.replace("-","")),
-                Sequence(Char('-'),Not(Char('-'))))).parse(input)
+        text = _DESC_TEXT.parse(input)
         if text is None: return None
         input.commit()
-        return ChoiceDescPart("".join(
-                [t[0] if isinstance(t,list) else t for t in text]).strip())
+        return ChoiceDescPart(text.strip())
         
     
 class ChoiceResponse(object):
     
-    _description = None
+    __slots__ = ("_description","_goto","_feedback")
+
     description = property(lambda s: s._description)
-    _goto = None
     goto = property(lambda s: s._goto)
-    _feedback = None
     feedback = property(lambda s: s._feedback)
     
     def __init__(self,description,goto,feedback):
@@ -1118,14 +1759,11 @@ class ChoiceResponse(object):
     def parse(input):
         input = input.branch()
 
-        n1 = Optional(ChoiceDescNewline).parse(input)
+        n1 = _OPTIONAL_CHOICEDESCNEWLINE.parse(input)
         
         if ChoiceResponseSeparator.parse(input) is None: return None
 
-        result = Sequence(
-            Optional(ChoiceDescNewline),
-            ChoiceResponseDesc,
-            Optional(ChoiceGoto)).parse(input)
+        result = _RESPONSE_DESC_AND_GOTO.parse(input)
         if result is not None:
             n2 = result[0]
             desc = result[1]
@@ -1153,20 +1791,23 @@ class ChoiceResponse(object):
 
 class ChoiceResponseSeparator(object):
 
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()
-        if Char('-').parse(input) is None: return None
-        if Char('-').parse(input) is None: return None
+        if _DOUBLE_HYPHEN.parse(input) is None: return None
         input.commit()
-        return ChoiceResponseSeparator()
+        return ChoiceResponseSeparator.INST
+
+ChoiceResponseSeparator.INST = ChoiceResponseSeparator()
                 
 
 class ChoiceResponseDesc(object):
 
-    _text = None
+    __slots__ = ("_text","_feedback")
+
     text = property(lambda s: s._text)
-    _feedback = None
     feedback = property(lambda s: s._feedback)
     
     def __init__(self,text,feedback):
@@ -1188,8 +1829,7 @@ class ChoiceResponseDesc(object):
         if p is None: return None
         parts.append(p.text)
         
-        ps = ZeroOrMore(Sequence(
-            ChoiceDescNewline,ChoiceResponseDescPart)).parse(input)
+        ps = _RESPONSE_CONTINUATION.parse(input)
         if ps is None: return None
         parts.extend([p[1].text for p in ps])
         flines.extend(list(filter(lambda s: s is not None, 
@@ -1202,7 +1842,8 @@ class ChoiceResponseDesc(object):
         
 class ChoiceResponseDescPart(object):
 
-    _text = None
+    __slots__ = ("_text",)
+
     text = property(lambda s: s._text)
     
     def __init__(self,text):
@@ -1213,25 +1854,18 @@ class ChoiceResponseDescPart(object):
         
     @staticmethod
     def parse(input):
-        input.branch()
-        text = OneOrMore(Alternatives(
-                Char(ALL_CHARACTERS.replace("G","")),
-                Sequence(
-                    Char('G'),
-                    Not(Sequence(Char('O'),Char(' '),Char('T'),Char('O')))
-                )
-            )).parse(input)
+        input = input.branch()
+        text = _RESPONSE_TEXT.parse(input)
         if text is None: return None
         input.commit()
-        return ChoiceResponseDescPart("".join(
-                [t[0] if isinstance(t,list) else t for t in text]).strip())
+        return ChoiceResponseDescPart(text.strip())
         
         
 class ChoiceGoto(object):
         
-    _secname = None
+    __slots__ = ("_secname","_feedback")
+
     secname = property(lambda s: s._secname)
-    _feedback = None
     feedback = property(lambda s: s._feedback)
         
     def __init__(self,secname,feedback):
@@ -1246,16 +1880,16 @@ class ChoiceGoto(object):
     def parse(input):
         input = input.branch()
 
-        nl = Optional(ChoiceDescNewline).parse(input)
+        nl = _OPTIONAL_CHOICEDESCNEWLINE.parse(input)
         
         if GotoMarker.parse(input) is None: return None
         
-        Optional(LineWhitespace).parse(input)
+        _OPTIONAL_LINEWHITESPACE.parse(input)
         
         secname = Name.parse(input)
         if secname is None: return None
         
-        Optional(EndPunctuation).parse(input)
+        _OPTIONAL_ENDPUNCTUATION.parse(input)
         
         input.commit()
         return ChoiceGoto( secname.text,
@@ -1264,30 +1898,40 @@ class ChoiceGoto(object):
         
 class GotoMarker(object):
     
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()
-        if Sequence(Char('G'),Char('O'),Char(' '),
-                Char('T'),Char('O')).parse(input) is None: return None
+        if _GOTO.parse(input) is None: return None
         input.commit()
-        return GotoMarker()
+        return GotoMarker.INST
+
+GotoMarker.INST = GotoMarker()
     
     
 class EndPunctuation(object):
     
     _CHARACTERS = ".,!?;:"
     
+    __slots__ = ()
+
     @staticmethod
     def parse(input):
         input = input.branch()
-        if OneOrMore(Char(EndPunctuation._CHARACTERS)).parse(input) is None: return None
+        if _END_PUNCTUATION.parse(input) is None: return None
         input.commit()
-        return EndPunctuation()
+        return EndPunctuation.INST
+
+EndPunctuation.INST = EndPunctuation()
         
         
 class FeedbackLine(object):
 
-    _text = None
+    FIRST = frozenset(ALL_CHARACTERS)
+
+    __slots__ = ("_text",)
+
     text = property(lambda s: s._text)
 
     def __init__(self,text):
@@ -1297,10 +1941,11 @@ class FeedbackLine(object):
         return "FeedbackLine(%s)" % self._text
         
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
         
-        Optional(QuoteMarker).parse(input)
+        _OPTIONAL_QUOTEMARKER.parse(input)
 
         text = LineText.parse(input)
         if text is None: return None
@@ -1313,7 +1958,10 @@ class FeedbackLine(object):
 
 class StarterLine(object):
 
-    _line = None
+    FIRST = frozenset(" \t>:%=")
+
+    __slots__ = ("_line",)
+
     line = property(lambda s: s._line)
 
     def __init__(self,line):
@@ -1323,11 +1971,11 @@ class StarterLine(object):
         return "StarterLine(%s)" % repr(self._line)
         
     @staticmethod
+    @memoized()
     def parse(input):
         input = input.branch()
         
-        line = Alternatives(FirstTextLine,FirstInstructionLine,
-            Heading,FirstChoice).parse(input)
+        line = _STARTER.parse(input)
         if line is None: return None
         
         input.commit()
@@ -1335,16 +1983,39 @@ class StarterLine(object):
         
 
 class Alternatives(object):
-    """( A | B ) implementation"""
+    """( A | B ) implementation. Rules and combinators may give the set 
+    of symbols they can start with as FIRST, in which case they're only 
+    tried when the next symbol is one of them. Those without a FIRST set, 
+    such as ones which can match nothing, are always tried"""
     
     _alts = None
+    _viable = None
+    _others = None
     
     def __init__(self,*alts):
         self._alts = alts
+        firsts = [ _first(a) for a in alts ]
+        if any(f is not None for f in firsts):
+            self._others = tuple( a for a,f in zip(alts,firsts) if f is None )
+            self._viable = {}
+            for c in frozenset().union(*[ f for f in firsts if f is not None ]):
+                self._viable[c] = tuple( a for a,f in zip(alts,firsts) 
+                    if f is None or c in f )
+        
+    @property
+    def FIRST(self):
+        firsts = [ _first(a) for a in self._alts ]
+        if any(f is None for f in firsts): return None
+        return frozenset().union(*firsts)
         
     def parse(self,input):
         input = input.branch()
-        for a in self._alts:
+        alts = self._alts
+        if self._viable is not None:
+            peek = getattr(input,"peek",None)
+            if peek is not None:
+                alts = self._viable.get(peek(),self._others)
+        for a in alts:
             r = a.parse(input)
             if r is not None: 
                 input.commit()
@@ -1356,6 +2027,7 @@ class OneOrMore(object):
     """A+ implementation"""
     
     _item = None
+    FIRST = property(lambda s: _first(s._item))
     
     def __init__(self,item):
         self._item = item
@@ -1434,6 +2106,7 @@ class Sequence(object):
     """A B implementation"""
     
     _items = None
+    FIRST = property(lambda s: _first(s._items[0]) if len(s._items) > 0 else None)
     
     def __init__(self,*items):
         self._items = items
@@ -1464,14 +2137,40 @@ class Not(object):
         return False
             
         
+class Literal(object):
+    """Parses the given string of symbols, like a Sequence of Chars, 
+    but with a single comparison. Returns the string"""
+    
+    _text = None
+    FIRST = property(lambda s: frozenset(s._text[:1]))
+    
+    def __init__(self,text):
+        self._text = text
+        
+    def parse(self,input):
+        return input.literal(self._text)
+        
+        
+class NotLiteral(Literal):
+    """Not(Literal(text)) implementation"""
+    
+    FIRST = None
+    
+    def parse(self,input):
+        if input.branch().literal(self._text) is not None:
+            return None
+        return False
+
+
 class Char(object):
     """Parses a single symbol of those specified in 
     the given string"""
 
     _chars = None
+    FIRST = property(lambda s: s._chars)
     
     def __init__(self,chars):
-        self._chars = chars
+        self._chars = frozenset(chars)
         
     def parse(self,input):
         input = input.branch()
@@ -1481,5 +2180,117 @@ class Char(object):
         return c
 
 
+class CharRun(object):
+    """Parses one or more symbols of those specified in the 
+    given string, like OneOrMore(Char(chars)), but consumes the 
+    whole run at once and returns it as a string"""
+    
+    _pattern = None
+    _chars = None
+    FIRST = property(lambda s: s._chars)
+    
+    def __init__(self,chars):
+        self._pattern = re.compile("[%s]+" % re.escape(chars))
+        self._chars = frozenset(chars)
+        
+    def parse(self,input):
+        return input.match(self._pattern)
+
+
+class Pattern(object):
+    """Parses a non-empty match of the given regular expression in one 
+    go, returning it as a string. The expression stands in for a tree 
+    of combinators, so that a terminal rule costs a single match. Where 
+    those combinators would look past the end of the match, the 
+    expression given as ahead says how far, so that parse errors are 
+    reported at the same position"""
+    
+    _pattern = None
+    
+    def __init__(self,pattern,ahead=None):
+        if ahead is not None:
+            pattern = "(?:%s)(?=(%s)?)" % (pattern,ahead)
+        self._pattern = re.compile(pattern)
+        
+    def parse(self,input):
+        r = input.match(self._pattern)
+        if not r: return None
+        return r
+
+
+def _first(parser):
+    """Returns the FIRST set of the rule or combinator, or None if it 
+    doesn't have one"""
+    first = getattr(parser,"FIRST",None)
+    return first if isinstance(first,frozenset) else None
+
+
 class InputError(Exception):
-    pass
+    """Raised when input can't be read. Where known, holds the line 
+    and column the problem was found at, both counting from 1"""
+    
+    _line = None
+    line = property(lambda s: s._line)
+    _column = None
+    column = property(lambda s: s._column)
+    
+    def __init__(self,message,line=None,column=None):
+        Exception.__init__(self,message)
+        self._line = line
+        self._column = column
+
+
+# The combinator trees for the rule bodies above, built once here rather 
+# than each time a rule is parsed. Rules are referred to by class, so these 
+# can only be assembled once all of the rule classes have been defined.
+
+_OPTIONAL_WHITESPACE = Optional(CharRun(" \t"))
+_WHITESPACE = CharRun(" \t")
+_OPTIONAL_LINEWHITESPACE = Optional(LineWhitespace)
+_QUOTES = OneOrMore(Sequence(_OPTIONAL_WHITESPACE,Char(">")))
+_OPTIONAL_QUOTEMARKER = Optional(QuoteMarker)
+_NEWLINE = Alternatives(Literal("\r\n"),Literal("\n"),Literal("\r"))
+_END = Char(chr(0))
+_LINE_TEXT = CharRun(ALL_CHARACTERS)
+_COLON = Literal(":")
+_NOT_COLON = NotLiteral(":")
+_DOUBLE_COLON = Literal("::")
+_PERCENT = Literal("%")
+_NOT_PERCENT = NotLiteral("%")
+_DOUBLE_PERCENT = Literal("%%")
+_DOUBLE_HYPHEN = Literal("--")
+_EQUALS = Char("=")
+_MORE_EQUALS = CharRun("=")
+_NAME_TEXT = Pattern("[%s][%s]*" % (re.escape(Name._CHARACTERS),
+    re.escape(Name._CHARACTERS+" ")))
+
+_SECTIONS = ZeroOrMore(Section)
+_STARTER = Alternatives(FirstTextLine,FirstInstructionLine,Heading,FirstChoice)
+_FEEDBACK = Sequence(Not(StarterLine),FeedbackLine)
+_LEADING_LINE = Alternatives(BlankLine,_FEEDBACK)
+_BLOCK = Alternatives(ChoiceBlock,InstructionBlock,TextBlock)
+_CHOICE_BLOCK_LINE = Alternatives(BlankLine,Choice,_FEEDBACK)
+_INSTRUCTION_BLOCK_LINE = Alternatives(BlankLine,InstructionLine,_FEEDBACK)
+_TEXT_BLOCK_LINE = Alternatives(BlankLine,TextLine,_FEEDBACK)
+
+_OPEN_BRACKET = Char("[")
+_CLOSE_BRACKET = Char("]")
+_MARK_TEXT = CharRun(ALL_CHARACTERS.replace("]",""))
+_OPTIONAL_CHOICEMARKERMARK = Optional(ChoiceMarkerMark)
+_NOT_CHOICEMARKER = Not(ChoiceMarker)
+# ( chars | '-' !'-' )+
+_DESC_TEXT = Pattern("(?:[%s]|-(?!-))*" % re.escape(ALL_CHARACTERS.replace("-","")),"--")
+_DESC_CONTINUATION = ZeroOrMore(Sequence(ChoiceDescNewline,ChoiceDescPart))
+_DESC_NEWLINE_LINE = Alternatives(BlankLine,
+    Sequence(Not(Alternatives(StarterLine,TextLine)),FeedbackLine))
+_OPTIONAL_CHOICEDESCNEWLINE = Optional(ChoiceDescNewline)
+_OPTIONAL_CHOICERESPONSE = Optional(ChoiceResponse)
+_RESPONSE_DESC_AND_GOTO = Sequence(_OPTIONAL_CHOICEDESCNEWLINE,
+    ChoiceResponseDesc,Optional(ChoiceGoto))
+# ( chars | 'G' !( 'O' ' ' 'T' 'O' ) )+
+_RESPONSE_TEXT = Pattern("(?:[%s]|G(?!O TO))*" % re.escape(ALL_CHARACTERS.replace("G","")),
+    "GO TO")
+_RESPONSE_CONTINUATION = ZeroOrMore(Sequence(ChoiceDescNewline,ChoiceResponseDescPart))
+_GOTO = Literal("GO TO")
+_END_PUNCTUATION = CharRun(EndPunctuation._CHARACTERS)
+_OPTIONAL_ENDPUNCTUATION = Optional(EndPunctuation)
@@ -7,46 +7,239 @@ class RunnerError(Exception):
     pass
     
 
-class CommandLineRunner(object):
+class StepRunner(object):
+    """Runs a document one step at a time without doing any I/O, so that 
+    the caller can present each prompt however it likes and answer it 
+    whenever the reader does. start gives the state at the beginning of 
+    the document, present gives the prompt for a state, and advance 
+    gives the state following an answer to it."""
+
+    class State(object):
+        """A reader's position in a document, along with the choices they 
+        have made. States aren't changed once made, so any of them can be 
+        gone back to."""
+
+        __slots__ = ("_answers","_section","_item","_response","_entered")
+
+        # a copy of the choices made, as Answers
+        answers = property(lambda s: s._answers.copy())
+        document = property(lambda s: s._answers.document)
+        # index of the current section
+        section = property(lambda s: s._section)
+        # index of the current block within the section, which is past 
+        # the last one once the end of the document is reached
+        item = property(lambda s: s._item)
+        # whether the response to the choice just made is being shown
+        response = property(lambda s: s._response)
+        # whether the section was entered since the last prompt
+        entered = property(lambda s: s._entered)
+
+        def __init__(self,answers,section,item,response=False,entered=False):
+            self._answers = answers
+            self._section = section
+            self._item = item
+            self._response = response
+            self._entered = entered
+
+        def __repr__(self):
+            return "State(%s,%s,%s,%s,%s)" % (repr(self._answers),
+                repr(self._section),repr(self._item),repr(self._response),
+                repr(self._entered))
+
+        @property
+        def is_ended(self):
+            sections = self._answers.document.sections
+            return (self._section >= len(sections) 
+                or self._item >= len(sections[self._section].items))
+
+    class TextPrompt(object):
+        """Text for the reader to read, answered with None"""
+
+        __slots__ = ("_heading","_text")
+
+        # heading of the section just entered, or None
+        heading = property(lambda s: s._heading)
+        text = property(lambda s: s._text)
+
+        def __init__(self,heading,text):
+            self._heading = heading
+            self._text = text
+
+        def __repr__(self):
+            return "TextPrompt(%s,%s)" % (repr(self._heading),repr(self._text))
+
+    class ChoicePrompt(object):
+        """Choices for the reader to pick from, answered with the index of 
+        the one picked"""
+
+        __slots__ = ("_heading","_options","_selected")
 
-    FIRST = object()
+        # heading of the section just entered, or None
+        heading = property(lambda s: s._heading)
+        # description of each choice
+        options = property(lambda s: s._options)
+        # index of the choice already marked, or None
+        selected = property(lambda s: s._selected)
+
+        def __init__(self,heading,options,selected):
+            self._heading = heading
+            self._options = options
+            self._selected = selected
+
+        def __repr__(self):
+            return "ChoicePrompt(%s,%s,%s)" % (repr(self._heading),
+                repr(self._options),repr(self._selected))
+
+    class EndPrompt(object):
+        """The end of the document, which can't be answered"""
+
+        __slots__ = ("_heading",)
+
+        # heading of the section just entered, or None
+        heading = property(lambda s: s._heading)
+
+        def __init__(self,heading):
+            self._heading = heading
+
+        def __repr__(self):
+            return "EndPrompt(%s)" % repr(self._heading)
 
     @staticmethod
-    def run(document):
-        CommandLineRunner.INST._run(document, sys.stdin, sys.stdout)
-        
-    def _run(self,document,ins,outs):        
-        
-        if len(document.sections)==0: return
-        
-        # make map of sections
-        sections = {}
-        for i,s in enumerate(document.sections):
-            name = s.heading.lower() if hasattr(s,"heading") else CommandLineRunner.FIRST            
-            sections[name] = s
+    def start(document,answers=None):
+        """Returns the state at the start of the document, with the choices 
+        in the given Answers, if any, already made"""
+        return StepRunner.INST._start(document,answers)
 
-        sname = CommandLineRunner.FIRST
+    @staticmethod
+    def present(state):
+        """Returns the prompt to show the reader in the given state"""
+        return StepRunner.INST._present(state)
 
-        # walk section graph        
-        while sname is not None:
-            section = sections[sname]
-            sname = self._run_section(section,ins,outs)
+    @staticmethod
+    def advance(state,answer):
+        """Returns the state following the given answer to the state's 
+        prompt. Raises ValueError if the answer isn't valid for the prompt 
+        and RunnerError if it leads to an unknown section."""
+        return StepRunner.INST._advance(state,answer)
 
-    def _run_section(self,section,ins,outs):
-        if hasattr(section,"heading"):
-            outs.write(section.heading+"\n"
-                +"-"*len(section.heading)+"\n\n")
-        for block in section.items:
-            goto = self._run_block(block,ins,outs)
-            if goto is not None: return goto
-        return None
+    @staticmethod
+    def save(state):
+        """Returns the state as a tuple of plain values, leaving out the 
+        document, which can be restored with load"""
+        return (state.section,state.item,state.response,state.entered,
+            state._answers.tolist())
+
+    @staticmethod
+    def load(document,saved):
+        """Restores a state saved with save, for the given document"""
+        section,item,response,entered,selected = saved
+        return StepRunner.State(parse.Answers(document,selected),section,item,
+            response,entered)
 
-    def _run_block(self,block,ins,outs):
-        hname = "_run_%s" % type(block).__name__
-        return getattr(self,hname,self._run_default)(block,ins,outs)
+    def _start(self,document,answers=None):
+        answers = answers.copy() if answers is not None else parse.Answers(document)
+        return self._settle(answers,0,0,False)
 
-    def _run_default(self,block,ins,outs):
-        return None
+    def _settle(self,answers,section,item,entered):
+        """Returns the state at the first block from the given one which 
+        has something to show. Running out of blocks ends the document."""
+        sections = answers.document.sections
+        if section < len(sections):
+            items = sections[section].items
+            while item < len(items):
+                if isinstance(items[item],(parse.TextBlock,parse.ChoiceBlock)):
+                    break
+                item += 1
+        return StepRunner.State(answers,section,item,False,entered)
+
+    def _heading(self,state):
+        if not state.entered: return None
+        return getattr(state.document.sections[state.section],"heading",None)
+
+    def _present(self,state):
+        if state.is_ended:
+            return StepRunner.EndPrompt(self._heading(state))
+        block = state.document.sections[state.section].items[state.item]
+        if state.response:
+            return StepRunner.TextPrompt(None,
+                block.choices[state._answers.selected(block)].response)
+        if isinstance(block,parse.TextBlock):
+            return StepRunner.TextPrompt(self._heading(state),block.text)
+        selected = None
+        for i,mark in enumerate(state._answers.marks(block)):
+            if mark:
+                selected = i
+                break
+        return StepRunner.ChoicePrompt(self._heading(state),
+            [ c.description for c in block.choices ],selected)
+
+    def _advance(self,state,answer):
+        if state.is_ended:
+            raise ValueError("Document has ended")
+        answers = state._answers
+        block = state.document.sections[state.section].items[state.item]
+        
+        if state.response:
+            return self._follow(state,answers,block,answers.selected(block))
+
+        if isinstance(block,parse.TextBlock):
+            return self._settle(answers,state.section,state.item+1,False)
+
+        if (isinstance(answer,bool) or not isinstance(answer,int) 
+                or not 0 <= answer < len(block.choices)):
+            raise ValueError("Invalid choice")
+        # the state's answers are copied, as earlier states still use them
+        answers = answers.copy()
+        answers.select(block,answer)
+        if block.choices[answer].response is not None:
+            return StepRunner.State(answers,state.section,state.item,True,False)
+        return self._follow(state,answers,block,answer)
+
+    def _follow(self,state,answers,block,choice):
+        """Returns the state with the given answers after the choice at the 
+        given index in the block: the start of the section it goes to, or 
+        otherwise the block after its own"""
+        chosen = block.choices[choice]
+        if chosen.goto is None:
+            return self._settle(answers,state.section,state.item+1,False)
+        target = state.document.target(block,choice)
+        if target is None:
+            raise RunnerError("Go-to references unknown section '%s'" 
+                % chosen.goto.lower())
+        return self._settle(answers,state.document.index(target),0,True)
+        
+        
+StepRunner.INST = StepRunner()
+
+
+class CommandLineRunner(object):
+
+    @staticmethod
+    def run(document,answers=None):
+        """Runs the document on the console, recording the reader's choices 
+        in the given Answers, or in new ones, which are returned. The 
+        document itself is left unchanged."""
+        return CommandLineRunner.INST._run(document, sys.stdin, sys.stdout, answers)
+        
+    def _run(self,document,ins,outs,answers=None):        
+        
+        # step through the document, showing each prompt on the console
+        state = StepRunner.start(document,answers)
+        while True:
+            prompt = StepRunner.present(state)
+            if prompt.heading is not None:
+                outs.write(prompt.heading+"\n"
+                    +"-"*len(prompt.heading)+"\n\n")
+            if isinstance(prompt,StepRunner.EndPrompt):
+                if answers is None: return state.answers
+                answers.update(state.answers)
+                return answers
+            answer = self._ask(prompt,ins,outs)
+            state = StepRunner.advance(state,answer)
+
+    def _ask(self,prompt,ins,outs):
+        hname = "_ask_%s" % type(prompt).__name__
+        return getattr(self,hname)(prompt,ins,outs)
 
     def _wait_for_enter(self,ins,outs):
         outs.write("[enter]")
@@ -54,15 +247,15 @@ class CommandLineRunner(object):
         ins.readline()
         outs.write("\n\n")
         
-    def _run_TextBlock(self,block,ins,outs):
-        outs.write(block.text+"\n\n")
+    def _ask_TextPrompt(self,prompt,ins,outs):
+        outs.write(prompt.text+"\n\n")
         self._wait_for_enter(ins,outs)
         return None
         
-    def _run_ChoiceBlock(self,block,ins,outs):
+    def _ask_ChoicePrompt(self,prompt,ins,outs):
         
-        for i,c in enumerate(block.choices):
-                outs.write("%d) %s\n" % (i+1,c.description))
+        for i,o in enumerate(prompt.options):
+                outs.write("%d) %s\n" % (i+1,o))
         outs.write("\n")
         
         while True:
@@ -76,25 +269,11 @@ class CommandLineRunner(object):
                 outs.write("Enter a number\n\n")
                 continue
                 
-            if selnum < 1 or selnum > len(block.choices):
+            if selnum < 1 or selnum > len(prompt.options):
                 outs.write("Invalid choice\n\n")
                 continue
                 
-            break
-                
-        chosen = block.choices[selnum-1]
-        
-        for c in block.choices:
-            c.set_mark("X" if c is chosen else None)
-            
-        if chosen.response is not None:
-            outs.write("%s\n\n" % chosen.response)
-            self._wait_for_enter(ins,outs)
-    
-        if chosen.goto is not None:
-            return chosen.goto.lower()
-                
-        return None
+            return selnum-1
 
         
 CommandLineRunner.INST = CommandLineRunner()
@@ -227,11 +406,12 @@ class GuiRunner(object):
             self.next = next
         
         @staticmethod
-        def from_block(sectionname,secmapper,next,block): 
+        def from_block(sectionname,secmapper,next,block,answers): 
             if isinstance(block,parse.TextBlock):
                 return GuiRunner.TextStep.from_block(sectionname,next,block)
             elif isinstance(block,parse.ChoiceBlock):
-                return GuiRunner.ChoiceStep.from_block(sectionname,secmapper,next,block)
+                return GuiRunner.ChoiceStep.from_block(sectionname,secmapper,next,block,
+                    answers)
             else:
                 return None
         
@@ -266,30 +446,31 @@ class GuiRunner(object):
         _docupdater = None
     
         @staticmethod
-        def from_block(sectionname,secmapper,next,choiceblock):
+        def from_block(sectionname,secmapper,next,choiceblock,answers):
             selected = None
             options = []
-            for i,choice in enumerate(choiceblock.choices):
-                if choice.mark and not selected:
+            for i,(choice,mark) in enumerate(zip(choiceblock.choices,
+                    answers.marks(choiceblock))):
+                if mark and not selected:
                     selected = i
                 secmapper(GuiRunner.ChoiceStep._make_map_callback(
-                    sectionname,next,choice,options))
+                    sectionname,next,choiceblock,i,options))
             return GuiRunner.ChoiceStep(sectionname,next,options,selected,
-                GuiRunner.ChoiceStep._make_updater_callback(choiceblock))
+                GuiRunner.ChoiceStep._make_updater_callback(choiceblock,answers))
 
         @staticmethod
-        def _make_updater_callback(choiceblock):
+        def _make_updater_callback(choiceblock,answers):
             def updater(val):
-                for i,choice in enumerate(choiceblock.choices):
-                    choice.set_mark( "X" if i==val else None )
+                answers.select(choiceblock,val)
             return updater
 
         @staticmethod
-        def _make_map_callback(sectionname,next,choice,options):
-            def callback(sectionmap):
+        def _make_map_callback(sectionname,next,choiceblock,index,options):
+            choice = choiceblock.choices[index]
+            def callback(targetstep):
                 step = next
                 if choice.goto:
-                    step = sectionmap[choice.goto.lower()]
+                    step = targetstep(choiceblock,index)
                 if choice.response:
                     step = GuiRunner.TextStep(sectionname,step,choice.response)
                 options.append(GuiRunner.ChoiceStep.Option(choice.description,step))
@@ -321,10 +502,13 @@ class GuiRunner(object):
     _path = None
 
     @staticmethod
-    def run(document):
-        GuiRunner.INST._run(document)
+    def run(document,answers=None):
+        """Runs the document in a window, recording the reader's choices 
+        in the given Answers, or in new ones, which are returned. The 
+        document itself is left unchanged."""
+        return GuiRunner.INST._run(document,answers=answers)
         
-    def _run(self,document,tkroot=None,gui=None):
+    def _run(self,document,tkroot=None,gui=None,answers=None):
         global tk
         try: 
             import tkinter as tk
@@ -342,6 +526,7 @@ class GuiRunner(object):
         
         self._gui.listener = self
         
+        if answers is None: answers = parse.Answers(document)
         self._path = []
         secmap = {}
         secmap_cbs = []
@@ -350,19 +535,20 @@ class GuiRunner(object):
             step = None
             for b in reversed(sec.items):
                 s = GuiRunner.Step.from_block(name,
-                    lambda cb: secmap_cbs.append(cb),step,b)
+                    lambda cb: secmap_cbs.append(cb),step,b,answers)
                 if s: step = s
-            secmap[name.lower() if name else None] = step
+            secmap[sec] = step
         for cb in secmap_cbs:
-            cb(secmap)
+            cb(lambda block,choice: secmap[document.target(block,choice)])
 
         self._current_secname = object()            
-        self._path_push( secmap[None] if len(secmap)>0 else None )
+        self._path_push( secmap[document.sections[0]] if len(secmap)>0 else None )
             
         self._tkroot.mainloop()
         
         if not self._completed:
             raise RunnerError("User aborted")
+        return answers
         
     def _path_push(self,step):
         self._path.append(step)
@@ -9,9 +9,16 @@ from unittest import mock
 import unittest
 import tkinter as Tkinter
 import re
+import ast
+import warnings
+import random
+import tempfile
 import hrbrt.io as hio
 import hrbrt.run as hrun
 import hrbrt.parse as hps
+import hrbrt.lex as hlx
+import hrbrt.genparse as hgp
+import hrbrt.cache as hca
 
 
 def get_nested(obj,propspec):
@@ -71,6 +78,44 @@ class TestInput(unittest.TestCase):
         j.commit()
         self.assertEqual("c",i.next())
         
+    def test_can_match(self):
+        i = hps.Input("aabc")
+        self.assertEqual("aab", i.match(re.compile("[ab]+")))
+        self.assertEqual("c", i.next())
+        
+    def test_can_peek(self):
+        i = hps.Input("abc")
+        i.next()
+        self.assertEqual("b", i.peek())
+        self.assertEqual(1, i.pos)
+        self.assertEqual(1, i.get_deepest_pos())
+        
+    def test_can_match_literal(self):
+        i = hps.Input("GO TO x")
+        self.assertEqual("GO TO", i.literal("GO TO"))
+        self.assertEqual(5, i.pos)
+        self.assertEqual(4, i.get_deepest_pos())
+        
+    def test_literal_doesnt_advance_on_failure(self):
+        i = hps.Input("GO TX")
+        self.assertIsNone(i.literal("GO TO"))
+        self.assertEqual(0, i.pos)
+        self.assertEqual(4, i.get_deepest_pos())
+        
+    def test_match_doesnt_advance_on_failure(self):
+        i = hps.Input("abc")
+        self.assertIsNone(i.match(re.compile("c")))
+        self.assertEqual("a", i.next())
+
+    def test_pos_readable(self):
+        i = hps.Input("abc")
+        i.next()
+        self.assertEqual(1, i.pos)
+        
+    def test_line_index_covers_input(self):
+        i = hps.Input("a\nb")
+        self.assertEqual((2,2), i.line_index.location(3))
+
     def test_get_deepest_pos(self):
         i = hps.Input("abcdef")
         i.next()
@@ -78,7 +123,312 @@ class TestInput(unittest.TestCase):
         j.next()
         k = j.branch()
         k.next()
+        self.assertEqual(2, i.get_deepest_pos())
+        
+    def test_get_deepest_pos_kept_after_backtracking(self):
+        i = hps.Input("abcdef")
+        j = i.branch()
+        j.next()
+        j.next()
+        i.next()
+        self.assertEqual(1, i.get_deepest_pos())
+        self.assertEqual(1, i.branch().get_deepest_pos())
+        
+    def test_get_deepest_pos_includes_match(self):
+        i = hps.Input("aabc")
+        i.match(re.compile("a+"))
+        self.assertEqual(2, i.get_deepest_pos())
+        i.branch().match(re.compile("c"))
+        self.assertEqual(2, i.get_deepest_pos())
+        
+    def test_get_deepest_pos_includes_lookahead_group(self):
+        i = hps.Input("aabcd")
+        self.assertEqual("a", i.match(re.compile("a(?=(abc)?)")))
+        self.assertEqual(3, i.get_deepest_pos())
+        i.match(re.compile("a(?=(x)?)"))
+        self.assertEqual(3, i.get_deepest_pos())
+        
+    def test_branch_doesnt_keep_child(self):
+        i = hps.Input("abc")
+        j = i.branch()
+        # referenced only by j and getrefcount's argument
+        self.assertEqual(2, sys.getrefcount(j))
+
+
+class TestBufferInput(unittest.TestCase):
+
+    def test_can_iterate(self):
+        i = hps.BufferInput(b"ab")
+        self.assertEqual("a",i.next())
+        self.assertEqual("b",i.next())
+        
+    def test_gives_null_at_end(self):
+        i = hps.BufferInput(b"a")
+        i.next()
+        self.assertEqual(chr(0),i.next())
+        
+    def test_can_branch_and_commit(self):
+        i = hps.BufferInput(b"abcdef")
+        j = i.branch()
+        j.next()
+        j.next()
+        self.assertIsInstance(j, hps.BufferInput)
+        self.assertEqual("a",i.next())
+        j.commit()
+        self.assertEqual("c",i.next())
+        
+    def test_can_match_string_pattern(self):
+        i = hps.BufferInput(b"aa\tbc")
+        self.assertEqual("aa\tb", i.match(re.compile("[ab\t]+")))
+        self.assertEqual(4, i.pos)
+        self.assertIsNone(i.match(re.compile("a")))
+        self.assertEqual("c", i.next())
+        
+    def test_can_peek(self):
+        i = hps.BufferInput(b"a")
+        self.assertEqual("a", i.peek())
+        i.next()
+        self.assertEqual(chr(0), i.peek())
+        self.assertEqual(1, i.pos)
+        
+    def test_can_match_literal(self):
+        i = hps.BufferInput(b"--x-")
+        self.assertEqual("--", i.literal("--"))
+        self.assertEqual(2, i.pos)
+        self.assertIsNone(i.literal("x--"))
+        self.assertEqual(2, i.pos)
+        self.assertEqual(4, i.get_deepest_pos())
+        
+    def test_line_index_covers_input(self):
+        i = hps.BufferInput(b"a\r\nb")
+        self.assertEqual((2,2), i.line_index.location(4))
+        
+    def test_parses_same_document_as_input(self):
+        t = (":: [] a -- GO TO foo\n\nsome feedback\n\n> == foo ==\n\n"
+            ":: text\n:  more\n\n%% end\n")
+        expected = hps.Document.parse(hps.Input(t))
+        result = hps.Document.parse(hps.BufferInput(t.encode("ascii")))
+        self.assertEqual(repr(expected), repr(result))
+        self.assertEqual([s.pos for s in expected.sections], [s.pos for s in result.sections])
+
+
+class TestLineIndex(unittest.TestCase):
+
+    def test_location_in_first_line(self):
+        self.assertEqual((1,3), hps.LineIndex("abcd\nef").location(2))
+        
+    def test_location_after_line_breaks(self):
+        l = hps.LineIndex("ab\ncd\r\nef\rgh")
+        self.assertEqual((1,3), l.location(2))
+        self.assertEqual((2,1), l.location(3))
+        self.assertEqual((3,1), l.location(7))
+        self.assertEqual((4,2), l.location(11))
+        
+    def test_line_start(self):
+        l = hps.LineIndex("ab\ncd\r\nef")
+        self.assertEqual(0, l.line_start(1))
+        self.assertEqual(7, l.line_start(3))
+
+
+class TestCharRun(unittest.TestCase):
+
+    def test_parse_returns_run_as_string(self):
+        self.assertEqual("a]-^b", hps.CharRun("ab]-^").parse(MockInput("a]-^bc\x00")))
+        
+    def test_parse_consumes_run(self):
+        i = MockInput("  \tx\x00")
+        hps.CharRun(" \t").parse(i)
+        self.assertEqual(3, i.pos)
+        
+    def test_parse_expects_one_char(self):
+        i = MockInput("x\x00")
+        self.assertIsNone(hps.CharRun(" \t").parse(i))
+        self.assertEqual(0, i.pos)
+
+
+class TestLiteral(unittest.TestCase):
+
+    def test_parse_returns_text(self):
+        self.assertEqual("GO TO", hps.Literal("GO TO").parse(MockInput("GO TO x\x00")))
+        
+    def test_parse_consumes_text(self):
+        i = MockInput("--x\x00")
+        hps.Literal("--").parse(i)
+        self.assertEqual(2, i.pos)
+        
+    def test_parse_expects_whole_text(self):
+        i = MockInput("-x\x00")
+        self.assertIsNone(hps.Literal("--").parse(i))
+        self.assertEqual(0, i.pos)
+        
+    def test_same_failure_position_as_chars(self):
+        for text in ("GO TO","GO T","G","GX TO","x"):
+            i = hps.Input(text)
+            hps.Literal("GO TO").parse(i)
+            j = hps.Input(text)
+            hps.Sequence(*[hps.Char(c) for c in "GO TO"]).parse(j)
+            self.assertEqual(j.get_deepest_pos(), i.get_deepest_pos(), text)
+            
+    def test_not_literal_doesnt_consume(self):
+        i = MockInput("%x\x00")
+        self.assertIs(False, hps.NotLiteral("%%").parse(i))
+        self.assertEqual(0, i.pos)
+        
+    def test_not_literal_fails_on_text(self):
+        self.assertIsNone(hps.NotLiteral("%").parse(MockInput("%x\x00")))
+        
+
+class TestPattern(unittest.TestCase):
+
+    def test_parse_returns_match_as_string(self):
+        self.assertEqual("ab-c", hps.Pattern("(?:[abc]|-(?!-))*").parse(MockInput("ab-c--\x00")))
+        
+    def test_parse_consumes_match(self):
+        i = MockInput("ab-c--\x00")
+        hps.Pattern("(?:[abc]|-(?!-))*").parse(i)
+        self.assertEqual(4, i.pos)
+        
+    def test_parse_fails_on_empty_match(self):
+        i = MockInput("--\x00")
+        self.assertIsNone(hps.Pattern("(?:[abc]|-(?!-))*").parse(i))
+        self.assertEqual(0, i.pos)
+        
+    def test_ahead_counts_as_examined(self):
+        i = hps.Input("ab--c")
+        self.assertEqual("ab", hps.Pattern("(?:[abc]|-(?!-))*","--").parse(i))
         self.assertEqual(3, i.get_deepest_pos())
+        
+    def test_ahead_counts_as_examined_on_failure(self):
+        i = hps.Input("GO TO")
+        self.assertIsNone(hps.Pattern("(?:[A-FH-Z ]|G(?!O TO))*","GO TO").parse(i))
+        self.assertEqual(4, i.get_deepest_pos())
+        
+    def test_same_failure_position_as_combinators(self):
+        for text in ("a -- b GO TO c","a -- b GO T c","a --- b","a -"):
+            i = hps.Input(text)
+            hps.ChoiceDescPart.parse(i)
+            j = hps.Input(text)
+            hps.OneOrMore(hps.Alternatives(hps.CharRun("ab GOTc"),
+                hps.Sequence(hps.Char("-"),hps.Not(hps.Char("-"))))).parse(j)
+            self.assertEqual(j.get_deepest_pos(), i.get_deepest_pos(), text)
+            
+
+class TestMemo(unittest.TestCase):
+
+    DOCUMENT = ( ":: Hello\n\n"
+                 ":: [] Yes -- GO TO foo\n"
+                 ":  [] No -- Oh. GO TO foo\n\n"
+                 "== foo ==\n\n"
+                 ":: Bye\n" )
+
+    def test_packrat_parse_gives_same_result(self):
+        plain = hps.Document.parse(hps.Input(self.DOCUMENT))
+        memoized = hps.Document.parse(hps.Input(self.DOCUMENT,hps.Memo()))
+        self.assertEqual(repr(plain), repr(memoized))
+        
+    def test_packrat_parse_records_hits(self):
+        m = hps.Memo()
+        hps.Document.parse(hps.Input(self.DOCUMENT,m))
+        self.assertTrue(m.hits > 0)
+        self.assertTrue(m.misses > 0)
+        self.assertTrue(0.0 < m.hit_rate < 1.0)
+        
+    def test_hit_consumes_input(self):
+        m = hps.Memo()
+        hps.FeedbackLine.parse(hps.Input("foo\nbar\n",m))
+        i = hps.Input("foo\nbar\n",m)
+        result = hps.FeedbackLine.parse(i)
+        self.assertEqual(1, m.hits)
+        self.assertEqual("foo", result.text)
+        self.assertEqual("b", i.next())
+        
+    def test_hit_doesnt_consume_input_on_failure(self):
+        m = hps.Memo()
+        hps.Heading.parse(hps.Input("foo\n",m))
+        i = hps.Input("foo\n",m)
+        self.assertIsNone(hps.Heading.parse(i))
+        self.assertEqual(1, m.hits)
+        self.assertEqual("f", i.next())
+        
+    def test_hit_restores_deepest_pos(self):
+        m = hps.Memo()
+        i = hps.Input("== foo\n",m)
+        hps.Heading.parse(i)
+        expected = i.get_deepest_pos()
+        i = hps.Input("== foo\n",m)
+        hps.Heading.parse(i)
+        self.assertEqual(expected, i.get_deepest_pos())
+        
+    def test_discards_entries_before_successful_block(self):
+        m = hps.Memo()
+        i = hps.Input(":: foo\n:: bar\n",m)
+        hps.TextBlock.parse(i)
+        hps.TextBlock.parse(i)
+        self.assertTrue(all(p >= 7 for p in m._table))
+        
+    def test_hit_rate_zero_when_unused(self):
+        self.assertEqual(0.0, hps.Memo().hit_rate)
+
+
+class TestCompiledGrammar(unittest.TestCase):
+
+    def test_parse_doesnt_construct_combinators(self):
+        patches = [ mock.patch.object(c,"__init__",side_effect=AssertionError(c.__name__)) 
+                    for c in (hps.Alternatives,hps.Sequence,hps.Optional,hps.OneOrMore,
+                              hps.ZeroOrMore,hps.Not,hps.Char,hps.Literal) ]
+        for p in patches: p.start()
+        try:
+            result = hps.Document.parse(hps.Input(TestMemo.DOCUMENT))
+        finally:
+            for p in patches: p.stop()
+        self.assertIsNotNone(result)
+
+
+class TestAlternatives(unittest.TestCase):
+
+    def make_alt(self,first,result=None):
+        return mock.Mock(FIRST=frozenset(first) if first is not None else None,
+            **{"parse.return_value": result})
+
+    def test_tries_alternatives_in_order(self):
+        a,b = self.make_alt("x"),self.make_alt("x","b")
+        self.assertEqual("b", hps.Alternatives(a,b).parse(hps.Input("x")))
+        self.assertTrue(a.parse.called)
+
+    def test_skips_alternatives_not_starting_with_next_symbol(self):
+        a,b = self.make_alt("ab","a"),self.make_alt("xy","b")
+        self.assertEqual("b", hps.Alternatives(a,b).parse(hps.Input("y")))
+        self.assertFalse(a.parse.called)
+
+    def test_always_tries_alternatives_without_first_set(self):
+        a,b,c = self.make_alt("ab"),self.make_alt(None),self.make_alt("a","c")
+        alts = hps.Alternatives(a,b,c)
+        self.assertIsNone(alts.parse(hps.Input("z")))
+        self.assertFalse(a.parse.called)
+        self.assertTrue(b.parse.called)
+        self.assertFalse(c.parse.called)
+        self.assertEqual("c", alts.parse(hps.Input("a")))
+
+    def test_skipping_counts_as_examined(self):
+        i = hps.Input("ab")
+        i.next()
+        hps.Alternatives(self.make_alt("x")).parse(i)
+        self.assertEqual(1, i.get_deepest_pos())
+
+    def test_first_is_union_of_alternatives(self):
+        self.assertEqual(frozenset("abx"), 
+            hps.Alternatives(hps.Char("ab"),hps.CharRun("x")).FIRST)
+        self.assertIsNone(hps.Alternatives(hps.Char("a"),hps.Optional(hps.Char("b"))).FIRST)
+
+    def test_rule_first_sets_match_grammar(self):
+        for t in (":: a\n",": a\n","%% a\n","% a\n","== a ==\n"," > :: a\n",
+                ":: [] a\n",":  [] a\n","\n","> \n","a\n"):
+            for rule in (hps.Heading,hps.ChoiceBlock,hps.InstructionBlock,hps.TextBlock,
+                    hps.TextLine,hps.FirstTextLine,hps.BlankLine,hps.InstructionLine,
+                    hps.FirstInstructionLine,hps.Choice,hps.FirstChoice,hps.FeedbackLine,
+                    hps.StarterLine):
+                if rule.parse(hps.Input(t)) is not None:
+                    self.assertIn(t[0], rule.FIRST, "%s %s" % (rule.__name__,repr(t)))
 
 
 class MockInput(object):
@@ -86,6 +436,7 @@ class MockInput(object):
     pos = 0
     parent = None
     data = None
+    line_index = None
     
     def __init__(self,data,pos=0,parent=None):
         self.data = data
@@ -97,6 +448,17 @@ class MockInput(object):
         self.pos += 1
         return s
     
+    def match(self,pattern):
+        m = pattern.match(self.data,self.pos)
+        if m is None: return None
+        self.pos = m.end()
+        return m.group()
+    
+    def literal(self,text):
+        if not self.data.startswith(text,self.pos): return None
+        self.pos += len(text)
+        return text
+    
     def branch(self):
         return MockInput(self.data,self.pos,self)
         
@@ -143,7 +505,8 @@ class TestDocument(unittest.TestCase):
     def test_sections_attribute_immutable(self):
         s = hps.FirstSection([],None)
         d = hps.Document([s])
-        d.sections[0] = "weh"
+        with self.assertRaises(TypeError):
+            d.sections[0] = "weh"
         self.assertEqual(s,d.sections[0])
 
     def test_is_completed_readable(self):
@@ -155,6 +518,31 @@ class TestDocument(unittest.TestCase):
         with self.assertRaises(AttributeError):
             d.is_completed = True
 
+    def test_parse_tree_nodes_have_no_dict(self):
+        import bench
+        d = hps.Document.parse(hps.Input(bench.make_document(5)))
+        nodes = [d,d.line_index]
+        for s in d.sections:
+            nodes.append(s)
+            for i in s.items:
+                nodes.append(i)
+                nodes.extend(getattr(i,"choices",[]))
+        self.assertEqual(set(), set( type(n).__name__ for n in nodes if hasattr(n,"__dict__") ))
+        
+    def test_parsed_document_is_compact(self):
+        import bench
+        import tracemalloc
+        text = bench.make_document(100)
+        tracemalloc.start()
+        try:
+            d = hps.Document.parse(hps.Input(text))
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        # nodes with a __dict__ and a list of int objects for the line 
+        # index took over 6 bytes per byte of source
+        self.assertLess(size, 5*len(text))
+
     def setup_parse_methods(self):
         hps.FirstSection.parse.side_effect = make_parse({"f":self.make_section(gotos=[["foo"]])})
         hps.Section.parse.side_effect = make_parse({"s":self.make_section("foo",gotos=[])})
@@ -413,6 +801,180 @@ class TestDocument(unittest.TestCase):
         self.assertEqual('Dead-end loop found in section "foo"',
             d.validate() )
         
+    def test_validate_returns_error_for_dead_end_loop_before_last_choice_block(self):
+    
+        s1 = self.make_section(gotos=[["foo"]])
+        s2 = self.make_section("foo",gotos=[["foo"],["end"]])
+        s3 = self.make_section("end",gotos=[])
+        d = hps.Document([s1,s2,s3])
+        self.assertEqual('Dead-end loop found in section "foo"',
+            d.validate() )
+            
+    def test_validate_allows_loop_exiting_through_end_section(self):
+    
+        s1 = self.make_section(gotos=[["end"]])
+        s2 = self.make_section("foo",gotos=[["end","foo"]])
+        s3 = self.make_section("end",gotos=[["foo",None]])
+        d = hps.Document([s1,s2,s3])
+        self.assertIsNone( d.validate() )
+        
+    def test_validate_handles_deep_branching_goto_graph(self):
+    
+        n = 2000
+        s = [self.make_section(gotos=[["s1","s2"]])]
+        for i in range(1,n):
+            s.append(self.make_section("s%d" % i,
+                gotos=[["s%d" % (i+1),"s%d" % min(i+2,n),"s%d" % max(i-1,1)]]))
+        s.append(self.make_section("s%d" % n,gotos=[]))
+        d = hps.Document(s)
+        self.assertIsNone( d.validate() )
+        
+    def test_line_index_readable(self):
+        l = hps.LineIndex("")
+        self.assertIs(l, hps.Document([],l).line_index)
+        
+    def test_diagnose_returns_empty_list_for_valid_document(self):
+        s1 = self.make_section(gotos=[["end"]])
+        s2 = self.make_section("end",gotos=[])
+        self.assertEqual([], hps.Document([s1,s2]).diagnose())
+        
+    def test_diagnose_reports_every_problem(self):
+        s1 = self.make_section(gotos=[["foo","nowhere","bar","end"]])
+        s2 = self.make_section("foo",gotos=[["foo"]])
+        s3 = self.make_section("Foo",gotos=[["end"]])
+        s4 = self.make_section("bar",gotos=[])
+        s5 = self.make_section("end",gotos=[])
+        self.assertEqual([
+            ("Duplicate section name 'foo'", "error", "foo"),
+            ("Go-to references unknown section 'nowhere'", "error", "first"),
+            ('Dead-end loop found in section "foo"', "error", "foo"),
+            ('Section "bar" has no choice blocks and so cannot reach end of '
+                +'document', "error", "bar"),
+        ], [ (d.message,d.severity,d.section) for d in 
+            hps.Document([s1,s2,s3,s4,s5]).diagnose() ])
+            
+    def test_diagnose_doesnt_report_loops_escaping_through_reported_sections(self):
+        s1 = self.make_section(gotos=[["foo","end"]])
+        s2 = self.make_section("foo",gotos=[["bar"]])
+        s3 = self.make_section("bar",gotos=[["foo","nowhere"]])
+        s4 = self.make_section("end",gotos=[])
+        self.assertEqual(["Go-to references unknown section 'nowhere'"], 
+            [ d.message for d in hps.Document([s1,s2,s3,s4]).diagnose() ])
+            
+    def test_diagnose_warns_of_unreachable_sections(self):
+        s1 = self.make_section(gotos=[["end"]])
+        s2 = self.make_section("foo",gotos=[["end"]])
+        s3 = self.make_section("end",gotos=[])
+        self.assertEqual([('Section "foo" cannot be reached from start of document',
+            "warning")], [ (d.message,d.severity) for d in 
+            hps.Document([s1,s2,s3]).diagnose() ])
+            
+    def test_diagnose_gives_section_line_and_column(self):
+        s1 = hps.FirstSection([hps.TextBlock("a",None)],None,0)
+        s2 = hps.Section("foo",[hps.TextBlock("b",None)],None,4)
+        d = hps.Document([s1,s2],hps.LineIndex("a\nb\nc\n"))
+        self.assertEqual([(1,1,"first"),(3,1,"foo")], [ (x.line,x.column,x.section) 
+            for x in d.diagnose() ])
+            
+    def test_diagnose_gives_line_and_column_of_choice_at_fault(self):
+        c = hps.Choice(None,"b",None,"nowhere",None,14)
+        b = hps.ChoiceBlock([hps.FirstChoice(None,"a",None,None,None,10),c],None,10)
+        s1 = hps.FirstSection([hps.TextBlock("a",None)],None,0)
+        # parsed at position 8 of another text, then moved to 4
+        s2 = hps.Section("foo",[b],None,4,8)
+        d = hps.Document([s1,s2],hps.LineIndex("a\nb\nc\nd\ne\nf\n"))
+        self.assertEqual([(6,1,"foo")], [ (x.line,x.column,x.section) 
+            for x in d.diagnose() if x.message.startswith("Go-to") ])
+            
+    def test_diagnose_gives_section_line_and_column_without_choice_positions(self):
+        s1 = self.make_section(gotos=[["nowhere"]])
+        s1 = hps.FirstSection(s1.items,None,2)
+        d = hps.Document([s1],hps.LineIndex("a\nb\nc\n"))
+        self.assertEqual([(2,1)], [ (x.line,x.column) for x in d.diagnose() 
+            if x.message.startswith("Go-to") ])
+            
+    def test_diagnose_gives_no_line_without_line_index(self):
+        s1 = hps.FirstSection([hps.TextBlock("a",None)],None,0)
+        s2 = hps.Section("foo",[],None,5)
+        self.assertIsNone(hps.Document([s1,s2]).diagnose()[0].line)
+        
+    def test_diagnose_checks_once(self):
+        s1 = self.make_section(gotos=[["end"]])
+        s2 = self.make_section("end",gotos=[])
+        d = hps.Document([s1,s2])
+        d.diagnose()
+        with mock.patch.object(hps.Document,"_validate") as v:
+            d.diagnose()
+            self.assertFalse(v.called)
+            
+    def test_diagnose_returns_given_diagnostics(self):
+        x = hps.Diagnostic("foo")
+        self.assertEqual([x], hps.Document([],None,[x]).diagnose())
+
+    def test_links_choices_to_sections(self):
+        c1 = hps.Choice(None,"a",None,"FoO",None)
+        c2 = hps.Choice(None,"b",None,None,None)
+        s = hps.Section("foo",[],None)
+        b = hps.ChoiceBlock([c1,c2],None)
+        d = hps.Document([hps.FirstSection([b],None),s])
+        self.assertIs(s, d.target(b,0))
+        self.assertIsNone(d.target(b,1))
+        
+    def test_links_choice_to_first_section_of_name(self):
+        c = hps.Choice(None,"a",None,"foo",None)
+        s1,s2 = hps.Section("foo",[],None),hps.Section("Foo",[],None)
+        b = hps.ChoiceBlock([c],None)
+        d = hps.Document([hps.FirstSection([b],None),s1,s2])
+        self.assertIs(s1, d.target(b,0))
+        
+    def test_links_unknown_goto_to_none(self):
+        c = hps.Choice(None,"a",None,"bar",None)
+        b = hps.ChoiceBlock([c],None)
+        d = hps.Document([hps.FirstSection([b],None),hps.Section("foo",[],None)])
+        self.assertIsNone(d.target(b,0))
+
+    def test_target_throws_valueerror_for_block_from_another_document(self):
+        d = hps.Document([hps.FirstSection([],None)])
+        with self.assertRaises(ValueError):
+            d.target(hps.ChoiceBlock([hps.Choice(None,"a",None,None,None)],None),0)
+
+    def test_links_choices_from_given_targets(self):
+        b = hps.ChoiceBlock([hps.Choice(None,"a",None,"foo",None),
+            hps.Choice(None,"b",None,"foo",None)],None)
+        s1,s2 = hps.Section("foo",[],None),hps.Section("bar",[],None)
+        d = hps.Document([hps.FirstSection([b],None),s1,s2],None,None,[2,-1])
+        self.assertIs(s2, d.target(b,0))
+        self.assertIsNone(d.target(b,1))
+
+    def test_throws_valueerror_for_bad_targets(self):
+        b = hps.ChoiceBlock([hps.Choice(None,"a",None,"foo",None)],None)
+        for targets in ([],[0,0],[2],[-2]):
+            with self.assertRaises(ValueError):
+                hps.Document([hps.FirstSection([b],None),hps.Section("foo",[],None)],
+                    None,None,targets)
+
+    def test_links_are_kept_per_document(self):
+        c = hps.Choice(None,"a",None,"foo",None)
+        b = hps.ChoiceBlock([c],None)
+        s1,s2 = hps.Section("foo",[],None),hps.Section("foo",[],None)
+        d1 = hps.Document([hps.FirstSection([b],None),s1])
+        d2 = hps.Document([hps.FirstSection([b],None),s2])
+        self.assertIs(s1, d1.target(b,0))
+        self.assertIs(s2, d2.target(b,0))
+
+    def test_pickles_long_goto_chain(self):
+        import pickle
+        import bench
+        d = hio.HrbrtIO.read(io.StringIO(bench.make_document(3000)))
+        d2 = pickle.loads(pickle.dumps(d))
+        self.assertIs(d2.sections[1], d2.target(d2.sections[0].items[1],0))
+
+    def test_validate_ignores_warnings(self):
+        s1 = self.make_section(gotos=[["end"]])
+        s2 = self.make_section("foo",gotos=[["end"]])
+        s3 = self.make_section("end",gotos=[])
+        self.assertIsNone( hps.Document([s1,s2,s3]).validate() )
+
     def test_is_completed_returns_true_for_completed_section(self):
         s1 = mock.Mock()
         s1.is_completed = False
@@ -428,10 +990,225 @@ class TestDocument(unittest.TestCase):
         s2.is_completed = False
         d = hps.Document([s1,s2])
         self.assertEqual(False, d.is_completed)
+
+    def test_index_gives_position_of_section(self):
+        s1 = hps.FirstSection([],None)
+        s2 = hps.Section("foo",[],None)
+        d = hps.Document([s1,s2])
+        self.assertEqual(0, d.index(s1))
+        self.assertEqual(1, d.index(s2))
+        
+    def test_index_throws_valueerror_for_section_from_another_document(self):
+        d = hps.Document([hps.FirstSection([],None)])
+        with self.assertRaises(ValueError):
+            d.index(hps.Section("foo",[],None))
+        
+        
+class TestAnswers(unittest.TestCase):
+
+    def make_document(self):
+        return hps.Document([
+            hps.FirstSection([ hps.ChoiceBlock([
+                hps.FirstChoice("X","foo",None,None,None),
+                hps.Choice(None,"bar",None,None,None) ],None) ],None),
+            hps.Section("dave",[ hps.TextBlock("hi",None), hps.ChoiceBlock([
+                hps.FirstChoice(None,"weh",None,None,None),
+                hps.Choice(None,"meh",None,None,None),
+                hps.Choice(None,"yadda",None,None,None) ],None) ],None) ])
+
+    def test_has_document(self):
+        d = self.make_document()
+        self.assertIs(d, hps.Answers(d).document)
+
+    def test_blocks_start_unanswered(self):
+        d = self.make_document()
+        a = hps.Answers(d)
+        self.assertIsNone(a.selected(d.sections[0].items[0]))
+        self.assertIsNone(a.selected(d.sections[1].items[1]))
+
+    def test_unanswered_block_has_parsed_marks(self):
+        d = self.make_document()
+        self.assertEqual(["X",None], hps.Answers(d).marks(d.sections[0].items[0]))
+
+    def test_select_records_choice(self):
+        d = self.make_document()
+        a = hps.Answers(d)
+        a.select(d.sections[1].items[1],2)
+        self.assertEqual(2, a.selected(d.sections[1].items[1]))
+        self.assertEqual([None,None,"X"], a.marks(d.sections[1].items[1]))
+        self.assertIsNone(a.selected(d.sections[0].items[0]))
+
+    def test_select_replaces_parsed_marks(self):
+        d = self.make_document()
+        a = hps.Answers(d)
+        a.select(d.sections[0].items[0],1)
+        self.assertEqual([None,"X"], a.marks(d.sections[0].items[0]))
+
+    def test_select_none_forgets_answer(self):
+        d = self.make_document()
+        a = hps.Answers(d)
+        a.select(d.sections[0].items[0],1)
+        a.select(d.sections[0].items[0],None)
+        self.assertIsNone(a.selected(d.sections[0].items[0]))
+        self.assertEqual(["X",None], a.marks(d.sections[0].items[0]))
+
+    def test_select_leaves_document_unchanged(self):
+        d = self.make_document()
+        hps.Answers(d).select(d.sections[0].items[0],1)
+        self.assertEqual("X", d.sections[0].items[0].choices[0].mark)
+        self.assertIsNone(d.sections[0].items[0].choices[1].mark)
+
+    def test_answers_are_independent(self):
+        d = self.make_document()
+        a1 = hps.Answers(d)
+        a2 = hps.Answers(d)
+        a1.select(d.sections[1].items[1],0)
+        a2.select(d.sections[1].items[1],1)
+        self.assertEqual(0, a1.selected(d.sections[1].items[1]))
+        self.assertEqual(1, a2.selected(d.sections[1].items[1]))
+
+    def test_copy_is_independent(self):
+        d = self.make_document()
+        a = hps.Answers(d)
+        a.select(d.sections[0].items[0],1)
+        a2 = a.copy()
+        a2.select(d.sections[0].items[0],0)
+        self.assertEqual(1, a.selected(d.sections[0].items[0]))
+        self.assertEqual(0, a2.selected(d.sections[0].items[0]))
+
+    def test_update_takes_on_other_choices(self):
+        d = self.make_document()
+        a = hps.Answers(d)
+        a2 = hps.Answers(d)
+        a2.select(d.sections[1].items[1],2)
+        a.update(a2)
+        self.assertEqual(2, a.selected(d.sections[1].items[1]))
+
+    def test_update_throws_valueerror_for_other_document(self):
+        with self.assertRaises(ValueError):
+            hps.Answers(self.make_document()).update(hps.Answers(self.make_document()))
+
+    def test_tolist_gives_selections_in_document_order(self):
+        d = self.make_document()
+        a = hps.Answers(d)
+        a.select(d.sections[1].items[1],2)
+        self.assertEqual([-1,2], a.tolist())
+
+    def test_can_make_from_list(self):
+        d = self.make_document()
+        a = hps.Answers(d,[1,-1])
+        self.assertEqual(1, a.selected(d.sections[0].items[0]))
+        self.assertIsNone(a.selected(d.sections[1].items[1]))
+
+    def test_throws_valueerror_for_list_of_wrong_length(self):
+        with self.assertRaises(ValueError):
+            hps.Answers(self.make_document(),[1])
+
+    def test_select_throws_indexerror_for_bad_index(self):
+        d = self.make_document()
+        with self.assertRaises(IndexError):
+            hps.Answers(d).select(d.sections[0].items[0],2)
+
+    def test_throws_valueerror_for_block_from_another_document(self):
+        d = self.make_document()
+        with self.assertRaises(ValueError):
+            hps.Answers(d).selected(self.make_document().sections[0].items[0])
+
+    def test_can_pickle(self):
+        import pickle
+        d = self.make_document()
+        a = hps.Answers(d)
+        a.select(d.sections[1].items[1],1)
+        a2 = pickle.loads(pickle.dumps(a))
+        b = a2.document.sections[1].items[1]
+        self.assertEqual(1, a2.selected(b))
+
+
+class TestReadOnlyList(unittest.TestCase):
+
+    def test_reads_as_list(self):
+        l = hps.ReadOnlyList(["a","b"])
+        self.assertEqual(["a","b"], l)
+        self.assertEqual(["b"], l[1:])
+        self.assertEqual(["b","a"], list(reversed(l)))
+        
+    def test_refuses_changes(self):
+        l = hps.ReadOnlyList(["a","b"])
+        for change in (lambda: l.append("c"), lambda: l.extend(["c"]), lambda: l.pop(),
+                lambda: l.insert(0,"c"), lambda: l.remove("a"), lambda: l.sort(),
+                lambda: l.reverse(), lambda: l.clear(), lambda: l.__delitem__(0),
+                lambda: l.__setitem__(slice(0,1),["c"]), lambda: l.__iadd__(["c"])):
+            with self.assertRaises(TypeError):
+                change()
+        self.assertEqual(["a","b"], l)
+        
+    def test_refuses_changes_through_list_methods(self):
+        l = hps.ReadOnlyList(["a","b"])
+        for change in (lambda: list.append(l,"c"), lambda: list.extend(l,["c"]),
+                lambda: list.__setitem__(l,0,"c"), lambda: list.__delitem__(l,0),
+                lambda: list.clear(l)):
+            with self.assertRaises(TypeError):
+                change()
+        self.assertEqual(["a","b"], l)
+        
+    def test_compares_with_lists(self):
+        l = hps.ReadOnlyList(["a","b"])
+        self.assertTrue(l == hps.ReadOnlyList(["a","b"]))
+        self.assertTrue(l != ["a"])
+        self.assertFalse(l == ("a","b"))
+        self.assertEqual(["a","b","c"], l + ["c"])
+        self.assertEqual("['a', 'b']", repr(l))
+        
+
+    def test_can_pickle(self):
+        import pickle
+        l = pickle.loads(pickle.dumps(hps.ReadOnlyList(["a","b"])))
+        self.assertIsInstance(l, hps.ReadOnlyList)
+        self.assertEqual(["a","b"], l)
+        
+    def test_accessors_dont_copy(self):
+        c = hps.ChoiceBlock([hps.Choice(None,"a",None,None,None)],None)
+        s = hps.Section("foo",[c],None)
+        d = hps.Document([s])
+        self.assertIs(d.sections, d.sections)
+        self.assertIs(s.items, s.items)
+        self.assertIs(c.choices, c.choices)
+        
+    def test_node_keeps_read_only_list_given(self):
+        s = hps.Section("foo",[],None)
+        self.assertIs(s.items, hps.Section("bar",s.items,None).items)
         
+    def test_node_copies_list_given(self):
+        items = []
+        s = hps.Section("foo",items,None)
+        items.append("x")
+        self.assertEqual([], s.items)
+
+
+class TestDiagnostic(unittest.TestCase):
+
+    def test_fields_readable(self):
+        d = hps.Diagnostic("foo",hps.Diagnostic.WARNING,"bar",3,4)
+        self.assertEqual(("foo","warning","bar",3,4), 
+            (d.message,d.severity,d.section,d.line,d.column))
+            
+    def test_defaults_to_error(self):
+        self.assertEqual(hps.Diagnostic.ERROR, hps.Diagnostic("foo").severity)
         
+    def test_fields_not_writable(self):
+        d = hps.Diagnostic("foo")
+        with self.assertRaises(AttributeError):
+            d.message = "bar"
+            
+    def test_str_gives_message(self):
+        self.assertEqual("foo", str(hps.Diagnostic("foo",section="bar",line=1)))
+
+
 class TestFirstSection(unittest.TestCase):
 
+    def test_key_is_none(self):
+        self.assertIsNone(hps.FirstSection([],None).key)
+
     def test_construct(self):
         hps.FirstSection([],"bar")
         
@@ -448,7 +1225,8 @@ class TestFirstSection(unittest.TestCase):
     def test_items_immutable(self):
         i = hps.TextBlock("a",None)
         f = hps.FirstSection([i],None)
-        f.items[0] = "bar"
+        with self.assertRaises(TypeError):
+            f.items[0] = "bar"
         self.assertEqual(i,f.items[0])
             
     def test_feedback_readable(self):
@@ -538,6 +1316,11 @@ class TestSection(unittest.TestCase):
     def test_construct(self):
         hps.Section("foo",[],None)
         
+    def test_key_is_lowercase_heading(self):
+        s = hps.Section("Foo Bar",[],None)
+        self.assertEqual("foo bar", s.key)
+        self.assertIs(s.key, hps.Section("FOO BAR",[],None).key)
+        
     def test_heading_readable(self):
         s = hps.Section("foo",[],None)
         self.assertEqual("foo", s.heading)
@@ -560,7 +1343,8 @@ class TestSection(unittest.TestCase):
     def test_items_immutable(self):
         i = hps.TextBlock("a",None)
         s = hps.Section("foo",[i],None)
-        s.items[0] = "yadda"
+        with self.assertRaises(TypeError):
+            s.items[0] = "yadda"
         self.assertEqual(i,s.items[0])
         
     def test_feedback_readable(self):
@@ -580,6 +1364,13 @@ class TestSection(unittest.TestCase):
         s = hps.Section("foo",[],None)
         with self.assertRaises(AttributeError):
             s.is_completed = True
+            
+    def test_pos_readable(self):
+        s = hps.Section("foo",[],None,12)
+        self.assertEqual(12, s.pos)
+        
+    def test_pos_defaults_to_none(self):
+        self.assertIsNone(hps.Section("foo",[],None).pos)
     
     def setup_parse_methods(self):
         hps.Heading.parse.side_effect = make_parse({"h":hps.Heading("a")})
@@ -610,6 +1401,12 @@ class TestSection(unittest.TestCase):
         result = hps.Section.parse(MockInput("hc"))
         self.assertIsNone(result.feedback)
         
+    @mock_parse_methods
+    def test_parse_records_position(self):
+        self.setup_parse_methods()
+        result = hps.Section.parse(MockInput("xxhc",2))
+        self.assertEqual(2, result.pos)
+        
     @mock_parse_methods
     def test_parse_expects_heading(self):
         self.setup_parse_methods()
@@ -941,6 +1738,10 @@ class TestNewline(unittest.TestCase):
         result = hps.Newline.parse(MockInput("\n^",0,None))
         self.assertTrue( isinstance(result,hps.Newline) )
         
+    def test_parse_returns_shared_instance(self):
+        self.assertIs(hps.Newline.parse(MockInput("\n^",0,None)),
+            hps.Newline.parse(MockInput("\r^",0,None)))
+        
     def test_parse_expects_newline(self):
         self.assertIsNone( hps.Newline.parse(MockInput(",^",0,None)) )
         
@@ -979,7 +1780,8 @@ class TestSectionContent(unittest.TestCase):
             
     def test_items_immutable(self):
         c = hps.SectionContent(["foo","bar"],"weh")
-        c.items[0] = "weh"
+        with self.assertRaises(TypeError):
+            c.items[0] = "weh"
         self.assertEqual("foo", c.items[0])
         
     def test_feedback_readable(self):
@@ -1160,7 +1962,8 @@ class TestChoiceBlock(unittest.TestCase):
     def test_choices_immutable(self):
         cc = hps.Choice(None,"a","b","c",None)
         c = hps.ChoiceBlock([cc],None)
-        c.choices[0] = "blah"
+        with self.assertRaises(TypeError):
+            c.choices[0] = "blah"
         self.assertEqual(cc,c.choices[0])
         
     def test_feedback_readable(self):
@@ -3541,6 +4344,154 @@ class TestStarterLine(unittest.TestCase):
         self.assertEqual(0, i.pos)
 
 
+class TestLex(unittest.TestCase):
+
+    GENERATED_LINES = [
+        "", "  ", "> ", " >> \t", "feedback", "> quoted feedback", ":", "::", "%", "%%",
+        ":: Some text", ":  more text", "%% Do this", "%  and this", "== Foo ==", "> == bar baz  ==",
+        "== x == y", "==x", ":: [] yes", ":: [X] yes -- ok", ":  [] no -- GO TO foo",
+        ":  [ y ] maybe -- fine. GO TO bar baz.", ":  [] a - b -- c-d GO TO x!?", ":  [] x ---y",
+        ":  [] x --", ":  [] x -- ", ":  [] x -- GO TO", ":  [] x -- GO TO !", ":  [] x -- GO TO y (z)",
+        ":  [] x -- GGO TO y", ":  [[]] x", ":  [ bad", ":      -- a response", ":      GO TO foo",
+        ":  -- GO TO bar", ":  continued", ":  resp more G", "GO TO foo", "-- x", "\t:: tabbed",
+        ":  [] c -- r GO TO  foo  ,", ":: [] a\t", ":: text -- not a choice",
+    ]
+
+    def assert_same_as_combinators(self,text):
+        try:
+            expected = hps.Document.parse(hps.Input(text))
+        except hps.ValidationError:
+            expected = None
+        result = hlx.parse(text)
+        if result is not None:
+            self.assertEqual(repr(expected),repr(result),repr(text))
+            self.assertEqual([s.pos for s in expected.sections],
+                [s.pos for s in result.sections],repr(text))
+        elif expected is not None:
+            self.fail("Tokenizer failed to parse %s" % repr(text))
+
+    def test_tokenize_classifies_lines(self):
+        tokens = hlx.tokenize("\n> \n:: a\n: b\n%% c\n% d\n== e ==\nf\n::\n")
+        self.assertEqual([hlx.BLANK,hlx.BLANK,hlx.FIRST_TEXT,hlx.TEXT,hlx.FIRST_INSTRUCTION,
+            hlx.INSTRUCTION,hlx.HEADING,hlx.FEEDBACK,hlx.FEEDBACK], [t.kind for t in tokens])
+        self.assertEqual([None,None,"a","b","c","d","e",None,None], [t.text for t in tokens])
+        
+    def test_tokenize_handles_line_breaks(self):
+        tokens = hlx.tokenize(":: a\r\n: b\r: c\n")
+        self.assertEqual(["a","b","c"], [t.text for t in tokens])
+
+    def test_tokenize_rejects_unterminated_line(self):
+        self.assertIsNone(hlx.tokenize(":: a\n: b"))
+        
+    def test_tokenize_rejects_invalid_characters(self):
+        self.assertIsNone(hlx.tokenize(":: caf\xe9\n"))
+        self.assertIsNone(hlx.tokenize(":: a\x00\n"))
+        
+    def test_heading_starts(self):
+        t = ":: a\n== foo ==\n > ==x==\n  == y ==\n:: == z ==\n== w == \n\r== v ==\r\n== u =="
+        self.assertEqual([t.index("== foo"),t.index(" > =="),t.index("== v"),t.index("== u")],
+            hlx.heading_starts(t))
+        
+    def test_is_heading(self):
+        self.assertTrue(hlx.is_heading("== foo =="))
+        self.assertTrue(hlx.is_heading(" > ==foo bar  ==="))
+        self.assertFalse(hlx.is_heading("== foo == "))
+        self.assertFalse(hlx.is_heading(":: == foo =="))
+
+    def test_parse_returns_none_for_parse_error(self):
+        self.assertIsNone(hlx.parse("== foo ==\n:: bar\n"))
+        
+    def test_parse_returns_none_for_consecutive_choice_blocks(self):
+        self.assertIsNone(hlx.parse(":: [] a\n\n:: [] b\n"))
+
+    def test_parse_handles_multiline_choice(self):
+        result = hlx.parse(":: [] a\n\nfb\n:  b -- c\n:  GO TO d\n")
+        choice = result.sections[0].items[0].choices[0]
+        self.assertEqual("a b", choice.description)
+        self.assertEqual("c", choice.response)
+        self.assertEqual("d", choice.goto)
+        self.assertEqual("fb", choice.feedback)
+
+    def test_same_as_combinators_for_test_corpus(self):
+        with open(__file__) as f, warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node,ast.Constant) and isinstance(node.value,str):
+                text = node.value.replace("\x00","")
+                self.assert_same_as_combinators(text)
+                self.assert_same_as_combinators(text+"\n")
+                
+    def test_same_as_combinators_for_generated_documents(self):
+        rand = random.Random(0)
+        for i in range(2000):
+            lines = [ rand.choice(self.GENERATED_LINES) for j in range(rand.randint(1,12)) ]
+            self.assert_same_as_combinators("".join( 
+                l+rand.choice(["\n","\n","\r\n","\r"]) for l in lines ))
+
+    def test_same_as_combinators_for_benchmark_document(self):
+        import bench
+        self.assert_same_as_combinators(bench.make_document(20))
+
+
+class TestGenParse(unittest.TestCase):
+
+    def assert_same_as_combinators(self,text):
+        input = hps.Input(text)
+        try:
+            expected = repr(hps.Document.parse(input)),None
+        except hps.ValidationError as e:
+            expected = None,str(e)
+        try:
+            document,pos = hgp.parse(text)
+            result = repr(document),None
+        except hps.ValidationError as e:
+            document,pos = None,None
+            result = None,str(e)
+        self.assertEqual(expected,result,repr(text))
+        if document is not None:
+            self.assertEqual([s.pos for s in hps.Document.parse(hps.Input(text)).sections],
+                [s.pos for s in document.sections],repr(text))
+        elif result[1] is None:
+            self.assertEqual(input.get_deepest_pos(),pos,repr(text))
+
+    def test_parses_document(self):
+        document,pos = hgp.parse(":: a\n\n== foo ==\n\n:: [] b -- c GO TO foo\n")
+        self.assertIsNone(pos)
+        self.assertEqual("foo", document.sections[1].heading)
+        self.assertEqual("foo", document.sections[1].items[0].choices[0].goto)
+
+    def test_gives_position_of_parse_error(self):
+        self.assertEqual((None,9), hgp.parse("== foo ==\n:: bar\n"))
+
+    def test_raises_validation_error_for_consecutive_choice_blocks(self):
+        with self.assertRaises(hps.ValidationError):
+            hgp.parse(":: [] a\n\n:: [] b\n")
+
+    def test_same_as_combinators_for_test_corpus(self):
+        with open(__file__) as f, warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node,ast.Constant) and isinstance(node.value,str):
+                self.assert_same_as_combinators(node.value)
+                self.assert_same_as_combinators(node.value+"\n")
+
+    def test_same_as_combinators_for_generated_documents(self):
+        rand = random.Random(1)
+        for i in range(2000):
+            lines = [ rand.choice(TestLex.GENERATED_LINES) for j in range(rand.randint(1,12)) ]
+            self.assert_same_as_combinators("".join( 
+                l+rand.choice(["\n","\n","\r\n","\r"]) for l in lines ))
+
+    def test_matches_grammar(self):
+        import generate
+        with open(generate.GRAMMAR) as f:
+            source = generate.generate(f.read())
+        with open(hgp.__file__) as f:
+            self.assertEqual(source, f.read(), "genparse.py is out of date, run generate.py")
+
+
 class TestJsonIO(unittest.TestCase):
 
     def test_has_extensions(self):
@@ -3576,6 +4527,22 @@ class TestJsonIO(unittest.TestCase):
                             '    }\n'
                             ']', s.getvalue())
 
+    def test_write_handles_multiple_sections(self):
+        s = io.StringIO()
+        hio.JsonIO.write(hps.Document([hps.FirstSection([],"foo\nbar"),
+            hps.Section("bar",[],None)]),s ) 
+        self.assertEqual('[\n'
+                            '    {\n'
+                            '        "blocks": [],\n'
+                            '        "feedback": "foo\\nbar"\n'
+                            '    },\n'
+                            '    {\n'
+                            '        "blocks": [],\n'
+                            '        "feedback": null,\n'
+                            '        "name": "bar"\n'
+                            '    }\n'
+                            ']', s.getvalue())
+
     def test_write_handles_textblock(self):
         s = io.StringIO()
         hio.JsonIO.write(hps.Document([hps.FirstSection([hps.TextBlock("blah","yadda")],"")]),s ) 
@@ -3648,6 +4615,61 @@ class TestJsonIO(unittest.TestCase):
                             '        "feedback": "great"\n'
                             '    }\n'
                             ']', s.getvalue() )
+
+    def test_write_marks_choices_from_answers(self):
+        d = hps.Document([hps.FirstSection([hps.ChoiceBlock([
+            hps.Choice("X","foo",None,None,None),
+            hps.Choice(None,"bar",None,None,None) ],None)],None)])
+        a = hps.Answers(d)
+        a.select(d.sections[0].items[0],1)
+        s = io.StringIO()
+        hio.JsonIO.write(d,s,a)
+        import json
+        self.assertEqual([None,"X"], [ c["mark"] for c in 
+            json.loads(s.getvalue())[0]["blocks"][0]["content"] ])
+                            
+    def test_read_handles_document(self):
+        d = hio.JsonIO.read(io.StringIO('[]'))
+        self.assertEqual([], d.sections)
+        
+    def test_read_handles_sections(self):
+        d = hio.JsonIO.read(io.StringIO('[{"blocks": [], "feedback": "foo"},'
+            '{"blocks": [], "feedback": null, "name": "bar"}]'))
+        self.assertEqual("FirstSection([],'foo')", repr(d.sections[0]))
+        self.assertEqual("Section('bar',[],None)", repr(d.sections[1]))
+        
+    def test_read_handles_blocks(self):
+        d = hio.JsonIO.read(io.StringIO('[{"blocks": ['
+            '{"content": "foo", "type": "text"},'
+            '{"content": "bar", "type": "instructions"},'
+            '{"content": [{"description": "a", "goto": "x", "mark": null, "response": "b"},'
+                '{"description": "c", "goto": null, "mark": "X", "response": null}],'
+                '"feedback": "d", "type": "choices"}'
+            '], "feedback": null}]'))
+        self.assertEqual("[TextBlock('foo',None), InstructionBlock('bar',None), "
+            "ChoiceBlock([FirstChoice(None,'a','b','x',None), Choice('X','c',None,None,None)],'d')]",
+            repr(d.sections[0].items))
+            
+    def test_read_round_trips_written_document(self):
+        import bench
+        doc = hio.HrbrtIO.read(io.StringIO(bench.make_document(10)))
+        s = io.StringIO()
+        hio.JsonIO.write(doc,s)
+        s2 = io.StringIO()
+        hio.JsonIO.write(hio.JsonIO.read(io.StringIO(s.getvalue())),s2)
+        self.assertEqual(s.getvalue(), s2.getvalue())
+        
+    def test_read_throws_inputerror_for_invalid_json(self):
+        with self.assertRaises(hps.InputError):
+            hio.JsonIO.read(io.StringIO('[{"blocks": '))
+            
+    def test_read_throws_inputerror_for_missing_field(self):
+        with self.assertRaises(hps.InputError):
+            hio.JsonIO.read(io.StringIO('[{"feedback": null}]'))
+            
+    def test_read_throws_inputerror_for_unknown_block_type(self):
+        with self.assertRaises(hps.InputError):
+            hio.JsonIO.read(io.StringIO('[{"blocks": [{"type": "foo"}], "feedback": null}]'))
                     
                     
 class TestHrbrtIO(unittest.TestCase):
@@ -3849,6 +4871,18 @@ class TestHrbrtIO(unittest.TestCase):
             +":  [Y] weh\n:      -- meh\n:      GO TO yadda\n",
             s.getvalue())
 
+    def test_write_marks_choices_from_answers(self):
+        d = hps.Document([
+                hps.FirstSection([ hps.ChoiceBlock([
+                    hps.Choice("X","foo",None,None,None),
+                    hps.Choice(None,"weh",None,None,None)
+                ],None) ],None) ])
+        a = hps.Answers(d)
+        a.select(d.sections[0].items[0],1)
+        s = io.StringIO()
+        hio.HrbrtIO.write(d,s,a)
+        self.assertEqual(":: [] foo\n:  [X] weh\n", s.getvalue())
+
     def test_write_handles_multiple_sections(self):
         s = io.StringIO()
         hio.HrbrtIO.write(hps.Document([
@@ -3873,6 +4907,35 @@ class TestHrbrtIO(unittest.TestCase):
         i = hps.Document.parse.call_args[0][0]
         self.assertEqual( "test\x00", i._data )
 
+    @mock_statics(hps,"Document.parse")
+    def test_read_uses_line_tokenizer_first(self):
+        result = hio.HrbrtIO.read(io.StringIO(":: test\n"))
+        self.assertFalse( hps.Document.parse.called )
+        self.assertEqual( "test", result.sections[0].items[0].text )
+
+    @mock_statics(hps,"Document.parse")
+    def test_read_can_skip_line_tokenizer(self):
+        hio.HrbrtIO.read(io.StringIO(":: test\n"),fast=False)
+        self.assertTrue( hps.Document.parse.called )
+
+    @mock_statics(hps,"Document.parse")
+    def test_read_uses_memo_for_packrat(self):
+        s = io.StringIO("test")
+        hio.HrbrtIO.read(s,packrat=True)
+        i = hps.Document.parse.call_args[0][0]
+        self.assertTrue( isinstance(i._memo, hps.Memo) )
+
+    @mock_statics(hps,"Document.parse")
+    def test_read_uses_given_memo(self):
+        m = hps.Memo()
+        hio.HrbrtIO.read(io.StringIO("test"),packrat=m)
+        self.assertIs( m, hps.Document.parse.call_args[0][0]._memo )
+
+    @mock_statics(hps,"Document.parse")
+    def test_read_doesnt_memoize_by_default(self):
+        hio.HrbrtIO.read(io.StringIO("test"))
+        self.assertIsNone( hps.Document.parse.call_args[0][0]._memo )
+
     @mock_statics(hps,"Document.parse")
     def test_read_returns_parse_result(self):
         m = mock.Mock()
@@ -3880,6 +4943,289 @@ class TestHrbrtIO(unittest.TestCase):
         s = io.StringIO("test")
         self.assertEqual(m, hio.HrbrtIO.read(s) )
         
+    def test_read_gives_section_lines(self):
+        text = ":: [] a -- GO TO foo\n\n> == foo ==\n:: [] b\n"
+        for fast in (True,False):
+            d = hio.HrbrtIO.read(io.StringIO(text),fast=fast)
+            self.assertEqual([(1,1),(3,1)], [ d.line_index.location(s.pos) 
+                for s in d.sections ])
+
+    REPARSE_DOCUMENT = (":: [] a -- GO TO foo\n:  [] b -- GO TO bar\n\n"
+        "== foo ==\n\n:: text\n:: [] c -- GO TO bar\n\n"
+        "== bar ==\n\n%% end\n")
+        
+    def assert_reparse_same_as_read(self,text,offset,removed,inserted):
+        doc = hio.HrbrtIO.read(io.StringIO(text))
+        result = hio.HrbrtIO.reparse(doc,text,offset,removed,inserted)
+        newtext = text[:offset]+inserted+text[offset+removed:]
+        expected = hio.HrbrtIO.read(io.StringIO(newtext))
+        self.assertEqual(repr(expected), repr(result))
+        self.assertEqual([s.pos for s in expected.sections], [s.pos for s in result.sections])
+        last = result.sections[-1].pos
+        self.assertEqual((newtext.count("\n",0,last)+1,1), result.line_index.location(last))
+        def targets(d):
+            return [ [ i for i,s in enumerate(d.sections) if s is d.target(b,c) ]
+                for s in d.sections for b in s.items 
+                if isinstance(b,hps.ChoiceBlock) for c in range(len(b.choices)) ]
+        self.assertEqual(targets(expected), targets(result))
+        return result
+        
+    def test_reparse_handles_edit_within_section(self):
+        t = self.REPARSE_DOCUMENT
+        self.assert_reparse_same_as_read(t,t.index("text"),4,"more words")
+        
+    def test_reparse_leaves_old_document_links(self):
+        t = self.REPARSE_DOCUMENT
+        doc = hio.HrbrtIO.read(io.StringIO(t))
+        before = [ (b,c,doc.target(b,c)) for s in doc.sections for b in s.items 
+            if isinstance(b,hps.ChoiceBlock) for c in range(len(b.choices)) ]
+        hio.HrbrtIO.reparse(doc,t,t.index("text"),4,"more words")
+        self.assertEqual(before, [ (b,c,doc.target(b,c)) for b,c,x in before ])
+        for b,c,target in before:
+            if target is not None:
+                doc.index(target)
+        
+    DIAGNOSE_DOCUMENT = (":: Intro\n\n:: [] a -- GO TO foo\n: [] b -- GO TO nowhere\n\n"
+        +"== foo ==\n\n> :: Text\n>\n> :: [] c -- GO TO bar\n>  : [] d\n\n"
+        +"== bar ==\n\n:: Text\n\n:: [] e -- GO TO foo\n:  [] f -- GO TO bar\n")
+        
+    DIAGNOSE_POSITIONS = [
+        ("Go-to references unknown section 'nowhere'",4,1),
+        ('End section "bar" has no choices that reach end of document',17,1),
+        ('Section "foo" has one or more choices that reach end of section and so '
+            +'never reach end of document',11,1)]
+        
+    def test_read_gives_position_of_choice_or_block_at_fault(self):
+        t = self.DIAGNOSE_DOCUMENT
+        for kw in [dict(fast=False),dict(fast=True),dict(fast=False,generated=True),
+                dict(jobs=2)]:
+            d = hio.HrbrtIO.read(io.StringIO(t),**kw)
+            self.assertEqual(self.DIAGNOSE_POSITIONS, 
+                [ (x.message,x.line,x.column) for x in d.diagnose() ])
+                
+    def test_iter_sections_gives_position_of_choice_or_block_at_fault(self):
+        t = self.DIAGNOSE_DOCUMENT
+        with mock.patch.object(hio.HrbrtIO,"_READ_SIZE",5):
+            sections = list(hio.HrbrtIO.iter_sections(io.StringIO(t)))
+        d = hps.Document(sections,hps.LineIndex(t))
+        self.assertEqual(self.DIAGNOSE_POSITIONS, 
+            [ (x.message,x.line,x.column) for x in d.diagnose() ])
+                
+    def test_reparse_moves_position_of_choice_or_block_at_fault(self):
+        t = self.DIAGNOSE_DOCUMENT
+        doc = hio.HrbrtIO.read(io.StringIO(t))
+        offset = t.index(":: Intro")
+        result = hio.HrbrtIO.reparse(doc,t,offset,0,":: More\n\n")
+        self.assertEqual([ (m,l+2,c) for m,l,c in self.DIAGNOSE_POSITIONS ], 
+            [ (x.message,x.line,x.column) for x in result.diagnose() ])
+        
+    def test_reparse_handles_added_heading(self):
+        t = self.REPARSE_DOCUMENT
+        r = self.assert_reparse_same_as_read(t,t.index(":: [] c"),0,"== new ==\n\n")
+        self.assertEqual(4, len(r.sections))
+        
+    def test_reparse_handles_removed_heading(self):
+        t = self.REPARSE_DOCUMENT
+        r = self.assert_reparse_same_as_read(t,t.index("== bar"),2,"")
+        self.assertEqual(2, len(r.sections))
+        
+    def test_reparse_handles_edit_across_sections(self):
+        t = self.REPARSE_DOCUMENT
+        self.assert_reparse_same_as_read(t,t.index("b --"),t.index("c --")-t.index("b --"),"")
+        
+    def test_reparse_handles_edit_at_end(self):
+        t = self.REPARSE_DOCUMENT
+        self.assert_reparse_same_as_read(t,len(t),0,"%  more\n")
+        
+    def test_reparse_keeps_untouched_sections(self):
+        import bench
+        t = bench.make_document(10)
+        doc = hio.HrbrtIO.read(io.StringIO(t))
+        offset = t.index("section 5,")
+        result = hio.HrbrtIO.reparse(doc,t,offset,0,"x")
+        self.assertIs(doc.sections[0], result.sections[0])
+        self.assertIs(doc.sections[3], result.sections[3])
+        self.assertIs(doc.sections[9].items[0], result.sections[9].items[0])
+        self.assertIsNot(doc.sections[5].items[0], result.sections[5].items[0])
+        
+    def test_reparse_throws_inputerror_for_parse_error(self):
+        t = self.REPARSE_DOCUMENT
+        doc = hio.HrbrtIO.read(io.StringIO(t))
+        with self.assertRaises(hps.InputError):
+            hio.HrbrtIO.reparse(doc,t,t.index(":: text"),t.index("== bar")-t.index(":: text"),"")
+
+    PARALLEL_DOCUMENT = (":: [] a -- GO TO foo\n:  [] b -- GO TO bar\n\n"
+        "== foo ==\n\n:: text\n:: [] c -- GO TO bar\n\n"
+        "== bar ==\n\n:: more text\n\n> == baz ==\n\n%% end\n")
+
+    @mock.patch.object(hio.HrbrtIO,"CHUNK_SIZE",10)
+    def test_read_in_parallel_gives_same_document(self):
+        t = self.PARALLEL_DOCUMENT
+        for fast in (True,False):
+            expected = hio.HrbrtIO.read(io.StringIO(t),fast=fast)
+            result = hio.HrbrtIO.read(io.StringIO(t),fast=fast,jobs=10)
+            self.assertEqual(repr(expected), repr(result))
+            self.assertEqual([s.pos for s in expected.sections], [s.pos for s in result.sections])
+            self.assertEqual((13,1), result.line_index.location(result.sections[-1].pos))
+            
+    @mock.patch.object(hio.HrbrtIO,"CHUNK_SIZE",10)
+    def test_read_in_parallel_splits_at_headings(self):
+        t = self.PARALLEL_DOCUMENT
+        self.assertEqual([0,t.index("== foo"),t.index("== bar"),t.index("> == baz")], 
+            hio.HrbrtIO.INST._chunks(t,10))
+        self.assertEqual([0,t.index("== foo")], hio.HrbrtIO.INST._chunks(t,3))
+        
+    def test_read_in_parallel_handles_long_goto_chain(self):
+        import bench
+        t = bench.make_document(3000)
+        result = hio.HrbrtIO.read(io.StringIO(t),jobs=4)
+        self.assertEqual(3000, len(result.sections))
+        self.assertIs(result.sections[-1], result.target(result.sections[-2].items[1],0))
+        
+    def test_read_in_parallel_leaves_small_document_whole(self):
+        t = self.PARALLEL_DOCUMENT
+        self.assertEqual([0], hio.HrbrtIO.INST._chunks(t,4))
+        
+    @mock.patch.object(hio.HrbrtIO,"CHUNK_SIZE",10)
+    def test_read_in_parallel_throws_inputerror_at_document_position(self):
+        t = self.PARALLEL_DOCUMENT
+        t = t.replace("== bar ==\n\n:: more text\n","== bar ==\n\nnothing\n")
+        for fast in (True,False):
+            with self.assertRaises(hps.InputError) as expected:
+                hio.HrbrtIO.read(io.StringIO(t),fast=fast)
+            with self.assertRaises(hps.InputError) as result:
+                hio.HrbrtIO.read(io.StringIO(t),fast=fast,jobs=10)
+            self.assertEqual(str(expected.exception), str(result.exception))
+
+    @mock.patch.object(hio.HrbrtIO,"CHUNK_SIZE",1)
+    def test_read_in_parallel_throws_earlier_inputerror_before_validationerror(self):
+        t = (":: ok\n== a ==\n: orphan line no starter\n== b ==\n:: t\n"
+            "== c ==\n:: [] one\n:: [] two\n")
+        for fast in (True,False):
+            with self.assertRaises(hps.InputError) as expected:
+                hio.HrbrtIO.read(io.StringIO(t),fast=fast)
+            with self.assertRaises(hps.InputError) as result:
+                hio.HrbrtIO.read(io.StringIO(t),fast=fast,jobs=3)
+            self.assertEqual(str(expected.exception), str(result.exception))
+            
+    @mock.patch.object(hio.HrbrtIO,"CHUNK_SIZE",1)
+    def test_read_in_parallel_throws_validationerror_of_piece(self):
+        t = ":: ok\n== a ==\n:: t\n== c ==\n:: [] one\n:: [] two\n"
+        with self.assertRaises(hps.ValidationError):
+            hio.HrbrtIO.read(io.StringIO(t),jobs=3)
+
+    def read_mapped(self,data,**kargs):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d,"test.hb")
+            with open(filename,"wb") as f:
+                f.write(data)
+            with open(filename,"rb") as f:
+                return hio.HrbrtIO.read(f,mmap=True,**kargs)
+                
+    def test_read_mapped_gives_same_document(self):
+        t = self.PARALLEL_DOCUMENT
+        for fast in (True,False):
+            expected = hio.HrbrtIO.read(io.StringIO(t),fast=fast)
+            result = self.read_mapped(t.encode("ascii"),fast=fast)
+            self.assertEqual(repr(expected), repr(result))
+            self.assertEqual([s.pos for s in expected.sections], [s.pos for s in result.sections])
+            self.assertEqual((13,1), result.line_index.location(result.sections[-1].pos))
+            
+    @mock_statics(hlx,"parse")
+    def test_read_mapped_parses_mapping_when_tokenizer_fails(self):
+        hlx.parse.return_value = None
+        t = self.PARALLEL_DOCUMENT
+        self.assertEqual(repr(hio.HrbrtIO.read(io.StringIO(t),fast=False)), 
+            repr(self.read_mapped(t.encode("ascii"))))
+            
+    def test_read_mapped_throws_inputerror_for_parse_error(self):
+        for data in (b":: [] a\n== foo ==\n", ":: caf\u00e9\n".encode("utf-8"), b""):
+            for fast in (True,False):
+                with self.assertRaises(hps.InputError):
+                    self.read_mapped(data,fast=fast)
+
+    def test_iter_sections_gives_same_sections_as_read(self):
+        t = self.PARALLEL_DOCUMENT
+        for size in (1,7,1000):
+            with mock.patch.object(hio.HrbrtIO,"_READ_SIZE",size):
+                for fast in (True,False):
+                    expected = hio.HrbrtIO.read(io.StringIO(t),fast=fast).sections
+                    result = list(hio.HrbrtIO.iter_sections(io.StringIO(t),fast=fast))
+                    self.assertEqual(repr(expected), repr(result))
+                    self.assertEqual([s.pos for s in expected], [s.pos for s in result])
+                    
+    def test_iter_sections_handles_carriage_returns(self):
+        t = self.PARALLEL_DOCUMENT.replace("\n","\r\n")
+        with mock.patch.object(hio.HrbrtIO,"_READ_SIZE",5):
+            result = list(hio.HrbrtIO.iter_sections(io.StringIO(t,newline="")))
+        self.assertEqual(["foo","bar","baz"], [s.heading for s in result[1:]])
+        self.assertEqual(t.index("== foo"), result[1].pos)
+                    
+    def test_iter_sections_yields_sections_before_reading_whole_stream(self):
+        t = self.PARALLEL_DOCUMENT
+        s = io.StringIO(t)
+        with mock.patch.object(hio.HrbrtIO,"_READ_SIZE",10):
+            sections = hio.HrbrtIO.iter_sections(s)
+            self.assertIsInstance(next(sections), hps.FirstSection)
+            self.assertLess(s.tell(), t.index("== bar"))
+            
+    def test_iter_sections_throws_inputerror_for_parse_error(self):
+        t = self.PARALLEL_DOCUMENT.replace(":: more text\n","nothing\n")
+        sections = hio.HrbrtIO.iter_sections(io.StringIO(t))
+        self.assertEqual(None, next(sections).feedback)
+        self.assertEqual("foo", next(sections).heading)
+        with self.assertRaises(hps.InputError):
+            next(sections)
+
+    def test_read_gives_line_and_column_of_parse_error(self):
+        t = ":: [] a -- GO TO foo\n\n== foo ==\n\n== bar ==\n\n:: x\n"
+        for fast in (True,False):
+            with self.assertRaises(hps.InputError) as cm:
+                hio.HrbrtIO.read(io.StringIO(t),fast=fast)
+            self.assertEqual((5,10), (cm.exception.line,cm.exception.column))
+            self.assertEqual("Parse error at line 5, column 10", str(cm.exception))
+            
+    def test_read_generated_gives_same_document(self):
+        t = self.PARALLEL_DOCUMENT
+        expected = hio.HrbrtIO.read(io.StringIO(t),fast=False)
+        for fast in (True,False):
+            result = hio.HrbrtIO.read(io.StringIO(t),fast=fast,generated=True)
+            self.assertEqual(repr(expected), repr(result))
+            self.assertEqual(repr(expected), repr(self.read_mapped(t.encode("ascii"),
+                fast=fast,generated=True)))
+        
+    @mock_statics(hps,"Document.parse")
+    def test_read_generated_doesnt_use_combinators(self):
+        hio.HrbrtIO.read(io.StringIO(":: a\n"),fast=False,generated=True)
+        self.assertFalse(hps.Document.parse.called)
+        
+    def test_read_generated_gives_line_and_column_of_parse_error(self):
+        t = ":: [] a -- GO TO foo\n\n== foo ==\n\n== bar ==\n\n:: x\n"
+        with self.assertRaises(hps.InputError) as cm:
+            hio.HrbrtIO.read(io.StringIO(t),generated=True)
+        self.assertEqual((5,10), (cm.exception.line,cm.exception.column))
+            
+    def test_iter_sections_gives_line_of_parse_error(self):
+        t = ":: [] a -- GO TO foo\n\n== foo ==\n\n== bar ==\n\n:: x\n"
+        with mock.patch.object(hio.HrbrtIO,"_READ_SIZE",3):
+            with self.assertRaises(hps.InputError) as cm:
+                list(hio.HrbrtIO.iter_sections(io.StringIO(t)))
+        self.assertEqual((5,10), (cm.exception.line,cm.exception.column))
+
+    def test_iter_sections_gives_same_error_position_as_read(self):
+        ts = ["\rx\r\n== foo ==\r\n:: [] c -- GO TO foo\n",
+              "== foo ==\r\n\r\n:: [] a -- GO TO\r\n\r\n== bar ==\r\nb\r\n",
+              "a\n\n== foo ==\n\n:: x\n\n== bar ==\n\nb\n"]
+        for t in ts:
+            with self.assertRaises(hps.InputError) as cm:
+                hio.HrbrtIO.read(io.StringIO(t))
+            expected = (cm.exception.line,cm.exception.column)
+            for size in (1,2,3,5,7):
+                with mock.patch.object(hio.HrbrtIO,"_READ_SIZE",size):
+                    with self.assertRaises(hps.InputError) as cm:
+                        list(hio.HrbrtIO.iter_sections(io.StringIO(t)))
+                self.assertEqual(expected, (cm.exception.line,cm.exception.column))
+
     @mock_statics(hps,"Document.parse")
     def test_read_throws_inputerror_for_parse_error(self):
         hps.Document.parse.return_value = None
@@ -3888,6 +5234,237 @@ class TestHrbrtIO(unittest.TestCase):
             hio.HrbrtIO.read(s)
     
 
+class TestBinaryIO(unittest.TestCase):
+
+    DOCUMENT = (":: Cafe [] menu\n\n:: [X] Tea -- Fine. GO TO Drinks\n"
+        ":  [] Nothing\n\nsome feedback\n\n== drinks ==\n\n%% Pour it\n\n"
+        ":: [] Done -- GO TO DRINKS\n:  [] Leave\n")
+
+    def written(self,doc):
+        s = io.BytesIO()
+        hio.BinaryIO.write(doc,s)
+        return s.getvalue()
+
+    def test_has_extensions(self):
+        hio.BinaryIO.EXTENSIONS[0]
+        
+    def test_write_starts_with_header(self):
+        data = self.written(hps.Document([]))
+        self.assertEqual(b"HBRT", data[:4])
+        self.assertEqual(hio.BinaryIO.VERSION, data[4]+(data[5]<<8))
+        
+    def test_round_trips_empty_document(self):
+        d = hio.BinaryIO.read(io.BytesIO(self.written(hps.Document([]))))
+        self.assertEqual([], d.sections)
+        
+    def test_round_trips_document(self):
+        doc = hio.HrbrtIO.read(io.StringIO(self.DOCUMENT))
+        d = hio.BinaryIO.read(io.BytesIO(self.written(doc)))
+        self.assertEqual(repr(doc), repr(d))
+        
+    def test_round_trips_benchmark_document(self):
+        import bench
+        doc = hio.HrbrtIO.read(io.StringIO(bench.make_document(20)))
+        self.assertEqual(repr(doc), repr(hio.BinaryIO.load(self.written(doc))))
+        
+    def test_write_marks_choices_from_answers(self):
+        doc = hio.HrbrtIO.read(io.StringIO(self.DOCUMENT))
+        a = hps.Answers(doc)
+        a.select(doc.sections[0].items[1],1)
+        a.select(doc.sections[1].items[1],0)
+        s = io.BytesIO()
+        hio.BinaryIO.write(doc,s,a)
+        d = hio.BinaryIO.load(s.getvalue())
+        self.assertEqual([None,"X"], [ c.mark for c in d.sections[0].items[1].choices ])
+        self.assertEqual(["X",None], [ c.mark for c in d.sections[1].items[1].choices ])
+        
+    def test_links_gotos_from_stored_targets(self):
+        doc = hio.HrbrtIO.read(io.StringIO(self.DOCUMENT))
+        data = self.written(doc)
+        # with section names unusable, go-tos can only be linked by index
+        with mock.patch.object(hps.Section,"key",property(lambda s: None)):
+            d = hio.BinaryIO.load(data)
+        self.assertIs(d.sections[1], d.target(d.sections[0].items[1],0))
+        self.assertIs(d.sections[1], d.target(d.sections[1].items[1],0))
+        self.assertIsNone(d.target(d.sections[1].items[1],1))
+        
+    def test_load_throws_inputerror_for_target_out_of_range(self):
+        doc = hps.Document([hps.FirstSection([hps.ChoiceBlock([
+            hps.Choice(None,"a",None,None,None)],None)],None)])
+        import struct
+        data = bytearray(self.written(doc))
+        # the target is the fifth field of the choice record at the end
+        data[-8:-4] = struct.pack("<i",5)
+        with self.assertRaises(hps.InputError):
+            hio.BinaryIO.load(bytes(data))
+        
+    def test_round_trips_unicode(self):
+        doc = hps.Document([hps.FirstSection([hps.TextBlock("Caf\u00e9 \u2615",None)],"\u00fc")])
+        self.assertEqual(repr(doc), repr(hio.BinaryIO.load(self.written(doc))))
+        
+    def test_stores_strings_once(self):
+        doc = hps.Document([hps.FirstSection([hps.TextBlock("x"*100,None),
+            hps.TextBlock("x"*100,None)],None)])
+        self.assertLess(len(self.written(doc)), 200)
+        
+    def test_stores_goto_section_index(self):
+        doc = hio.HrbrtIO.read(io.StringIO(self.DOCUMENT))
+        data = self.written(doc)
+        choice = hio.BinaryIO._CHOICE
+        # last two choice records in the file: "Done" then "Leave"
+        end = len(data)
+        self.assertEqual(-1, choice.unpack_from(data,end-choice.size)[4])
+        self.assertEqual(1, choice.unpack_from(data,end-2*choice.size)[4])
+        
+    def test_read_can_memory_map_file(self):
+        doc = hio.HrbrtIO.read(io.StringIO(self.DOCUMENT))
+        path = os.path.join(os.path.dirname(__file__),"_test_binaryio.hbc")
+        try:
+            with open(path,"wb") as f:
+                hio.BinaryIO.write(doc,f)
+            with open(path,"rb") as f:
+                d = hio.BinaryIO.read(f,mmap=True)
+        finally:
+            os.remove(path)
+        self.assertEqual(repr(doc), repr(d))
+        
+    def test_read_mapped_throws_inputerror_for_empty_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d,"test.hbc")
+            open(path,"wb").close()
+            with open(path,"rb") as f:
+                with self.assertRaises(hps.InputError):
+                    hio.BinaryIO.read(f,mmap=True)
+        
+    def test_read_throws_inputerror_for_wrong_magic(self):
+        with self.assertRaises(hps.InputError):
+            hio.BinaryIO.load(b"XXXX"+self.written(hps.Document([]))[4:])
+            
+    def test_read_throws_inputerror_for_unsupported_version(self):
+        data = bytearray(self.written(hps.Document([])))
+        data[4] += 1
+        with self.assertRaises(hps.InputError):
+            hio.BinaryIO.load(bytes(data))
+            
+    def test_read_throws_inputerror_for_truncated_data(self):
+        doc = hio.HrbrtIO.read(io.StringIO(self.DOCUMENT))
+        data = self.written(doc)
+        for n in (3,12,len(data)//2,len(data)-1):
+            with self.assertRaises(hps.InputError):
+                hio.BinaryIO.load(data[:n])
+
+
+class TestParseCache(unittest.TestCase):
+
+    DOCUMENT = ":: [] a -- GO TO foo\n\n== foo ==\n\n:: b\n\n== bar ==\n\n:: c\n"
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.dir = self.tempdir.name
+        
+    def tearDown(self):
+        self.tempdir.cleanup()
+        
+    def entries(self):
+        return [ n for n in os.listdir(self.dir) if n.endswith(hca.ParseCache.EXTENSION) ]
+
+    def test_get_returns_none_for_uncached_text(self):
+        self.assertIsNone(hca.ParseCache(self.dir).get(self.DOCUMENT))
+        
+    def test_get_returns_stored_document(self):
+        c = hca.ParseCache(self.dir)
+        doc = hio.HrbrtIO.read(io.StringIO(self.DOCUMENT))
+        c.put(self.DOCUMENT,doc)
+        self.assertEqual(repr(doc), repr(c.get(self.DOCUMENT)))
+        
+    def test_get_returns_stored_diagnostics(self):
+        c = hca.ParseCache(self.dir)
+        doc = hio.HrbrtIO.read(io.StringIO(self.DOCUMENT))
+        c.put(self.DOCUMENT,doc)
+        self.assertEqual(repr(doc.diagnose()), repr(c.get(self.DOCUMENT).diagnose()))
+        self.assertEqual(3, c.get(self.DOCUMENT).diagnose()[0].line)
+        
+    def test_get_links_gotos_from_stored_targets(self):
+        c = hca.ParseCache(self.dir)
+        c.put(self.DOCUMENT,hio.HrbrtIO.read(io.StringIO(self.DOCUMENT)))
+        # with section names unusable, go-tos can only be linked by index
+        with mock.patch.object(hps.Section,"key",property(lambda s: None)):
+            d = c.get(self.DOCUMENT)
+        self.assertIs(d.sections[1], d.target(d.sections[0].items[0],0))
+        
+    def test_persists_between_instances(self):
+        hca.ParseCache(self.dir).put(self.DOCUMENT,
+            hio.HrbrtIO.read(io.StringIO(self.DOCUMENT)))
+        self.assertIsNotNone(hca.ParseCache(self.dir).get(self.DOCUMENT))
+        
+    def test_key_depends_on_grammar_version(self):
+        k = hca.ParseCache.key(self.DOCUMENT)
+        with mock.patch.object(hps,"GRAMMAR_VERSION",hps.GRAMMAR_VERSION+1):
+            self.assertNotEqual(k, hca.ParseCache.key(self.DOCUMENT))
+            
+    def test_key_depends_on_text(self):
+        self.assertNotEqual(hca.ParseCache.key(":: a\n"), hca.ParseCache.key(":: b\n"))
+        
+    def test_get_treats_corrupt_entry_as_missing(self):
+        c = hca.ParseCache(self.dir)
+        c.put(self.DOCUMENT,hio.HrbrtIO.read(io.StringIO(self.DOCUMENT)))
+        with open(os.path.join(self.dir,self.entries()[0]),"wb") as f:
+            f.write(b"\xff\xff")
+        self.assertIsNone(c.get(self.DOCUMENT))
+        self.assertEqual([], self.entries())
+        
+    def test_evicts_least_recently_used(self):
+        texts = [ ":: %s\n" % n for n in ("a","b","c") ]
+        c = hca.ParseCache(self.dir)
+        for i,t in enumerate(texts):
+            c.put(t,hio.HrbrtIO.read(io.StringIO(t)))
+            os.utime(os.path.join(self.dir,c.key(t)+c.EXTENSION),(1000+i,1000+i))
+        c.get(texts[0])
+        size = os.path.getsize(os.path.join(self.dir,self.entries()[0]))
+        c = hca.ParseCache(self.dir,size*2)
+        c.evict()
+        self.assertIsNotNone(c.get(texts[0]))
+        self.assertIsNone(c.get(texts[1]))
+        self.assertIsNotNone(c.get(texts[2]))
+        
+    def test_evicts_stale_temporary_files(self):
+        import time
+        c = hca.ParseCache(self.dir)
+        stale = os.path.join(self.dir,"a"+c.TEMP_EXTENSION)
+        fresh = os.path.join(self.dir,"b"+c.TEMP_EXTENSION)
+        for path in (stale,fresh):
+            with open(path,"wb") as f:
+                f.write(b"partial")
+        old = time.time()-c.STALE_AGE-60
+        os.utime(stale,(old,old))
+        c.evict()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+        
+    def test_put_keeps_cache_within_max_size(self):
+        c = hca.ParseCache(self.dir,1000)
+        for i in range(50):
+            t = ":: %d\n" % i
+            c.put(t,hio.HrbrtIO.read(io.StringIO(t)))
+        self.assertLessEqual(sum(os.path.getsize(os.path.join(self.dir,n)) 
+            for n in os.listdir(self.dir)), 1000+200)
+            
+    def test_clear_removes_entries(self):
+        c = hca.ParseCache(self.dir)
+        c.put(self.DOCUMENT,hio.HrbrtIO.read(io.StringIO(self.DOCUMENT)))
+        c.clear()
+        self.assertEqual([], os.listdir(self.dir))
+        
+    def test_hrbrtio_read_uses_cache(self):
+        c = hca.ParseCache(self.dir)
+        doc = hio.HrbrtIO.read(io.StringIO(self.DOCUMENT),cache=c)
+        self.assertEqual(1, len(self.entries()))
+        with mock.patch.object(hlx,"parse") as p:
+            cached = hio.HrbrtIO.read(io.StringIO(self.DOCUMENT),cache=c)
+            self.assertFalse(p.called)
+        self.assertEqual(repr(doc), repr(cached))
+
+
 class TestCommandLineRunner(unittest.TestCase):
 
     def setUp(self):
@@ -4005,6 +5582,14 @@ class TestCommandLineRunner(unittest.TestCase):
             hps.Section("KiTTenS",[],None) ]),"1\n" )
         self.assertEqual("1) foo\n\n> \n\nKiTTenS\n-------\n\n", result)
         
+    def test_raises_runnererror_for_unknown_goto(self):
+        with self.assertRaises(hrun.RunnerError):
+            self.do_run( hps.Document([
+                hps.FirstSection([ hps.ChoiceBlock([
+                    hps.Choice(None,"foo",None,"bar",None)
+                ],None), ],None),
+                hps.Section("flibble",[],None) ]), "1\n" )
+        
     def test_follows_gotos_backwards(self):
         result = self.do_run( hps.Document([
             hps.FirstSection([ hps.ChoiceBlock([
@@ -4022,27 +5607,177 @@ class TestCommandLineRunner(unittest.TestCase):
             +"\n\nfoobar\n------\n\n1) apple\n\n> "
             +"\n\nblarg\n-----\n\n1) aberdeen\n2) birmingham\n\n> \n\n", result)
             
-    def test_records_selected_choice_in_document(self):
+    def test_records_selected_choice_in_answers(self):
         d = hps.Document([ hps.FirstSection([ hps.ChoiceBlock([
             hps.Choice(None,"foo",None,None,None),
             hps.Choice(None,"bar",None,None,None) ],None) ],None) ])
-        self.assertEqual(None,d.sections[0].items[0].choices[0].mark)
-        self.assertEqual(None,d.sections[0].items[0].choices[1].mark)
-        self.do_run(d,"2\n")
-        self.assertEqual(None,d.sections[0].items[0].choices[0].mark)
-        self.assertEqual("X",d.sections[0].items[0].choices[1].mark)
+        a = hrun.CommandLineRunner()._run(d,io.StringIO("2\n"),io.StringIO())
+        self.assertEqual(1,a.selected(d.sections[0].items[0]))
+        self.assertEqual([None,"X"],a.marks(d.sections[0].items[0]))
+        
+    def test_overwrites_existing_selected_choice_in_answers(self):
+        d = hps.Document([ hps.FirstSection([ hps.ChoiceBlock([
+            hps.Choice("X","foo",None,None,None),
+            hps.Choice(None,"bar",None,None,None) ],None) ],None) ])
+        a = hrun.CommandLineRunner()._run(d,io.StringIO("2\n"),io.StringIO())
+        self.assertEqual([None,"X"],a.marks(d.sections[0].items[0]))
         
-    def test_overwrites_existing_selected_choice_in_document(self):
+    def test_leaves_document_unchanged(self):
         d = hps.Document([ hps.FirstSection([ hps.ChoiceBlock([
             hps.Choice("X","foo",None,None,None),
             hps.Choice(None,"bar",None,None,None) ],None) ],None) ])
+        self.do_run(d,"2\n")
         self.assertEqual("X",d.sections[0].items[0].choices[0].mark)
         self.assertEqual(None,d.sections[0].items[0].choices[1].mark)
-        self.do_run(d,"2\n")
-        self.assertEqual(None,d.sections[0].items[0].choices[0].mark)
-        self.assertEqual("X",d.sections[0].items[0].choices[1].mark)
+        
+    def test_records_in_given_answers(self):
+        d = hps.Document([ hps.FirstSection([ hps.ChoiceBlock([
+            hps.Choice(None,"foo",None,None,None),
+            hps.Choice(None,"bar",None,None,None) ],None) ],None) ])
+        a = hps.Answers(d)
+        self.assertIs(a,hrun.CommandLineRunner()._run(d,io.StringIO("1\n"),
+            io.StringIO(),a))
+        self.assertEqual(0,a.selected(d.sections[0].items[0]))
         
         
+class TestStepRunner(unittest.TestCase):
+
+    def make_document(self):
+        return hps.Document([
+            hps.FirstSection([
+                hps.InstructionBlock("psst",None),
+                hps.TextBlock("hello",None),
+                hps.ChoiceBlock([
+                    hps.FirstChoice("X","stay",None,None,None),
+                    hps.Choice(None,"go","Off you go","Away",None) ],None),
+                hps.ChoiceBlock([
+                    hps.FirstChoice(None,"end",None,"Gone",None) ],None) ],None),
+            hps.Section("Away",[
+                hps.TextBlock("far",None),
+                hps.TextBlock("farther",None) ],None),
+            hps.Section("Gone",[],None) ])
+
+    def steps(self,doc,answers):
+        prompts = []
+        state = hrun.StepRunner.start(doc)
+        for a in answers:
+            prompts.append(hrun.StepRunner.present(state))
+            state = hrun.StepRunner.advance(state,a)
+        prompts.append(hrun.StepRunner.present(state))
+        return prompts
+
+    def test_presents_end_for_empty_document(self):
+        state = hrun.StepRunner.start(hps.Document([]))
+        self.assertTrue(state.is_ended)
+        self.assertEqual("EndPrompt(None)", repr(hrun.StepRunner.present(state)))
+
+    def test_presents_first_text_skipping_instructions(self):
+        state = hrun.StepRunner.start(self.make_document())
+        self.assertEqual("TextPrompt(None,'hello')", repr(hrun.StepRunner.present(state)))
+
+    def test_presents_choices_with_marked_selection(self):
+        self.assertEqual("ChoicePrompt(None,['stay', 'go'],0)", 
+            repr(self.steps(self.make_document(),[None])[-1]))
+
+    def test_falls_through_to_next_block(self):
+        self.assertEqual("ChoicePrompt(None,['end'],None)", 
+            repr(self.steps(self.make_document(),[None,0])[-1]))
+
+    def test_presents_response_then_goes_to_section(self):
+        self.assertEqual(["TextPrompt(None,'Off you go')","TextPrompt('Away','far')",
+            "TextPrompt(None,'farther')","EndPrompt(None)"],
+            list(map(repr,self.steps(self.make_document(),[None,1,None,None,None])[2:])))
+
+    def test_presents_heading_of_empty_section_at_end(self):
+        self.assertEqual("EndPrompt('Gone')", 
+            repr(self.steps(self.make_document(),[None,0,0])[-1]))
+
+    def test_records_choice_in_answers(self):
+        d = self.make_document()
+        state = hrun.StepRunner.start(d)
+        state = hrun.StepRunner.advance(state,None)
+        state = hrun.StepRunner.advance(state,1)
+        self.assertEqual(1, state.answers.selected(d.sections[0].items[2]))
+        self.assertEqual("X", d.sections[0].items[2].choices[0].mark)
+
+    def test_starts_from_given_answers(self):
+        d = self.make_document()
+        a = hps.Answers(d)
+        a.select(d.sections[0].items[2],1)
+        state = hrun.StepRunner.advance(hrun.StepRunner.start(d,a),None)
+        self.assertEqual("ChoicePrompt(None,['stay', 'go'],1)", 
+            repr(hrun.StepRunner.present(state)))
+
+    def test_leaves_given_answers_unchanged(self):
+        d = self.make_document()
+        a = hps.Answers(d)
+        state = hrun.StepRunner.start(d,a)
+        state = hrun.StepRunner.advance(state,None)
+        state = hrun.StepRunner.advance(state,0)
+        self.assertIsNone(a.selected(d.sections[0].items[2]))
+        self.assertEqual(0, state.answers.selected(d.sections[0].items[2]))
+
+    def test_answers_of_state_cant_change_it(self):
+        d = self.make_document()
+        state = hrun.StepRunner.advance(hrun.StepRunner.start(d),None)
+        state.answers.select(d.sections[0].items[2],1)
+        self.assertIsNone(state.answers.selected(d.sections[0].items[2]))
+
+    def test_advance_leaves_state_unchanged(self):
+        state = hrun.StepRunner.start(self.make_document())
+        hrun.StepRunner.advance(state,None)
+        self.assertEqual("TextPrompt(None,'hello')", repr(hrun.StepRunner.present(state)))
+
+    def test_earlier_state_presents_same_after_answering_again(self):
+        d = self.make_document()
+        s0 = hrun.StepRunner.advance(hrun.StepRunner.start(d),None)
+        s1 = hrun.StepRunner.advance(s0,1)
+        s2 = hrun.StepRunner.advance(s0,0)
+        self.assertEqual("TextPrompt(None,'Off you go')", repr(hrun.StepRunner.present(s1)))
+        self.assertEqual(1, s1.answers.selected(d.sections[0].items[2]))
+        self.assertEqual(0, s2.answers.selected(d.sections[0].items[2]))
+        self.assertEqual("ChoicePrompt(None,['stay', 'go'],0)", 
+            repr(hrun.StepRunner.present(s0)))
+        self.assertEqual("TextPrompt('Away','far')", 
+            repr(hrun.StepRunner.present(hrun.StepRunner.advance(s1,None))))
+
+    def test_advance_throws_valueerror_for_invalid_choice(self):
+        state = hrun.StepRunner.advance(hrun.StepRunner.start(self.make_document()),None)
+        for answer in (None,-1,2,"1",True):
+            with self.assertRaises(ValueError):
+                hrun.StepRunner.advance(state,answer)
+
+    def test_advance_throws_valueerror_at_end(self):
+        state = hrun.StepRunner.start(hps.Document([]))
+        with self.assertRaises(ValueError):
+            hrun.StepRunner.advance(state,None)
+
+    def test_advance_throws_runnererror_for_unknown_goto(self):
+        state = hrun.StepRunner.start(hps.Document([ hps.FirstSection([ 
+            hps.ChoiceBlock([ hps.FirstChoice(None,"foo",None,"bar",None) ],None) ],None) ]))
+        with self.assertRaises(hrun.RunnerError):
+            hrun.StepRunner.advance(state,0)
+
+    def test_save_gives_plain_values(self):
+        state = hrun.StepRunner.start(self.make_document())
+        state = hrun.StepRunner.advance(state,None)
+        state = hrun.StepRunner.advance(state,1)
+        self.assertEqual((0,2,True,False,[1,-1]), hrun.StepRunner.save(state))
+
+    def test_load_restores_saved_state(self):
+        d = self.make_document()
+        state = hrun.StepRunner.start(d)
+        state = hrun.StepRunner.advance(state,None)
+        state = hrun.StepRunner.advance(state,1)
+        state = hrun.StepRunner.advance(state,None)
+        state2 = hrun.StepRunner.load(d,hrun.StepRunner.save(state))
+        self.assertEqual(repr(hrun.StepRunner.present(state)),
+            repr(hrun.StepRunner.present(state2)))
+        self.assertEqual(1, state2.answers.selected(d.sections[0].items[2]))
+        self.assertEqual("TextPrompt(None,'farther')", 
+            repr(hrun.StepRunner.present(hrun.StepRunner.advance(state2,None))))
+
+
 class TestMarkdownIO(unittest.TestCase):
     
     def test_has_extensions(self):
@@ -4252,6 +5987,18 @@ class TestMarkdownIO(unittest.TestCase):
             +"- **[Y] [weh](#yadda)** _meh_\n",
             s.getvalue())
 
+    def test_write_marks_choices_from_answers(self):
+        d = hps.Document([
+                hps.FirstSection([ hps.ChoiceBlock([
+                    hps.Choice("X","foo",None,None,None),
+                    hps.Choice(None,"weh",None,None,None),
+                ],None) ],None) ])
+        a = hps.Answers(d)
+        a.select(d.sections[0].items[0],1)
+        s = io.StringIO()
+        hio.MarkdownIO.write(d,s,a)
+        self.assertEqual("- **[] foo**\n- **[X] weh**\n", s.getvalue())
+
     def test_write_handles_multiple_sections(self):
         s = io.StringIO()
         hio.MarkdownIO.write(hps.Document([
@@ -4308,6 +6055,24 @@ class TestXmlIO(unittest.TestCase):
             '</document>\n', 
             self.strip_text_nodes(s.getvalue()) )
                 
+    def test_write_handles_empty_elements(self):
+        s = io.StringIO()
+        hio.XmlIO.write(hps.Document([
+            hps.FirstSection([ hps.ChoiceBlock([ hps.Choice(None,"",None,None,None) ],None) ],None),
+            hps.Section("foo",[],None) ]), s)
+        self.assertEqual(
+            '<?xml version="1.0" ?>\n'
+            '<document>\n'
+            '    <section>\n'
+            '        <choice>\n'
+            '            <option/>\n'
+            '        </choice>\n'
+            '    </section>\n'
+            '    <section>\n'
+            '        <name>foo</name>\n'
+            '    </section>\n'
+            '</document>\n', s.getvalue())
+
     def test_write_handles_textblock(self):
         s = io.StringIO()
         hio.XmlIO.write(hps.Document([
@@ -4454,6 +6219,33 @@ class TestXmlIO(unittest.TestCase):
             '</document>\n', 
             self.strip_text_nodes(s.getvalue()) )
 
+    def test_write_marks_choices_from_answers(self):
+        d = hps.Document([
+            hps.FirstSection([ hps.ChoiceBlock([
+                hps.Choice("X","foo",None,None,None),
+                hps.Choice(None,"bar",None,None,None)
+            ],None) ],None) ])
+        a = hps.Answers(d)
+        a.select(d.sections[0].items[0],1)
+        s = io.StringIO()
+        hio.XmlIO.write(d,s,a)
+        self.assertEqual(
+            '<?xml version="1.0" ?>\n'
+            '<document>\n'
+            '    <section>\n'
+            '        <choice>\n'
+            '            <option>\n'
+            '                <desc>foo</desc>\n'
+            '            </option>\n'
+            '            <option>\n'
+            '                <mark>X</mark>\n'
+            '                <desc>bar</desc>\n'
+            '            </option>\n'
+            '        </choice>\n'
+            '    </section>\n'
+            '</document>\n', 
+            self.strip_text_nodes(s.getvalue()) )
+
     def test_write_handles_choice_no_response(self):
         s = io.StringIO()
         hio.XmlIO.write(hps.Document([
@@ -5203,7 +6995,7 @@ class TestGuiRunner(unittest.TestCase):
         ]),mockloop=loop,catch=False)
         self.tk.quit.assert_called_once_with()
         
-    def test_writes_selections_to_doc_if_end_reached(self):
+    def test_records_selections_in_answers_if_end_reached(self):
         def loop():
             self.runner.on_change_selection(0)
             self.runner.on_next()
@@ -5217,11 +7009,26 @@ class TestGuiRunner(unittest.TestCase):
                 hps.Choice(None,"up",None,None,None),
                 hps.Choice(None,"down",None,None,None) ],None),
         ],None) ])
-        self.do_run(d,mockloop=loop,catch=False)
-        self.assertEqual("X",d.sections[0].items[0].choices[0].mark)
-        self.assertIsNone(d.sections[0].items[0].choices[1].mark)
-        self.assertIsNone(d.sections[0].items[1].choices[0].mark)
-        self.assertEqual("X",d.sections[0].items[1].choices[1].mark)
+        self.runner = hrun.GuiRunner()
+        self.tk.mainloop.side_effect = loop
+        a = self.runner._run(d,self.tk,self.gui)
+        self.assertEqual(["X",None],a.marks(d.sections[0].items[0]))
+        self.assertEqual([None,"X"],a.marks(d.sections[0].items[1]))
+        self.assertIsNone(d.sections[0].items[0].choices[0].mark)
+        self.assertIsNone(d.sections[0].items[1].choices[1].mark)
+
+    def test_starts_from_selections_in_given_answers(self):
+        d = hps.Document([ hps.FirstSection([
+            hps.ChoiceBlock([
+                hps.Choice("X","left",None,None,None),
+                hps.Choice(None,"right",None,None,None) ],None),
+        ],None) ])
+        a = hps.Answers(d)
+        a.select(d.sections[0].items[0],1)
+        self.runner = hrun.GuiRunner()
+        with self.assertRaises(hrun.RunnerError):
+            self.runner._run(d,self.tk,self.gui,a)
+        self.assertEqual(1,self.gui.on_curr_item_change.call_args[0][0].selected)
 
     def test_throws_error_if_gui_closed_early(self):
         def loop():